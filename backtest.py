@@ -0,0 +1,248 @@
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+from xgboost import XGBRegressor
+
+from config import (
+    logger, setup_logging, FIRST_F1_YEAR, FEATURE_COLS, SESSION_BACKEND,
+    BACKTEST_REFIT_EVERY, BACKTEST_TREES_PER_FOLD
+)
+from data_loader import load_or_build_comprehensive_data
+from materialize import training_rows
+from model import build_training_frame
+from model_cache import load_model_params
+from preprocessing import impute
+from profiling import stage, add_profile_arguments, start_profile, finish_profile
+from simulation import fit_error_model, save_error_model
+from schedule import load_schedule_cache
+from utils import suppress_warnings
+
+def order_events(combined_data, schedule_cache=None):
+    """Return the (Year, CircuitName) events of a frame in chronological order.
+
+    Rounds come from the frame's RoundNumber column; the cached season
+    schedules are only consulted for events whose round is unknown (0).
+    Events with no round from either source cannot be placed and are dropped
+    with a warning, so they never leak into an earlier fold's training set.
+    """
+    events = combined_data[['Year', 'CircuitName']].astype({'CircuitName': str})
+    if 'RoundNumber' in combined_data.columns:
+        events['Round'] = pd.to_numeric(combined_data['RoundNumber'], errors='coerce').fillna(0).to_numpy()
+    else:
+        events['Round'] = 0
+    events = events.groupby(['Year', 'CircuitName'], as_index=False, sort=False)['Round'].max()
+
+    unknown = events['Round'] <= 0
+    if unknown.any():
+        if schedule_cache is None:
+            schedule_cache = load_schedule_cache()
+        rounds = {
+            (int(year), event['name']): event['round']
+            for year, season in schedule_cache['seasons'].items()
+            for event in season['events']
+        }
+        events.loc[unknown, 'Round'] = [
+            rounds.get((int(year), name), 0)
+            for year, name in zip(events.loc[unknown, 'Year'], events.loc[unknown, 'CircuitName'])
+        ]
+
+    unordered = events['Round'] <= 0
+    for year, name in zip(events.loc[unordered, 'Year'], events.loc[unordered, 'CircuitName']):
+        logger.warning(f"Skipping {year} {name}: no round number in the dataset or the schedule cache")
+    events = events[~unordered]
+    return events.sort_values(['Year', 'Round', 'CircuitName']).reset_index(drop=True)
+
+def score_event(predicted, actual_lap_times, finish_positions):
+    """Compare a predicted order with the actual result of one race.
+
+    The actual order uses classified finishing positions when the dataset has
+    them, and mean race lap time otherwise.
+    """
+    if np.isnan(finish_positions).all():
+        actual_order = np.argsort(actual_lap_times, kind='stable')
+    else:
+        actual_order = np.argsort(np.nan_to_num(finish_positions, nan=np.inf), kind='stable')
+    predicted_order = np.argsort(predicted, kind='stable')
+
+    n_top3 = min(3, len(actual_order))
+    n_top10 = min(10, len(actual_order))
+    return {
+        'Top1': float(predicted_order[0] == actual_order[0]),
+        'Top3': len(set(predicted_order[:n_top3]) & set(actual_order[:n_top3])) / n_top3,
+        'Top10': float(np.mean(predicted_order[:n_top10] == actual_order[:n_top10])),
+        'MAE': float(np.mean(np.abs(predicted - actual_lap_times))),
+    }
+
+def run_backtest(race_data, quali_data, start_year=None, warm_start=True,
+                 refit_every=BACKTEST_REFIT_EVERY, trees_per_fold=BACKTEST_TREES_PER_FOLD, return_residuals=False):
+    """Replay races in order, training each fold only on events before it.
+
+    The merged, feature-engineered frame and its feature matrix are built once and
+    sliced per fold; each fold is preprocessed like production training
+    (materialize.training_rows), with imputation fitted on its training rows
+    only. With `warm_start`, a fold continues boosting the previous
+    fold's model with `trees_per_fold` extra trees on the grown training set, and a
+    full refit happens every `refit_every` folds. With `return_residuals`, returns
+    (report, residuals) where residuals holds each driver's actual minus
+    predicted mean lap time in every evaluated race.
+    """
+    if start_year is None:
+        start_year = FIRST_F1_YEAR + 1
+
+    with stage("model.merge"):
+        combined_data = build_training_frame(race_data, quali_data)
+    if combined_data.empty:
+        logger.error("No matching data after merging race and qualifying information!")
+        return (None, None) if return_residuals else None
+
+    events = order_events(combined_data)
+    event_keys = set(zip(events['Year'].astype(int), events['CircuitName']))
+    ordered = np.array([(int(year), str(name)) in event_keys
+                        for year, name in zip(combined_data['Year'], combined_data['CircuitName'])], dtype=bool)
+    if not ordered.all():
+        combined_data = combined_data[ordered].reset_index(drop=True)
+    event_index = {(int(year), name): i for i, (year, name) in enumerate(zip(events['Year'], events['CircuitName']))}
+    row_event = np.array([
+        event_index[(int(year), str(name))]
+        for year, name in zip(combined_data['Year'], combined_data['CircuitName'])
+    ])
+
+    feature_cols = [col for col in FEATURE_COLS if col in combined_data.columns]
+    X = combined_data[feature_cols].to_numpy(dtype=np.float32, na_value=np.nan)
+    y = combined_data['LapTime (s)_mean'].to_numpy(dtype=np.float32)
+    if 'FinishPosition' in combined_data.columns:
+        finish_positions = combined_data['FinishPosition'].to_numpy(dtype=np.float64)
+    else:
+        logger.warning("Dataset has no FinishPosition column; ranking races by mean lap time instead")
+        finish_positions = np.full(len(combined_data), np.nan)
+
+    params = load_model_params()
+    folds = []
+    residual_rows = []
+    model = None
+    folds_since_refit = 0
+    for i, (year, circuit_name) in enumerate(zip(events['Year'], events['CircuitName'])):
+        train_mask = row_event < i
+        if year < start_year or not train_mask.any():
+            continue
+        test_mask = row_event == i
+
+        # Preprocess like production training, with the imputation fitted on this fold's training rows only
+        X_train, y_train, preprocessor = training_rows({'X': X[train_mask], 'y': y[train_mask], 'features': feature_cols})
+        X_test = impute(X[test_mask], preprocessor)
+
+        # Train, either from scratch or by adding trees to the previous fold's booster
+        start = time.perf_counter()
+        refit = not warm_start or model is None or folds_since_refit >= refit_every
+        if refit:
+            model = XGBRegressor(**params)
+            with stage("model.fit"):
+                model.fit(X_train, y_train)
+            folds_since_refit = 0
+        else:
+            previous_booster = model.get_booster()
+            model = XGBRegressor(**{**params, 'n_estimators': trees_per_fold})
+            with stage("model.fit_warm"):
+                model.fit(X_train, y_train, xgb_model=previous_booster)
+            folds_since_refit += 1
+        train_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with stage("model.predict"):
+            predicted = model.predict(X_test)
+        predict_seconds = time.perf_counter() - start
+
+        fold = {
+            'Year': int(year),
+            'CircuitName': circuit_name,
+            'TrainRows': int(train_mask.sum()),
+            'Drivers': int(test_mask.sum()),
+            'Refit': refit,
+        }
+        fold.update(score_event(predicted, y[test_mask], finish_positions[test_mask]))
+        fold.update({'TrainSeconds': train_seconds, 'PredictSeconds': predict_seconds})
+        folds.append(fold)
+        if return_residuals:
+            residual_rows.append(pd.DataFrame({
+                'FullName': combined_data['FullName'].to_numpy()[test_mask],
+                'Year': int(year),
+                'CircuitName': circuit_name,
+                'Residual': y[test_mask] - predicted,
+            }))
+
+    report = pd.DataFrame(folds)
+    if report.empty:
+        logger.warning(f"No events from {start_year} onwards had earlier data to train on")
+    else:
+        logger.info(
+            f"Backtest over {len(report)} races: top-1 {report['Top1'].mean():.1%}, "
+            f"top-3 {report['Top3'].mean():.1%}, top-10 {report['Top10'].mean():.1%}, "
+            f"MAE {report['MAE'].mean():.3f}s, training {report['TrainSeconds'].sum():.1f}s total"
+        )
+    if return_residuals:
+        residuals = pd.concat(residual_rows, ignore_index=True) if residual_rows else pd.DataFrame(
+            columns=['FullName', 'Year', 'CircuitName', 'Residual'])
+        return report, residuals
+    return report
+
+def save_report(report, output_prefix, settings):
+    """Write the per-fold report as CSV and a summary plus folds as JSON."""
+    report.to_csv(f"{output_prefix}.csv", index=False)
+
+    metrics = ['Top1', 'Top3', 'Top10', 'MAE']
+    summary = {
+        'settings': settings,
+        'folds': len(report),
+        'mean': {metric: float(report[metric].mean()) for metric in metrics} if not report.empty else {},
+        'train_seconds_total': float(report['TrainSeconds'].sum()) if not report.empty else 0.0,
+        'predict_seconds_total': float(report['PredictSeconds'].sum()) if not report.empty else 0.0,
+        'per_fold': report.to_dict(orient='records'),
+    }
+    with open(f"{output_prefix}.json", "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=1, default=str)
+    logger.info(f"Backtest report saved to {output_prefix}.csv and {output_prefix}.json")
+
+def main():
+    parser = argparse.ArgumentParser(description="Walk-forward backtest of the race prediction model.")
+    parser.add_argument('--start-year', type=int, default=None, help="first season to evaluate (default: second available season)")
+    parser.add_argument('--no-warm-start', action='store_true', help="retrain from scratch for every race")
+    parser.add_argument('--refit-every', type=int, default=BACKTEST_REFIT_EVERY, help="races between full refits when warm-starting")
+    parser.add_argument('--trees-per-fold', type=int, default=BACKTEST_TREES_PER_FOLD, help="trees added per warm-started race")
+    parser.add_argument('--output', default="backtest_report", help="report path without extension")
+    parser.add_argument('--backend', default=SESSION_BACKEND, help="session backend used if the dataset must be built")
+    parser.add_argument('--save-error-model', action='store_true',
+                        help="fit the per-driver error model used by race simulations from the backtest residuals")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    setup_logging()
+    suppress_warnings()
+    start_profile(args)
+    try:
+        race_data, quali_data = load_or_build_comprehensive_data(backend=args.backend)
+        if race_data is None or quali_data is None:
+            logger.error("Failed to get historical data. Exiting.")
+            return
+
+        report, residuals = run_backtest(race_data, quali_data, start_year=args.start_year,
+                                         warm_start=not args.no_warm_start, refit_every=args.refit_every,
+                                         trees_per_fold=args.trees_per_fold, return_residuals=True)
+        if args.save_error_model and residuals is not None and not residuals.empty:
+            save_error_model(fit_error_model(residuals),
+                             description=f"backtest residuals from {residuals['Year'].min()} onwards")
+            logger.info(f"Saved error model fitted on {len(residuals)} backtest residuals")
+        if report is not None:
+            with stage("report.save"):
+                save_report(report, args.output, {
+                    'start_year': args.start_year,
+                    'warm_start': not args.no_warm_start,
+                    'refit_every': args.refit_every,
+                    'trees_per_fold': args.trees_per_fold,
+                })
+    finally:
+        finish_profile(args)
+
+if __name__ == "__main__":
+    main()
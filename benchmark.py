@@ -0,0 +1,585 @@
+import argparse
+import importlib
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from config import (
+    logger, setup_logging, GRAND_PRIX_NAMES, FIRST_F1_YEAR, CURRENT_YEAR, FEATURE_COLS, MODEL_PARAMS, DATASET_DIR,
+    STARTUP_IMPORT_BUDGET_MS, STARTUP_FORBIDDEN_MODULES, BENCHMARK_SCALE, BENCHMARK_FIRST_YEAR,
+    BENCHMARK_BASELINES_PATH, BENCHMARK_TOLERANCE, BENCHMARK_NOISE_SECONDS, BENCHMARK_NOISE_BYTES,
+    BUILD_CHECK_WORKERS, BUILD_CHECK_TIMEOUT_SECONDS, FETCH_MAX_CONCURRENCY
+)
+from data_loader import get_race_data, load_session, session_load_options, session_memory_bytes
+from data_processor import preprocess_race_data, preprocess_quali_data, lap_pace_features
+from schema import SCHEMAS, RACE_SCHEMA, QUALI_SCHEMA, apply_schema, concat_frames, frame_memory_bytes
+from feature_engineering import (
+    CIRCUIT_FEATURE_COLS, extract_circuit_features, enhance_data_with_circuit_features, add_prior_race_features
+)
+from form_store import add_form_features
+from dataset_index import VOCABULARIES, extend_dataset_index, add_surrogate_keys
+from model import build_training_frame, train_comprehensive_model, fit_model, predict_race_winner
+from materialize import TARGET_COL, training_rows
+from simulation import finishing_position_counts
+from utils import suppress_warnings
+import synthetic
+
+def time_call(func, *args, repeat=3):
+    """Return the best wall-clock time of `repeat` calls."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def make_circuit_frame(n_rows, seed=42):
+    """Build a frame with a CircuitName column drawn from the known Grand Prix names."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'CircuitName': rng.choice(GRAND_PRIX_NAMES, n_rows)})
+
+def _row_wise_circuit_features(data):
+    """Reference implementation: one extract_circuit_features call per row and flag."""
+    for feature_name in CIRCUIT_FEATURE_COLS:
+        data[feature_name] = data['CircuitName'].apply(
+            lambda x: extract_circuit_features(x)[feature_name]
+        )
+    return data
+
+def bench_circuit_features(sizes=(10_000, 100_000, 1_000_000), reference_limit=100_000):
+    """Compare row-wise and memoized circuit feature extraction across frame sizes."""
+    logger.info("Circuit features: rows | row-wise (s) | vectorized (s) | speed-up")
+    for n_rows in sizes:
+        data = make_circuit_frame(n_rows)
+        vectorized = time_call(enhance_data_with_circuit_features, data.copy())
+
+        # The row-wise path is too slow to time repeatedly on the largest frames
+        if n_rows <= reference_limit:
+            row_wise = time_call(_row_wise_circuit_features, data.copy(), repeat=1)
+            expected = _row_wise_circuit_features(data.copy())
+            actual = enhance_data_with_circuit_features(data.copy())
+            pd.testing.assert_frame_equal(actual, expected)
+            logger.info(f"{n_rows:>10,} | {row_wise:12.3f} | {vectorized:14.4f} | {row_wise / vectorized:7.0f}x")
+        else:
+            logger.info(f"{n_rows:>10,} | {'-':>12} | {vectorized:14.4f} |")
+
+def bench_session_load(backend="synthetic", events=None):
+    """Report the time and bytes saved per session by selective loading versus a full load."""
+    if events is None:
+        events = [(2024, grand_prix) for grand_prix in synthetic.get_season_calendar(2024)[:3]]
+    module = importlib.import_module(backend)
+
+    logger.info("Session load: session | full (s) | selective (s) | saved (s) | full (MB) | selective (MB) | saved (MB)")
+    for year, grand_prix in events:
+        for session_type in ("R", "Q"):
+            session = module.get_session(year, grand_prix, session_type)
+            full_seconds = time_call(session.load, repeat=1)
+            full_bytes = session_memory_bytes(session)
+
+            session = module.get_session(year, grand_prix, session_type)
+            options = session_load_options(session_type)
+            selective_seconds = time_call(lambda: session.load(**options), repeat=1)
+            selective_bytes = session_memory_bytes(session)
+
+            logger.info(
+                f"{year} {grand_prix} {session_type} | {full_seconds:.2f} | {selective_seconds:.2f} | "
+                f"{full_seconds - selective_seconds:.2f} | {full_bytes / 1e6:.1f} | {selective_bytes / 1e6:.1f} | "
+                f"{(full_bytes - selective_bytes) / 1e6:.1f}"
+            )
+
+def _frame_race_summary(session):
+    """Reference implementation: broadcast metadata to every lap, then merge and group."""
+    laps = session.laps.copy()
+    laps['Year'] = session.event.year
+    laps['CircuitName'] = session.event.name
+    for col in ['AirTemp', 'TrackTemp', 'Humidity']:
+        laps[col] = session.weather_data[col].mean()
+    valid_laps = laps.dropna(subset=['LapTime']).copy()
+    valid_laps['LapTime (s)'] = valid_laps['LapTime'].dt.total_seconds()
+    drivers = session.results[['DriverNumber', 'FullName', 'TeamName', 'Position']].rename(columns={'Position': 'FinishPosition'})
+    merged_data = pd.merge(valid_laps, drivers, on="DriverNumber", how="left")
+    summary = merged_data.groupby(['FullName', 'TeamName', 'Year', 'CircuitName']).agg({
+        'LapTime (s)': ['mean', 'min', 'std'], 'AirTemp': 'mean', 'TrackTemp': 'mean',
+        'Humidity': 'mean', 'FinishPosition': 'first'
+    }).reset_index()
+    summary.columns = ['_'.join(col).strip('_') for col in summary.columns]
+    return summary.rename(columns={'FinishPosition_first': 'FinishPosition'})
+
+def bench_race_summary(lap_counts=(57, 570, 5700)):
+    """Compare time and peak memory of summarizing a race session per lap frame versus streaming."""
+    logger.info("Race summary: laps | frame (s) | streaming (s) | frame peak (MB) | streaming peak (MB)")
+    for n_laps in lap_counts:
+        session = synthetic.FakeSession(2024, "Dutch Grand Prix", "R", n_laps=n_laps)
+        session.load(telemetry=False, messages=False)
+        n_rows = len(session.laps)
+
+        expected, frame_peak = peak_memory(_frame_race_summary, session)
+        actual, streaming_peak = peak_memory(preprocess_race_data, session)
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False, check_like=True)
+        frame_seconds = time_call(_frame_race_summary, session)
+        streaming_seconds = time_call(preprocess_race_data, session)
+        logger.info(
+            f"{n_rows:>8,} | {frame_seconds:.4f} | {streaming_seconds:.4f} | "
+            f"{frame_peak / 1e6:.2f} | {streaming_peak / 1e6:.2f}"
+        )
+
+def bench_lap_features(driver_counts=(20, 200, 2000, 20000)):
+    """Time the race pace feature stage as the lap table grows; time per lap should stay flat.
+
+    The table grows by adding drivers to a normal-length race, so every lap stays
+    representative of real sessions.
+    """
+    logger.info("Lap features: laps | time (s) | per lap (us)")
+    for n_drivers in driver_counts:
+        session = synthetic.FakeSession(2024, "Dutch Grand Prix", "R", n_drivers=n_drivers)
+        session.load(telemetry=False, messages=False)
+        laps = session.laps
+        codes = pd.Index(session.results['DriverNumber']).get_indexer(laps['DriverNumber'])
+        seconds = time_call(lap_pace_features, laps, codes, len(session.results))
+        logger.info(f"{len(laps):>10,} | {seconds:.4f} | {1e6 * seconds / len(laps):.2f}")
+
+def _loop_position_counts(predicted, sigma, n_draws, rng):
+    """Reference implementation: one simulated race per Python loop iteration."""
+    n_drivers = len(predicted)
+    counts = np.zeros((n_drivers, n_drivers), dtype=np.int64)
+    for _ in range(n_draws):
+        order = np.argsort(predicted + sigma * rng.standard_normal(n_drivers))
+        for position, driver in enumerate(order):
+            counts[driver, position] += 1
+    return counts
+
+def bench_simulation(draw_counts=(10_000, 100_000, 1_000_000), reference_limit=100_000, n_drivers=20):
+    """Compare per-draw and vectorized race simulation, and the memory of chunked large draw counts."""
+    rng = np.random.default_rng(42)
+    predicted = np.sort(rng.normal(90.0, 0.6, n_drivers))
+    sigma = np.full(n_drivers, 0.6)
+
+    logger.info("Simulation: draws | loop (s) | vectorized (s) | speed-up | peak (MB)")
+    for n_draws in draw_counts:
+        vectorized = time_call(finishing_position_counts, predicted, sigma, n_draws, np.random.default_rng(0))
+        counts, peak = peak_memory(finishing_position_counts, predicted, sigma, n_draws, np.random.default_rng(0))
+        assert (counts.sum(axis=0) == n_draws).all() and (counts.sum(axis=1) == n_draws).all()
+        if n_draws <= reference_limit:
+            loop = time_call(_loop_position_counts, predicted, sigma, n_draws, np.random.default_rng(0), repeat=1)
+            logger.info(f"{n_draws:>10,} | {loop:8.2f} | {vectorized:14.4f} | {loop / vectorized:7.0f}x | {peak / 1e6:8.1f}")
+        else:
+            logger.info(f"{n_draws:>10,} | {'-':>8} | {vectorized:14.4f} | {'-':>8} | {peak / 1e6:8.1f}")
+
+def peak_memory(func, *args):
+    """Run a function under tracemalloc and return (result, peak traced bytes)."""
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+def _collect_dataset(kind, seasons, backend, compact):
+    """Preprocess every event of the seasons into one table, optionally applying the schema per event."""
+    session_type, preprocess = {"race": ("R", preprocess_race_data), "quali": ("Q", preprocess_quali_data)}[kind]
+    frames = []
+    for year in seasons:
+        for grand_prix in synthetic.get_season_calendar(year):
+            session = get_race_data(year, grand_prix, session_type, backend)
+            data = preprocess(session) if session is not None else None
+            if data is None:
+                continue
+            data = enhance_data_with_circuit_features(data)
+            frames.append(apply_schema(data, SCHEMAS[kind]) if compact else data)
+    if compact:
+        return concat_frames(frames, SCHEMAS[kind])
+    return pd.concat(frames, ignore_index=True)
+
+def bench_memory(backend="synthetic", seasons=None):
+    """Compare peak and final memory of building the full dataset with and without the compact schema."""
+    if seasons is None:
+        seasons = range(FIRST_F1_YEAR, CURRENT_YEAR + 1)
+
+    logger.info("Memory: table | rows | before (MB) | after (MB) | peak before (MB) | peak after (MB)")
+    for kind in ("race", "quali"):
+        before, peak_before = peak_memory(_collect_dataset, kind, seasons, backend, False)
+        after, peak_after = peak_memory(_collect_dataset, kind, seasons, backend, True)
+        logger.info(
+            f"{kind:>5} | {len(after):,} | {frame_memory_bytes(before) / 1e6:.2f} | {frame_memory_bytes(after) / 1e6:.2f} | "
+            f"{peak_before / 1e6:.2f} | {peak_after / 1e6:.2f}"
+        )
+
+def measure_imports(module="main"):
+    """Import a module in a fresh interpreter and return its -X importtime records.
+
+    Each record is (module name, cumulative microseconds); the last one is the
+    requested module itself.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+    )
+    records = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        records.append((name.strip(), int(cumulative)))
+    return records
+
+def bench_startup(module="main", budget_ms=STARTUP_IMPORT_BUDGET_MS, top=10):
+    """Check the import time of the entry point against its budget and forbidden modules."""
+    records = measure_imports(module)
+    total_ms = records[-1][1] / 1000
+    top_level = {}
+    for name, cumulative in records:
+        root = name.split('.')[0]
+        top_level[root] = max(top_level.get(root, 0), cumulative)
+
+    logger.info(f"Startup: import {module} took {total_ms:.0f} ms (budget {budget_ms} ms)")
+    for name, cumulative in sorted(top_level.items(), key=lambda item: -item[1])[:top]:
+        logger.info(f"{name:>24} | {cumulative / 1000:8.1f} ms")
+
+    loaded = sorted({name.split('.')[0] for name, _ in records} & set(STARTUP_FORBIDDEN_MODULES))
+    if loaded:
+        logger.error(f"Startup imports modules that should load lazily: {', '.join(loaded)}")
+    if total_ms > budget_ms:
+        logger.error(f"Startup import time {total_ms:.0f} ms exceeds the {budget_ms} ms budget")
+    if loaded or total_ms > budget_ms:
+        raise SystemExit(1)
+
+def _write_matrix(matrix_path, circuit, X, y, years):
+    os.makedirs(matrix_path)
+    np.save(os.path.join(matrix_path, "X.npy"), X)
+    np.save(os.path.join(matrix_path, "y.npy"), y)
+    np.save(os.path.join(matrix_path, "years.npy"), years)
+    with open(os.path.join(matrix_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({'circuit': circuit, 'features': FEATURE_COLS, 'sources': {}}, f)
+
+def _write_training_matrices(directory, n_rows, n_matrices, seed=42):
+    """Write synthetic stored matrices with FEATURE_COLS columns and a noisy linear target.
+
+    Like materialization, writes one matrix per circuit plus one of all their
+    rows; returns (circuit directories, all-circuits directory).
+    """
+    rng = np.random.default_rng(seed)
+    weights = rng.normal(0.0, 1.0, len(FEATURE_COLS))
+    directories = []
+    parts = []
+    for number in range(n_matrices):
+        rows = n_rows // n_matrices
+        X = rng.normal(0.0, 1.0, (rows, len(FEATURE_COLS))).astype(np.float32)
+        X[rng.random(X.shape) < 0.01] = np.nan
+        y = (90 + np.nan_to_num(X) @ weights + rng.normal(0, 0.5, rows)).astype(np.float32)
+        years = rng.integers(2018, 2026, rows).astype(np.int16)
+        matrix_path = os.path.join(directory, f"circuit{number:03d}")
+        _write_matrix(matrix_path, f"Circuit {number}", X, y, years)
+        directories.append(matrix_path)
+        parts.append((X, y, years))
+    all_path = os.path.join(directory, "_all")
+    _write_matrix(all_path, None, *(np.concatenate(arrays) for arrays in zip(*parts)))
+    return directories, all_path
+
+def training_run(mode, directories, all_directory, rounds):
+    """Train once in the current process and print its fit time and peak RSS as JSON (run by bench_training)."""
+    import resource
+    from materialize import load_matrix_dir
+    from stream_training import train_streaming
+
+    params = {**MODEL_PARAMS, 'n_estimators': rounds}
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if mode == "matrix":
+        # The in-memory path of get_or_train_matrix_model: the memory-mapped all-circuits matrix
+        _train_matrix(load_matrix_dir(all_directory), params)
+    else:
+        train_streaming(directories, params=params, external_memory=(mode == "external"))
+    seconds = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'seconds': seconds, 'peak_rss_kb': rss_after, 'rss_growth_kb': rss_after - rss_before}))
+
+def bench_training(n_rows=1_000_000, n_matrices=20, rounds=50, modes=("matrix", "quantile", "external")):
+    """Compare fit time and peak RSS of in-memory, streaming quantile and external-memory training.
+
+    Each mode trains in a fresh interpreter so its peak RSS is its own.
+    """
+    logger.info(f"Training: {n_rows:,} rows in {n_matrices} matrices, {rounds} rounds")
+    logger.info("Training: mode | fit (s) | peak RSS (MB) | RSS growth (MB)")
+    with tempfile.TemporaryDirectory(prefix="bench-matrices-", dir=".") as directory:
+        directories, all_directory = _write_training_matrices(directory, n_rows, n_matrices)
+        for mode in modes:
+            command = f"import benchmark; benchmark.training_run({mode!r}, {directories!r}, {all_directory!r}, {rounds})"
+            result = subprocess.run(
+                [sys.executable, "-c", command],
+                cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+            )
+            run = json.loads(result.stdout.strip().splitlines()[-1])
+            logger.info(f"{mode:>9} | {run['seconds']:7.2f} | {run['peak_rss_kb'] / 1024:13.0f} | {run['rss_growth_kb'] / 1024:15.0f}")
+
+def _ingest_sessions(events, n_drivers, n_laps):
+    """Load the race and qualifying session of every event through the fetch scheduler, as ingestion does."""
+    with synthetic.session_size(n_drivers, n_laps):
+        return [
+            tuple(load_session(year, grand_prix, session_type, backend="synthetic") for session_type in ("R", "Q"))
+            for year, grand_prix in events
+        ]
+
+def _preprocess_sessions(sessions):
+    return [(preprocess_race_data(race), preprocess_quali_data(quali)) for race, quali in sessions]
+
+def _engineer_features(summaries):
+    """Circuit features, compact schema, surrogate keys, prior-race and form features."""
+    race_data = concat_frames([
+        apply_schema(enhance_data_with_circuit_features(race.copy()), RACE_SCHEMA) for race, _ in summaries
+    ], RACE_SCHEMA)
+    quali_data = concat_frames([
+        apply_schema(enhance_data_with_circuit_features(quali.copy()), QUALI_SCHEMA) for _, quali in summaries
+    ], QUALI_SCHEMA)
+    index = {vocabulary: [] for vocabulary in VOCABULARIES.values()}
+    extend_dataset_index(index, [race_data, quali_data])
+    race_data = add_surrogate_keys(race_data, index)
+    quali_data = add_surrogate_keys(quali_data, index)
+    race_data = add_prior_race_features(race_data, race_data)
+    race_data = add_form_features(race_data, race_data)
+    return race_data, quali_data
+
+def _training_matrix(combined_data):
+    """In-memory equivalent of a materialized training matrix."""
+    features = [col for col in FEATURE_COLS if col in combined_data.columns]
+    return {
+        'X': combined_data[features].to_numpy(dtype=np.float32),
+        'y': combined_data[TARGET_COL].to_numpy(dtype=np.float32),
+        'years': combined_data['Year'].to_numpy(dtype=np.int16),
+        'features': features,
+    }
+
+def _train_frame(race_data, quali_data):
+    """Train through the frame path used on the in-memory dataset."""
+    return train_comprehensive_model(race_data, quali_data, params=MODEL_PARAMS)
+
+def _train_matrix(matrix, params=MODEL_PARAMS):
+    """Train a stored training matrix as get_or_train_matrix_model does on a cache miss."""
+    X, y, preprocessor = training_rows(matrix)
+    return fit_model(pd.DataFrame(X, columns=matrix['features'], copy=False), y, params, preprocessor)
+
+def _quietly(func):
+    """Wrap a function so its INFO logs do not interleave with the benchmark table."""
+    def call(*args):
+        level = logger.level
+        logger.setLevel(max(level, logging.WARNING))
+        try:
+            return func(*args)
+        finally:
+            logger.setLevel(level)
+    return call
+
+def scale_key(scale):
+    """Baseline key of a benchmark scale, e.g. "2x8x20x57" (seasons x events x drivers x laps)."""
+    return "x".join(str(scale[name]) for name in ('seasons', 'events', 'drivers', 'laps'))
+
+def load_baselines(path=BENCHMARK_BASELINES_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_baselines(baselines, path=BENCHMARK_BASELINES_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baselines, f, indent=1, sort_keys=True)
+        f.write("\n")
+
+def find_regressions(results, baseline, tolerance=BENCHMARK_TOLERANCE, noise_seconds=BENCHMARK_NOISE_SECONDS,
+                     noise_bytes=BENCHMARK_NOISE_BYTES):
+    """Compare stage results with a baseline and describe each stage that got slower or bigger."""
+    regressions = []
+    for stage_name, result in results.items():
+        expected = baseline.get(stage_name)
+        if expected is None:
+            continue
+        slower = result['seconds'] - expected['seconds']
+        if result['seconds'] > expected['seconds'] * (1 + tolerance) and slower > noise_seconds:
+            regressions.append(f"{stage_name} took {result['seconds']:.3f}s (baseline {expected['seconds']:.3f}s)")
+        bigger = result['peak_bytes'] - expected['peak_bytes']
+        if result['peak_bytes'] > expected['peak_bytes'] * (1 + tolerance) and bigger > noise_bytes:
+            regressions.append(f"{stage_name} peaked at {result['peak_bytes'] / 1e6:.2f} MB "
+                               f"(baseline {expected['peak_bytes'] / 1e6:.2f} MB)")
+    return regressions
+
+def bench_pipeline(scale=None, repeat=3, save_baseline=False, tolerance=BENCHMARK_TOLERANCE):
+    """Time every pipeline stage on synthetic sessions and check the results against stored baselines.
+
+    Each stage reports its best time over `repeat` runs, throughput, and peak
+    traced memory from one extra run (allocations made inside XGBoost are not
+    traced). Baselines are stored per scale; a stage slower or bigger than its
+    baseline by more than `tolerance` fails the run.
+    """
+    scale = {**BENCHMARK_SCALE, **(scale or {})}
+    events = synthetic.session_grid(BENCHMARK_FIRST_YEAR, scale['seasons'], scale['events'])
+    n_drivers, n_laps = scale['drivers'], scale['laps']
+    logger.info(f"Pipeline at scale {scale_key(scale)} (seasons x events x drivers x laps): "
+                f"{len(events)} events, {len(events) * n_drivers * n_laps:,} race laps")
+
+    sessions = _quietly(_ingest_sessions)(events, n_drivers, n_laps)
+    n_laps_total = sum(len(race.laps) for race, _ in sessions)
+    summaries = _preprocess_sessions(sessions)
+    race_data, quali_data = _engineer_features(summaries)
+    combined_data = build_training_frame(race_data, quali_data)
+    matrix = _training_matrix(combined_data)
+    model = _quietly(_train_matrix)(matrix)
+
+    # (stage, function, arguments, items processed, unit of the items)
+    stages = [
+        ('ingestion', _ingest_sessions, (events, n_drivers, n_laps), n_laps_total, 'laps'),
+        ('preprocessing', _preprocess_sessions, (sessions,), n_laps_total, 'laps'),
+        ('features', _engineer_features, (summaries,), len(race_data) + len(quali_data), 'rows'),
+        ('merge', build_training_frame, (race_data, quali_data), len(combined_data), 'rows'),
+        ('training', _train_frame, (race_data, quali_data), len(combined_data), 'rows'),
+        ('matrix-training', _train_matrix, (matrix,), len(combined_data), 'rows'),
+        ('prediction', predict_race_winner, (model, quali_data.copy()), len(quali_data), 'rows'),
+    ]
+    results = {}
+    logger.info("Pipeline: stage | time (s) | throughput | peak (MB)")
+    for stage_name, func, args, n_items, unit in stages:
+        seconds = time_call(_quietly(func), *args, repeat=repeat)
+        _, peak = peak_memory(_quietly(func), *args)
+        results[stage_name] = {'seconds': seconds, 'peak_bytes': peak, 'items': n_items}
+        logger.info(f"{stage_name:>15} | {seconds:8.3f} | {n_items / seconds:12,.0f} {unit}/s | {peak / 1e6:8.2f}")
+
+    baselines = load_baselines()
+    key = scale_key(scale)
+    if save_baseline:
+        baselines[key] = results
+        save_baselines(baselines)
+        logger.info(f"Saved baseline for scale {key} to {BENCHMARK_BASELINES_PATH}")
+        return
+    if key not in baselines:
+        logger.warning(f"No baseline for scale {key}; record one with --save-baseline")
+        return
+    regressions = find_regressions(results, baselines[key], tolerance)
+    for regression in regressions:
+        logger.error(f"Regression: {regression}")
+    if regressions:
+        raise SystemExit(1)
+    logger.info(f"All stages within {tolerance:.0%} of the baseline for scale {key}")
+
+def build_run(builds, backend):
+    """Build the dataset store once per (directory, workers) and print the build times as JSON (run by bench_build).
+
+    FETCH_MAX_CONCURRENCY sessions are loaded through the fetch scheduler
+    first, so build worker processes fork from a parent whose scheduler has
+    all its threads running, as after main.py prefetches races before building.
+    """
+    from data_loader import build_comprehensive_data, prefetch_session
+
+    grands_prix = synthetic.get_season_calendar(FIRST_F1_YEAR)[:FETCH_MAX_CONCURRENCY]
+    for future in [prefetch_session(FIRST_F1_YEAR, grand_prix, "Q", backend) for grand_prix in grands_prix]:
+        future.result()
+    seconds = []
+    for directory, workers in builds:
+        os.chdir(directory)
+        start = time.perf_counter()
+        if not build_comprehensive_data(workers=workers, backend=backend):
+            raise SystemExit(f"Build with {workers} worker(s) collected no data")
+        seconds.append(time.perf_counter() - start)
+    print(json.dumps(seconds))
+
+def store_differences(first, second):
+    """Describe how the dataset stores under two working directories differ (files, partition rows and order)."""
+    def files(root):
+        store = os.path.join(root, DATASET_DIR)
+        return {os.path.relpath(os.path.join(path, name), store)
+                for path, _, names in os.walk(store) for name in names}
+
+    first_files, second_files = files(first), files(second)
+    differences = [f"{name} only in one store" for name in sorted(first_files ^ second_files)]
+    for name in sorted(first_files & second_files):
+        paths = [os.path.join(root, DATASET_DIR, name) for root in (first, second)]
+        if name.endswith(".parquet"):
+            same = pd.read_parquet(paths[0]).equals(pd.read_parquet(paths[1]))
+        else:
+            with open(paths[0], "rb") as f, open(paths[1], "rb") as g:
+                same = f.read() == g.read()
+        if not same:
+            differences.append(f"{name} differs")
+    return differences
+
+def bench_build(workers=BUILD_CHECK_WORKERS, backend="synthetic", timeout=BUILD_CHECK_TIMEOUT_SECONDS):
+    """Build the dataset store serially and with `workers` processes on an offline backend and compare them.
+
+    Both builds run, one after the other, in one fresh interpreter, so a hung
+    parallel build is reported instead of blocking the benchmark run. The run
+    fails when the builds do not finish within `timeout` or do not write the
+    same partitions with the same rows in the same order.
+    """
+    with tempfile.TemporaryDirectory(prefix="bench-build-") as directory:
+        serial, parallel = os.path.join(directory, "serial"), os.path.join(directory, "parallel")
+        os.makedirs(serial)
+        os.makedirs(parallel)
+        command = f"import benchmark; benchmark.build_run([({serial!r}, 1), ({parallel!r}, {workers})], {backend!r})"
+        # Its own process group, so a hung build's pool workers are stopped with it
+        process = subprocess.Popen([sys.executable, "-c", command], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, start_new_session=True)
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.communicate()
+            logger.error(f"Serial and {workers}-worker builds did not finish within {timeout}s")
+            raise SystemExit(1)
+        if process.returncode != 0:
+            logger.error(f"Build failed:\n{stderr.strip()}")
+            raise SystemExit(1)
+        serial_seconds, parallel_seconds = json.loads(stdout.strip().splitlines()[-1])
+        logger.info(f"Build: serial {serial_seconds:.2f}s, {workers} workers {parallel_seconds:.2f}s")
+
+        differences = store_differences(serial, parallel)
+    for difference in differences:
+        logger.error(f"Parallel build: {difference}")
+    if differences:
+        raise SystemExit(1)
+    logger.info("Serial and parallel builds wrote identical partitions")
+
+BENCHMARKS = {
+    'circuit-features': bench_circuit_features,
+    'session-load': bench_session_load,
+    'startup': bench_startup,
+    'memory': bench_memory,
+    'race-summary': bench_race_summary,
+    'lap-features': bench_lap_features,
+    'pipeline': bench_pipeline,
+    'simulation': bench_simulation,
+    'training': bench_training,
+    'build': bench_build,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Run F1 predictor micro-benchmarks.")
+    parser.add_argument('names', nargs='*', help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    pipeline = parser.add_argument_group("pipeline benchmark")
+    for name, default in BENCHMARK_SCALE.items():
+        pipeline.add_argument(f'--{name}', type=int, default=default, help=f"synthetic {name} (default: {default})")
+    pipeline.add_argument('--repeat', type=int, default=3, help="timed runs per stage; the best is kept")
+    pipeline.add_argument('--tolerance', type=float, default=BENCHMARK_TOLERANCE,
+                          help="allowed slow-down or memory growth over the baseline, as a fraction")
+    pipeline.add_argument('--save-baseline', action='store_true', help="store the results as the baseline of this scale")
+    args = parser.parse_args()
+    setup_logging()
+    suppress_warnings()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    for name in args.names or BENCHMARKS:
+        if name == 'pipeline':
+            bench_pipeline({scale_name: getattr(args, scale_name) for scale_name in BENCHMARK_SCALE}, repeat=args.repeat,
+                           save_baseline=args.save_baseline, tolerance=args.tolerance)
+        else:
+            BENCHMARKS[name]()
+
+if __name__ == "__main__":
+    main()
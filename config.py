@@ -2,14 +2,19 @@ import os
 import logging
 from datetime import datetime
 
-# Set up logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Logging is configured by the entry points (setup_logging), not at import time
 logger = logging.getLogger("F1Predictor")
 
-# Cache directory setup
+def setup_logging(level=logging.INFO):
+    """Configure log output for a command line entry point."""
+    logging.basicConfig(level=level, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Cache directory, created on first use (ensure_cache_dir)
 CACHE_DIR = "cache"
-if not os.path.exists(CACHE_DIR):
-    os.makedirs(CACHE_DIR)
+
+def ensure_cache_dir():
+    """Create the cache directory if it does not exist yet."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
 
 # Define the first year of modern F1 data availability in FastF1
 FIRST_F1_YEAR = 2018  # FastF1 has reliable data from around 2018 onwards
@@ -17,10 +22,67 @@ FIRST_F1_YEAR = 2018  # FastF1 has reliable data from around 2018 onwards
 # Current year
 CURRENT_YEAR = datetime.now().year
 
+# Number of worker processes used to build the dataset (1 = serial build)
+BUILD_WORKERS = 1
+
+# Module providing get_session() for loading sessions ("synthetic" for offline runs)
+SESSION_BACKEND = "fastf1"
+
+# Session fetching: seconds before a load attempt is abandoned, retries of transient errors with
+# exponential backoff (first delay and cap, in seconds), and loads running at the same time
+FETCH_TIMEOUT_SECONDS = 300
+FETCH_RETRIES = 3
+FETCH_BACKOFF_SECONDS = 2.0
+FETCH_BACKOFF_MAX_SECONDS = 60.0
+FETCH_MAX_CONCURRENCY = 4
+
+# Fault injection of the "flaky" backend (synthetic sessions): added latency per load in
+# seconds, share of loads failing with a transient error, and share hanging for
+# FLAKY_HANG_SECONDS (off by default, as each hang waits for FETCH_TIMEOUT_SECONDS)
+FLAKY_LATENCY_SECONDS = 0.05
+FLAKY_FAILURE_RATE = 0.1
+FLAKY_HANG_RATE = 0.0
+FLAKY_HANG_SECONDS = 600
+
 # File paths
+DATASET_DIR = "dataset"
+DATASET_MANIFEST_PATH = os.path.join(DATASET_DIR, "manifest.json")
+DATASET_INDEX_PATH = os.path.join(DATASET_DIR, "index.json")
+FORM_STATE_PATH = os.path.join(DATASET_DIR, "form_state.json")
+SCHEDULE_CACHE_PATH = os.path.join(CACHE_DIR, "event_schedule.json")
+MODEL_CACHE_DIR = os.path.join(CACHE_DIR, "models")
+SUMMARY_CACHE_DIR = os.path.join(CACHE_DIR, "summaries")
+MATRIX_DIR = os.path.join(CACHE_DIR, "matrices")
+
+# Version of the data_processor output; bump it whenever preprocess_race_data or
+# preprocess_quali_data change so cached session summaries are rebuilt
+PROCESSOR_VERSION = 3
+
+# Laps aggregated per step when summarizing a race session
+LAP_CHUNK_ROWS = 4096
+
+# Race pace features: compounds with their own pace, laps slower than this factor of the
+# fastest lap (safety car, incidents) are ignored, lap time gained per lap of fuel burnt,
+# and the gap to the car ahead below which a lap counts as driven in traffic
+PACE_COMPOUNDS = ['SOFT', 'MEDIUM', 'HARD']
+QUICK_LAP_FACTOR = 1.07
+FUEL_EFFECT_PER_LAP = 0.03  # seconds
+TRAFFIC_GAP_SECONDS = 1.0
+
+# Least recently used models are evicted beyond these limits
+MODEL_CACHE_MAX_ENTRIES = 64
+MODEL_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Legacy CSV caches, migrated into DATASET_DIR when found
 ALL_RACE_DATA_PATH = "all_race_data.csv"
 ALL_QUALI_DATA_PATH = "all_quali_data.csv"
 
+# Hours before a cached schedule for the current season is fetched again
+SCHEDULE_REFRESH_HOURS = 24
+
+# Days after an event before a failed session load is remembered as missing
+MISSING_SESSION_GRACE_DAYS = 7
+
 # Default values for missing data
 DEFAULT_VALUES = {
     'AirTemp': 25.0,
@@ -52,12 +114,108 @@ HIGH_ALTITUDE_CIRCUITS = ['mexico', 'brazil', 'austria']
 HIGH_TEMP_CIRCUITS = ['bahrain', 'singapore', 'abu dhabi', 'saudi']
 WET_PRONE_CIRCUITS = ['spa', 'brazil', 'japan']
 
+# Columns joining race and qualifying records
+MERGE_KEYS = ['FullName', 'TeamName', 'Year', 'CircuitName']
+
+# Race lap time aggregates used as training targets
+RACE_TARGET_COLS = ['LapTime (s)_mean', 'LapTime (s)_min', 'LapTime (s)_std']
+
+# Per-driver race pace derived from the laps of each race
+RACE_PACE_COLS = [
+    'SoftPace', 'MediumPace', 'HardPace', 'DegradationSlope',
+    'PitStops', 'FuelCorrectedPace', 'CleanAirShare'
+]
+
+# Race pace of each driver's previous race; a race's own laps are never its features
+PRIOR_RACE_FEATURE_COLS = [f"Last{col}" for col in RACE_PACE_COLS]
+
+# Rolling form: races in each driver's window, smoothing of the team pace averages
+FORM_WINDOW = 5
+FORM_TEAM_ALPHA = 0.3
+
+# Driver, team and circuit form built from the races before each event
+FORM_FEATURE_COLS = [
+    'DriverFormPosition', 'DriverFormPace', 'TeamFormPace', 'TeamPaceTrend',
+    'CircuitHistoryPosition', 'CircuitHistoryStarts'
+]
+
 # Model feature columns
 FEATURE_COLS = [
     'BestQualiTime', 'AirTemp', 'TrackTemp', 'Humidity', 'Year',
     'is_street_circuit', 'is_high_speed', 'is_high_downforce',
     'is_high_altitude', 'is_high_temp', 'is_wet_prone'
-]
+] + PRIOR_RACE_FEATURE_COLS + FORM_FEATURE_COLS
+
+# Features whose missing values are imputed with their training median; the medians are
+# saved with each model and reused at prediction time
+IMPUTED_FEATURE_COLS = ['BestQualiTime', 'AirTemp', 'TrackTemp', 'Humidity']
+
+# XGBoost training: tree method, threads (None: every core) and, for streaming training
+# (--stream-training), matrix rows per batch handed to the quantile DMatrix and values
+# sampled per column to estimate the imputation medians (exact up to this many values)
+TRAINING_TREE_METHOD = "hist"
+TRAINING_THREADS = None
+STREAM_BATCH_ROWS = 65536
+STREAM_MEDIAN_SAMPLE = 200_000
+
+# Walk-forward backtest: full refit interval (in events) and trees added per warm-started fold
+BACKTEST_REFIT_EVERY = 10
+BACKTEST_TREES_PER_FOLD = 10
+
+# Race simulation: draws per race, draws generated per array chunk, lap time spread (seconds)
+# used when no error model has been fitted, and pseudo-races shrinking driver error estimates
+SIMULATION_DRAWS = 20000
+SIMULATION_CHUNK_DRAWS = 50000
+SIMULATION_DEFAULT_SIGMA = 0.6
+SIMULATION_SHRINKAGE = 10
+
+# Hyperparameter search: values sampled per trial, cross-validation folds grouped by
+# race, early stopping patience and the wall-clock budget of a whole search
+TUNING_SEARCH_SPACE = {
+    'learning_rate': [0.01, 0.02, 0.05, 0.1, 0.2],
+    'max_depth': [3, 4, 5, 6, 8],
+    'min_child_weight': [1, 2, 5, 10],
+    'subsample': [0.6, 0.7, 0.8, 0.9, 1.0],
+    'colsample_bytree': [0.5, 0.7, 0.8, 1.0],
+    'reg_lambda': [0.1, 1.0, 5.0, 10.0],
+}
+TUNING_TRIALS = 40
+TUNING_FOLDS = 5
+TUNING_MAX_TREES = 1000
+TUNING_EARLY_STOPPING_ROUNDS = 30
+TUNING_BUDGET_SECONDS = 600
+
+# Columns fed by each optional FastF1 session component. A component is only
+# requested from session.load() when one of its columns is in use.
+SESSION_COMPONENT_COLUMNS = {
+    'laps': RACE_TARGET_COLS + RACE_PACE_COLS,
+    'weather': ['AirTemp', 'TrackTemp', 'Humidity'],
+    'telemetry': [],
+    'messages': [],
+}
+
+# Prediction service defaults (main.py --serve)
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8000
+SERVICE_MAX_CONCURRENCY = 4
+SERVICE_QUEUE_TIMEOUT = 10.0  # seconds a request may wait for a free slot
+
+# Startup check: cumulative import time allowed for `import main`, and modules it must not load
+STARTUP_IMPORT_BUDGET_MS = 1500
+STARTUP_FORBIDDEN_MODULES = ['fastf1', 'xgboost', 'sklearn']
+
+# Pipeline benchmark: default synthetic scale, first season generated, stored baselines, and
+# the growth over a baseline (as a fraction, above noise floors) that fails a run
+BENCHMARK_SCALE = {'seasons': 2, 'events': 8, 'drivers': 20, 'laps': 57}
+BENCHMARK_FIRST_YEAR = 2018
+BENCHMARK_BASELINES_PATH = os.path.join("benchmarks", "baselines.json")
+BENCHMARK_TOLERANCE = 0.3
+BENCHMARK_NOISE_SECONDS = 0.02
+BENCHMARK_NOISE_BYTES = 256 * 1024
+
+# Parallel build check: worker processes, and how long a build may take before it counts as hung
+BUILD_CHECK_WORKERS = 2
+BUILD_CHECK_TIMEOUT_SECONDS = 600
 
 # XGBoost model parameters
 MODEL_PARAMS = {
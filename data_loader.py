@@ -1,111 +1,458 @@
+import logging
 import warnings
 import pandas as pd
 from datetime import datetime
 from config import logger
 import os
+import json
+import time
 import pandas as pd
-import fastf1
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 
-from config import logger, FIRST_F1_YEAR, CURRENT_YEAR, ALL_RACE_DATA_PATH, ALL_QUALI_DATA_PATH, GRAND_PRIX_NAMES
+from config import (
+    logger, CACHE_DIR, ensure_cache_dir, FIRST_F1_YEAR, CURRENT_YEAR, ALL_RACE_DATA_PATH, ALL_QUALI_DATA_PATH,
+    DATASET_DIR, DATASET_MANIFEST_PATH, BUILD_WORKERS, SESSION_BACKEND,
+    FEATURE_COLS, RACE_TARGET_COLS, SESSION_COMPONENT_COLUMNS
+)
+from dataset_store import (
+    RACE_COLUMNS, QUALI_COLUMNS, RACE_HISTORY_COLUMNS, store_exists, write_partitions, read_table, migrate_csv
+)
+from dataset_index import (
+    load_dataset_index, save_dataset_index, extend_dataset_index, add_surrogate_keys, select_circuit
+)
 from data_processor import preprocess_race_data, preprocess_quali_data
-from feature_engineering import enhance_data_with_circuit_features
-
-def load_or_build_comprehensive_data():
-    """Load comprehensive dataset from disk, or build it if not available."""
-    # Try to load from disk
-    if os.path.exists(ALL_RACE_DATA_PATH) and os.path.exists(ALL_QUALI_DATA_PATH):
-        logger.info("Loading data from cached files...")
-        race_data = pd.read_csv(ALL_RACE_DATA_PATH)
-        quali_data = pd.read_csv(ALL_QUALI_DATA_PATH)
-        
-        if not race_data.empty and not quali_data.empty:
-            logger.info(f"Loaded {len(race_data)} race records and {len(quali_data)} qualifying records from cache")
-            return race_data, quali_data
+from schema import RACE_SCHEMA, QUALI_SCHEMA, apply_schema
+from feature_engineering import enhance_data_with_circuit_features, add_prior_race_features
+from form_store import (
+    load_form_store, save_form_store, rebuild_form_store, update_form_store, add_form_features, form_features_for_event
+)
+from summary_cache import load_summary, save_summary
+from profiling import profiled, stage, count
+from fetch_scheduler import get_scheduler, SessionUnavailable, FetchFailed, PRIORITY_INGEST, PRIORITY_TARGET
+from schedule import (
+    load_schedule_cache, save_schedule_cache, discover_events, is_known_missing, record_missing, session_key
+)
+
+@profiled("data.load_or_build")
+def load_or_build_comprehensive_data(workers=None, backend=SESSION_BACKEND, refresh=False, circuit_identifier=None,
+                                     race_columns=RACE_COLUMNS, quali_columns=QUALI_COLUMNS):
+    """Load comprehensive dataset from disk, or build it if not available.
+    
+    With `refresh`, events missing from an existing dataset are ingested and
+    appended before it is loaded. `circuit_identifier` restricts the result to
+    matching circuits without reading the other partitions; pass None as
+    `race_columns`/`quali_columns` to read every stored column.
+    """
+    if not ensure_dataset(workers=workers, backend=backend, refresh=refresh):
+        return None, None
+    
+    # Load from disk, reading only the requested columns and partitions
+    logger.info("Loading data from the dataset store...")
+    race_data = read_table("race", race_columns, circuit_identifier)
+    quali_data = read_table("quali", quali_columns, circuit_identifier)
     
-    # Build from scratch
-    logger.info("Building comprehensive F1 dataset...")
-    race_data_list = []
-    quali_data_list = []
+    # Integer keys for joins and circuit lookups; names from stores that predate the index are added once
+    index = load_dataset_index()
+    if extend_dataset_index(index, [race_data, quali_data]):
+        save_dataset_index(index)
+    race_data = add_surrogate_keys(race_data, index)
+    quali_data = add_surrogate_keys(quali_data, index)
+    
+    # Prior-race and form features need every circuit's races, not just the ones read
+    if circuit_identifier is None and all(col in race_data.columns for col in RACE_HISTORY_COLUMNS):
+        history = race_data
+    else:
+        history = load_race_history()
+    race_data = add_prior_race_features(race_data, history)
+    race_data = add_form_features(race_data, history)
+    logger.info(f"Loaded {len(race_data)} race records and {len(quali_data)} qualifying records from {DATASET_DIR}")
+    
+    return race_data, quali_data
+
+def ensure_dataset(workers=None, backend=SESSION_BACKEND, refresh=False):
+    """Make sure the dataset store exists, migrating legacy CSV caches or building it when missing.
+    
+    With `refresh`, events missing from an existing store are ingested first.
+    Returns False when no dataset could be built.
+    """
+    if workers is None:
+        workers = BUILD_WORKERS
+    
+    # Move legacy CSV caches into the partitioned store
+    for csv_path, kind in [(ALL_RACE_DATA_PATH, "race"), (ALL_QUALI_DATA_PATH, "quali")]:
+        if os.path.exists(csv_path) and not store_exists(kind):
+            migrate_csv(csv_path, kind)
+    
+    if store_exists("race") and store_exists("quali"):
+        if refresh:
+            update_comprehensive_data(workers=workers, backend=backend)
+        return True
+    return build_comprehensive_data(workers=workers, backend=backend)
+
+def build_comprehensive_data(workers=1, backend=SESSION_BACKEND):
+    """Build the dataset store from scratch.
+    
+    Returns True when both race and qualifying data were collected.
+    """
+    logger.info(f"Building comprehensive F1 dataset with {workers} worker(s)...")
+    race_count = 0
+    quali_count = 0
     
     # Get all seasons
     first_year = FIRST_F1_YEAR
     current_year = CURRENT_YEAR
     seasons = range(first_year, current_year + 1)
     
-    total_combinations = len(seasons) * len(GRAND_PRIX_NAMES)
-    success_count = 0
-    combination_count = 0
+    # Resolve the events that actually took place instead of trying every name each season
+    schedule_cache = load_schedule_cache()
+    events = discover_events(seasons, schedule_cache, backend)
     
-    # Iterate through seasons and events
-    for year in seasons:
-        for gp_name in GRAND_PRIX_NAMES:
-            combination_count += 1
-            display_progress(combination_count, total_combinations, success_count, interval=5)
-            
-            try:
-                # Try to load race session
-                race_session = get_race_data(year, gp_name, "R")
-                quali_session = get_race_data(year, gp_name, "Q")
-                
-                # Process race data
-                if race_session is not None:
-                    race_data = preprocess_race_data(race_session)
-                    if race_data is not None and not race_data.empty:
-                        # Add circuit features
-                        race_data = enhance_data_with_circuit_features(race_data)
-                        race_data_list.append(race_data)
-                
-                # Process qualifying data
-                if quali_session is not None:
-                    quali_data = preprocess_quali_data(quali_session)
-                    if quali_data is not None and not quali_data.empty:
-                        # Add circuit features
-                        quali_data = enhance_data_with_circuit_features(quali_data)
-                        quali_data_list.append(quali_data)
-                
-                if race_session is not None or quali_session is not None:
-                    success_count += 1
-                    
-            except Exception as e:
-                logger.warning(f"Error processing {year} {gp_name}: {e}")
-    
-    # Combine all data
-    if race_data_list:
-        all_race_data = pd.concat(race_data_list, ignore_index=True)
-        all_race_data.to_csv(ALL_RACE_DATA_PATH, index=False)
-        logger.info(f"Saved {len(all_race_data)} race records to {ALL_RACE_DATA_PATH}")
+    # Results come back in event order regardless of which worker finished first
+    manifest = set()
+    index = load_dataset_index()
+    race_frames = []
+    results = ingest_events(events, workers=workers, backend=backend, schedule_cache=schedule_cache)
+    for (year, gp_name), (race_data, quali_data) in zip(events, results):
+        if race_data is not None:
+            write_partitions(race_data, "race")
+            race_count += len(race_data)
+            race_frames.append(race_data)
+            manifest.add(session_key(year, gp_name, "R"))
+        if quali_data is not None:
+            write_partitions(quali_data, "quali")
+            quali_count += len(quali_data)
+            manifest.add(session_key(year, gp_name, "Q"))
+        extend_dataset_index(index, [race_data, quali_data])
+    save_schedule_cache(schedule_cache)
+    save_manifest(manifest)
+    save_dataset_index(index)
+    save_form_store(update_form_store(rebuild_form_store(None), race_frames, load_race_history))
+    
+    if race_count:
+        logger.info(f"Saved {race_count} race records to {DATASET_DIR}")
     else:
-        all_race_data = None
         logger.warning("No race data collected!")
     
-    if quali_data_list:
-        all_quali_data = pd.concat(quali_data_list, ignore_index=True)
-        all_quali_data.to_csv(ALL_QUALI_DATA_PATH, index=False)
-        logger.info(f"Saved {len(all_quali_data)} qualifying records to {ALL_QUALI_DATA_PATH}")
+    if quali_count:
+        logger.info(f"Saved {quali_count} qualifying records to {DATASET_DIR}")
     else:
-        all_quali_data = None
         logger.warning("No qualifying data collected!")
     
-    return all_race_data, all_quali_data
+    return race_count > 0 and quali_count > 0
+
+def update_comprehensive_data(workers=1, backend=SESSION_BACKEND):
+    """Ingest events missing from the dataset store and add them as new partitions.
+    
+    Returns the number of events that contributed new data.
+    """
+    manifest = load_manifest()
+    index = load_dataset_index()
+    schedule_cache = load_schedule_cache()
+    seasons = range(FIRST_F1_YEAR, CURRENT_YEAR + 1)
+    events = discover_events(seasons, schedule_cache, backend)
+    
+    new_events = [
+        (year, gp_name) for year, gp_name in events
+        if any(session_key(year, gp_name, session_type) not in manifest for session_type in ("R", "Q"))
+    ]
+    logger.info(f"Refreshing dataset: {len(new_events)} of {len(events)} events are not in the store yet")
+    
+    race_count = 0
+    quali_count = 0
+    race_frames = []
+    results = ingest_events(new_events, workers=workers, backend=backend,
+                            schedule_cache=schedule_cache, skip_sessions=manifest)
+    # Only the new partitions are written; the existing history is never re-read or rewritten
+    for (year, gp_name), (race_data, quali_data) in zip(new_events, results):
+        if race_data is not None:
+            write_partitions(race_data, "race")
+            race_count += 1
+            race_frames.append(race_data)
+            manifest.add(session_key(year, gp_name, "R"))
+        if quali_data is not None:
+            write_partitions(quali_data, "quali")
+            quali_count += 1
+            manifest.add(session_key(year, gp_name, "Q"))
+        extend_dataset_index(index, [race_data, quali_data])
+    save_schedule_cache(schedule_cache)
+    save_manifest(manifest)
+    save_dataset_index(index)
+    
+    # New races advance the form state; stores that predate it build it once from their history
+    form_store = load_form_store()
+    if form_store is None:
+        form_store = rebuild_form_store(load_race_history())
+    else:
+        form_store = update_form_store(form_store, race_frames, load_race_history)
+    save_form_store(form_store)
+    
+    updated = sum(1 for race_data, quali_data in results if race_data is not None or quali_data is not None)
+    logger.info(f"Added {race_count} race and {quali_count} qualifying sessions from {updated} events")
+    return updated
+
+def load_manifest(path=DATASET_MANIFEST_PATH):
+    """Load the set of session keys already stored in the dataset.
+    
+    Stores created before the manifest existed are indexed once from their
+    Year/CircuitName partitions.
+    """
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return set(json.load(f))
+    
+    manifest = set()
+    for kind, session_type in [("race", "R"), ("quali", "Q")]:
+        if store_exists(kind):
+            keys = read_table(kind, columns=['Year', 'CircuitName']).drop_duplicates()
+            manifest.update(session_key(year, name, session_type) for year, name in keys.itertuples(index=False))
+    return manifest
+
+def load_race_history():
+    """Read the per-race pace of every driver from the dataset store, or None without one."""
+    if not store_exists("race"):
+        return None
+    history = read_table("race", RACE_HISTORY_COLUMNS)
+    if not all(col in history.columns for col in RACE_HISTORY_COLUMNS):
+        logger.warning(f"The dataset in {DATASET_DIR} predates the race pace features; rebuild it to use them")
+    return history
+
+def save_manifest(manifest, path=DATASET_MANIFEST_PATH):
+    """Write the manifest of stored session keys atomically."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(sorted(manifest), f, indent=1)
+    os.replace(tmp_path, path)
+
+@profiled("data.ingest_events")
+def ingest_events(events, workers=1, backend=SESSION_BACKEND, schedule_cache=None, skip_sessions=None):
+    """Load and preprocess a list of (year, grand_prix) events, serially or with a process pool.
+    
+    Sessions remembered as missing in `schedule_cache` or listed in `skip_sessions` are
+    not attempted, and sessions that fail to load are recorded in `schedule_cache`.
+    Returns a list of (race_data, quali_data) tuples in the same order as `events`.
+    """
+    total_combinations = len(events)
+    results = [(None, None)] * total_combinations
+    success_count = 0
+    combination_count = 0
+    
+    # Work out which sessions are worth attempting for each event
+    pending = []
+    for i, (year, gp_name) in enumerate(events):
+        session_types = tuple(
+            session_type for session_type in ("R", "Q")
+            if (schedule_cache is None or not is_known_missing(schedule_cache, year, gp_name, session_type))
+            and (skip_sessions is None or session_key(year, gp_name, session_type) not in skip_sessions)
+        )
+        if session_types:
+            pending.append((i, year, gp_name, session_types))
+        else:
+            combination_count += 1
+    if combination_count:
+        logger.info(f"Skipping {combination_count} events with no sessions left to load")
+    
+    def collect(i, year, gp_name, outcome):
+        nonlocal combination_count, success_count
+        race_data, quali_data, missing = outcome
+        results[i] = (race_data, quali_data)
+        if schedule_cache is not None:
+            for session_type in missing:
+                record_missing(schedule_cache, year, gp_name, session_type)
+        combination_count += 1
+        success_count += int(race_data is not None or quali_data is not None)
+        display_progress(combination_count, total_combinations, success_count, interval=5)
+    
+    if workers <= 1:
+        for i, year, gp_name, session_types in pending:
+            collect(i, year, gp_name, load_event_data(year, gp_name, session_types, backend))
+        return results
+    
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_build_worker, initargs=(backend,)) as executor:
+        futures = {
+            executor.submit(load_event_data, year, gp_name, session_types, backend): (i, year, gp_name)
+            for i, year, gp_name, session_types in pending
+        }
+        # Progress is aggregated here in the parent as workers finish
+        for future in as_completed(futures):
+            collect(*futures[future], future.result())
+    
+    return results
+
+def _init_build_worker(backend):
+    """Prepare a build worker process (warning filters and FastF1 cache)."""
+    suppress_warnings()
+    if backend == "fastf1":
+        import fastf1
+        ensure_cache_dir()
+        fastf1.Cache.enable_cache(CACHE_DIR)
 
-def get_race_data(year, grand_prix, session_type="R"):
-    """Load race or qualifying session data safely."""
+def load_event_data(year, gp_name, session_types=("R", "Q"), backend=SESSION_BACKEND):
+    """Load and preprocess the race and qualifying sessions of a single event.
+    
+    Returns (race_data, quali_data, missing) where the frames are None when unavailable
+    and `missing` lists the session types that could not be loaded.
+    """
+    race_data = None
+    quali_data = None
+    missing = []
+    
     try:
-        # Try to load the session
-        session = fastf1.get_session(year, grand_prix, session_type)
-        session.load()
-        return session
+        # Process race data
+        if "R" in session_types:
+            race_data, available = load_session_summary(year, gp_name, "R", backend)
+            if race_data is not None and not race_data.empty:
+                # Add circuit features
+                race_data = apply_schema(enhance_data_with_circuit_features(race_data), RACE_SCHEMA)
+            else:
+                race_data = None
+            if not available:
+                missing.append("R")
+        
+        # Process qualifying data
+        if "Q" in session_types:
+            quali_data, available = load_session_summary(year, gp_name, "Q", backend)
+            if quali_data is not None and not quali_data.empty:
+                # Add circuit features
+                quali_data = apply_schema(enhance_data_with_circuit_features(quali_data), QUALI_SCHEMA)
+            else:
+                quali_data = None
+            if not available:
+                missing.append("Q")
+            
     except Exception as e:
+        logger.warning(f"Error processing {year} {gp_name}: {e}")
+    
+    return race_data, quali_data, missing
+
+def load_session_summary(year, gp_name, session_type, backend=SESSION_BACKEND):
+    """Get the preprocessed per-driver summary of a session, loading the session only on a cache miss.
+    
+    Returns (summary, available) where summary is None when no usable data was
+    produced and available is False when the session itself could not be loaded.
+    """
+    with stage("cache.summary_load"):
+        summary = load_summary(year, gp_name, session_type)
+    if summary is not None:
+        count("summary cache hits")
+        return summary, True
+    count("summary cache misses")
+    
+    try:
+        session = load_session(year, gp_name, session_type, backend)
+    except SessionUnavailable as e:
+        logger.debug(f"Could not load {session_type} session for {year} {gp_name}: {e}")
+        return None, False
+    except FetchFailed as e:
+        # Not remembered as missing, so the next refresh tries again
+        logger.warning(f"{e}; it will be retried on the next refresh")
+        return None, True
+    
+    # Only the schema columns are kept, so cached summaries stay small
+    if session_type == "R":
+        summary = apply_schema(preprocess_race_data(session), RACE_SCHEMA)
+    else:
+        summary = apply_schema(preprocess_quali_data(session), QUALI_SCHEMA)
+    if summary is not None:
+        save_summary(year, gp_name, session_type, summary)
+    return summary, True
+
+def session_load_options(session_type, purpose="ingest"):
+    """Choose the session components to load for a purpose.
+    
+    "ingest" loads what preprocessing needs for the model features (plus race laps
+    for the training targets), "predict" what prediction features need, and
+    "results" only the always-loaded results table.
+    """
+    used_columns = set()
+    if purpose in ("ingest", "predict"):
+        used_columns.update(FEATURE_COLS)
+    if purpose == "ingest" and session_type == "R":
+        used_columns.update(RACE_TARGET_COLS)
+    
+    # Qualifying laps are never read: BestQualiTime comes from the results table
+    options = {
+        component: any(col in used_columns for col in columns)
+        for component, columns in SESSION_COMPONENT_COLUMNS.items()
+    }
+    if session_type != "R":
+        options['laps'] = False
+    return options
+
+def session_memory_bytes(session):
+    """Estimate the in-memory size of the tables a session has loaded."""
+    total = 0
+    for attr in ['results', 'laps', 'weather_data', 'car_data', 'pos_data', 'race_control_messages']:
+        try:
+            value = getattr(session, attr)
+        except Exception:
+            continue
+        frames = value.values() if isinstance(value, dict) else [value]
+        total += sum(int(frame.memory_usage(deep=True).sum()) for frame in frames if isinstance(frame, pd.DataFrame))
+    return total
+
+def load_session(year, grand_prix, session_type="R", backend=SESSION_BACKEND, purpose="ingest",
+                 priority=PRIORITY_INGEST, prefetched=None):
+    """Load a session through the fetch scheduler, requesting only the components `purpose` needs.
+    
+    `prefetched` is a Future from prefetch_session to wait on instead of queueing
+    a new load. Raises SessionUnavailable when the backend has no such session
+    and FetchFailed when transient errors outlast the retries.
+    """
+    options = session_load_options(session_type, purpose)
+    start = time.perf_counter()
+    with stage("session.load"):
+        if prefetched is None:
+            prefetched = get_scheduler(backend).submit(year, grand_prix, session_type, options, priority)
+        session = prefetched.result()
+    elapsed = time.perf_counter() - start
+    count("sessions loaded")
+    
+    # Measuring the session's memory is a deep scan of every table, so only do it when it will be logged
+    if logger.isEnabledFor(logging.DEBUG):
+        skipped = [component for component, enabled in options.items() if not enabled]
+        logger.debug(
+            f"Loaded {session_type} session for {year} {grand_prix} in {elapsed:.2f}s "
+            f"({session_memory_bytes(session) / 1e6:.1f} MB), skipped: {', '.join(skipped) or 'nothing'}"
+        )
+    return session
+
+def prefetch_session(year, grand_prix, session_type="Q", backend=SESSION_BACKEND, purpose="predict",
+                     priority=PRIORITY_TARGET):
+    """Start loading a session in the background and return its Future.
+    
+    Pass the Future as `prefetched` to get_race_data or get_current_quali_data;
+    its default priority puts it ahead of queued dataset ingestion.
+    """
+    options = session_load_options(session_type, purpose)
+    return get_scheduler(backend).submit(year, grand_prix, session_type, options, priority)
+
+def get_race_data(year, grand_prix, session_type="R", backend=SESSION_BACKEND, purpose="ingest",
+                  priority=PRIORITY_INGEST, prefetched=None):
+    """Load race or qualifying session data safely; returns None when it cannot be loaded."""
+    try:
+        return load_session(year, grand_prix, session_type, backend, purpose, priority, prefetched)
+    except SessionUnavailable as e:
         logger.debug(f"Could not load {session_type} session for {year} {grand_prix}: {e}")
-        return None
+    except FetchFailed as e:
+        logger.warning(str(e))
+    return None
 
-def get_current_quali_data(year, grand_prix):
-    """Get qualifying data for prediction."""
+@profiled("data.current_quali")
+def get_current_quali_data(year, grand_prix, backend=SESSION_BACKEND, history=None, prefetched=None):
+    """Get qualifying data for prediction.
+    
+    The session is fetched ahead of queued ingestion, or taken from a
+    `prefetched` Future. Prior-race and form features come from `history`
+    (per-race rows), read from the dataset store when not given; form features
+    of an upcoming race are read from the persisted form state instead.
+    """
     try:
         # Load qualifying session
-        quali_session = get_race_data(year, grand_prix, "Q")
+        quali_session = get_race_data(year, grand_prix, "Q", backend, purpose="predict",
+                                      priority=PRIORITY_TARGET, prefetched=prefetched)
         if quali_session is None:
             logger.error(f"No qualifying data found for {year} {grand_prix}")
             return None
@@ -117,7 +464,11 @@ def get_current_quali_data(year, grand_prix):
             return None
         
         # Add circuit features
-        enhanced_quali = enhance_data_with_circuit_features(quali_data)
+        enhanced_quali = apply_schema(enhance_data_with_circuit_features(quali_data), QUALI_SCHEMA)
+        if history is None:
+            history = load_race_history()
+        enhanced_quali = add_prior_race_features(enhanced_quali, history)
+        enhanced_quali = form_features_for_event(enhanced_quali, history)
         
         return enhanced_quali
         
@@ -131,8 +482,9 @@ def get_circuit_specific_data(all_race_data, all_quali_data, circuit_identifier)
         return None, None
     
     # Get circuit-specific data
-    circuit_race_data = all_race_data[all_race_data['CircuitName'].str.contains(circuit_identifier, case=False, na=False)]
-    circuit_quali_data = all_quali_data[all_quali_data['CircuitName'].str.contains(circuit_identifier, case=False, na=False)]
+    index = load_dataset_index()
+    circuit_race_data = select_circuit(all_race_data, circuit_identifier, index)
+    circuit_quali_data = select_circuit(all_quali_data, circuit_identifier, index)
     
     logger.info(f"Found {len(circuit_race_data)} race and {len(circuit_quali_data)} qualifying records for {circuit_identifier}")
     
@@ -1,9 +1,147 @@
 import numpy as np
 import pandas as pd
-from config import logger
+from config import (
+    logger, LAP_CHUNK_ROWS, RACE_PACE_COLS, PACE_COMPOUNDS, QUICK_LAP_FACTOR, FUEL_EFFECT_PER_LAP, TRAFFIC_GAP_SECONDS
+)
+from profiling import profiled, count
 
+def running_lap_stats(codes, seconds, n_drivers, chunk_rows=LAP_CHUNK_ROWS):
+    """Per-driver lap count, mean, min and sample std, accumulated chunk by chunk.
+    
+    `codes` gives each lap's driver (-1 for laps to ignore) and `seconds` its lap
+    time (NaN for laps without one). The statistics of each chunk are merged into
+    the running ones with Chan's parallel form of Welford's update, so only a few
+    arrays of one entry per driver are kept.
+    """
+    count = np.zeros(n_drivers)
+    mean = np.zeros(n_drivers)
+    m2 = np.zeros(n_drivers)
+    minimum = np.full(n_drivers, np.inf)
+    
+    for start in range(0, len(codes), chunk_rows):
+        chunk_codes = codes[start:start + chunk_rows]
+        chunk_seconds = seconds[start:start + chunk_rows]
+        valid = (chunk_codes >= 0) & ~np.isnan(chunk_seconds)
+        chunk_codes = chunk_codes[valid]
+        chunk_seconds = chunk_seconds[valid]
+        if not len(chunk_codes):
+            continue
+        
+        chunk_count = np.bincount(chunk_codes, minlength=n_drivers).astype(float)
+        chunk_sum = np.bincount(chunk_codes, weights=chunk_seconds, minlength=n_drivers)
+        chunk_mean = np.divide(chunk_sum, chunk_count, out=np.zeros(n_drivers), where=chunk_count > 0)
+        chunk_m2 = np.bincount(chunk_codes, weights=(chunk_seconds - chunk_mean[chunk_codes]) ** 2, minlength=n_drivers)
+        np.minimum.at(minimum, chunk_codes, chunk_seconds)
+        
+        total = count + chunk_count
+        delta = chunk_mean - mean
+        weight = np.divide(chunk_count, total, out=np.zeros(n_drivers), where=total > 0)
+        mean = mean + delta * weight
+        m2 = m2 + chunk_m2 + delta ** 2 * count * weight
+        count = total
+    
+    std = np.sqrt(np.divide(m2, count - 1, out=np.full(n_drivers, np.nan), where=count > 1))
+    minimum[count == 0] = np.nan
+    return count, mean, minimum, std
+
+def _group_mean(keys, values, n_groups):
+    """Mean of `values` per integer key, NaN for keys without values."""
+    counts = np.bincount(keys, minlength=n_groups)
+    sums = np.bincount(keys, weights=values, minlength=n_groups)
+    return np.divide(sums, counts, out=np.full(n_groups, np.nan), where=counts > 0)
+
+def lap_pace_features(laps, codes, n_drivers):
+    """Derive per-driver race pace features from a lap table in one vectorized pass.
+    
+    Pace values are seconds relative to the field's median representative lap, so
+    they compare across circuits. Representative laps have a time, are not the
+    first lap, an in-lap or an out-lap, and are within QUICK_LAP_FACTOR of the
+    fastest lap. Returns a dict of RACE_PACE_COLS arrays indexed by driver code.
+    """
+    n_laps = len(laps)
+    seconds = laps['LapTime'].dt.total_seconds().to_numpy()
+    lap_number = laps['LapNumber'].to_numpy(dtype=float)
+    stint = laps['Stint'].to_numpy(dtype=float) if 'Stint' in laps.columns else np.ones(n_laps)
+    features = {col: np.full(n_drivers, np.nan) for col in RACE_PACE_COLS}
+    
+    timed = (codes >= 0) & ~np.isnan(seconds)
+    representative = timed & (lap_number > 1)
+    for pit_col in ['PitInTime', 'PitOutTime']:
+        if pit_col in laps.columns:
+            representative &= laps[pit_col].isna().to_numpy()
+    if representative.any():
+        representative &= seconds <= QUICK_LAP_FACTOR * np.nanmin(seconds[representative])
+    
+    # Pit stops from the stints each driver started
+    driver_laps = codes >= 0
+    if 'Stint' in laps.columns and driver_laps.any():
+        stint_max = np.full(n_drivers, np.nan)
+        valid_stint = driver_laps & ~np.isnan(stint)
+        np.fmax.at(stint_max, codes[valid_stint], stint[valid_stint])
+        features['PitStops'] = np.clip(stint_max - 1, 0, None)
+    
+    if not representative.any():
+        return features
+    
+    # Fuel correction: express every lap as if driven on the final lap's fuel load
+    fuel_corrected = seconds - FUEL_EFFECT_PER_LAP * (np.nanmax(lap_number) - lap_number)
+    rep_codes = codes[representative]
+    delta = seconds[representative] - np.median(seconds[representative])
+    corrected_delta = fuel_corrected[representative] - np.median(fuel_corrected[representative])
+    features['FuelCorrectedPace'] = _group_mean(rep_codes, corrected_delta, n_drivers)
+    
+    # Pace per compound through a (driver, compound) key
+    if 'Compound' in laps.columns:
+        compound = pd.Categorical(laps['Compound'].to_numpy()[representative], categories=PACE_COMPOUNDS).codes
+        on_compound = compound >= 0
+        compound_pace = _group_mean(
+            rep_codes[on_compound] * len(PACE_COMPOUNDS) + compound[on_compound], delta[on_compound],
+            n_drivers * len(PACE_COMPOUNDS)
+        ).reshape(n_drivers, len(PACE_COMPOUNDS))
+        for j, name in enumerate(PACE_COMPOUNDS):
+            features[f"{name.capitalize()}Pace"] = compound_pace[:, j]
+    
+    # Degradation: least-squares slope of fuel-corrected time over tyre age per (driver, stint),
+    # averaged per driver weighted by the laps of each stint
+    if 'TyreLife' in laps.columns:
+        tyre_life = laps['TyreLife'].to_numpy(dtype=float)[representative]
+        rep_stint = stint[representative]
+        usable = ~np.isnan(tyre_life) & ~np.isnan(rep_stint)
+        stint_keys, stint_index = np.unique(
+            np.stack([rep_codes[usable], rep_stint[usable]], axis=1), axis=0, return_inverse=True
+        )
+        stint_index = stint_index.ravel()
+        x = tyre_life[usable]
+        y = fuel_corrected[representative][usable]
+        sums = [np.bincount(stint_index, weights=w, minlength=len(stint_keys)) for w in (None, x, y, x * x, x * y)]
+        n, sx, sy, sxx, sxy = sums
+        denominator = n * sxx - sx * sx
+        fitted = (n >= 3) & (denominator > 0)
+        slope = np.divide(n * sxy - sx * sy, denominator, out=np.zeros(len(stint_keys)), where=fitted)
+        stint_drivers = stint_keys[:, 0].astype(int)
+        weight = np.bincount(stint_drivers[fitted], weights=n[fitted], minlength=n_drivers)
+        weighted = np.bincount(stint_drivers[fitted], weights=(slope * n)[fitted], minlength=n_drivers)
+        features['DegradationSlope'] = np.divide(weighted, weight, out=np.full(n_drivers, np.nan), where=weight > 0)
+    
+    # Clean air: gap to the car ahead when crossing the line on the same lap
+    if 'Time' in laps.columns:
+        crossing = laps['Time'].dt.total_seconds().to_numpy()
+        order = np.lexsort((crossing, lap_number))
+        gap = np.full(n_laps, np.inf)
+        same_lap = lap_number[order][1:] == lap_number[order][:-1]
+        gap[order[1:]] = np.where(same_lap, np.diff(crossing[order]), np.inf)
+        clean_air = ~(gap < TRAFFIC_GAP_SECONDS)
+        features['CleanAirShare'] = _group_mean(rep_codes, clean_air[representative].astype(float), n_drivers)
+    
+    return features
+
+@profiled("process.race")
 def preprocess_race_data(session):
-    """Extract relevant features from the race session with enhanced circuit data."""
+    """Summarize the race lap times of each driver with enhanced circuit data.
+    
+    Lap times are aggregated per driver without copying the lap table; event and
+    weather metadata are attached to the per-driver rows only.
+    """
     try:
         laps = session.laps
         
@@ -11,69 +149,55 @@ def preprocess_race_data(session):
             logger.warning(f"No lap data available for {session.event.year} {session.event.name}")
             return None
         
-        # Add race metadata
-        laps['Year'] = session.event.year
-        laps['CircuitName'] = session.event.name
-        laps['CircuitShortName'] = session.event['EventName']
-        
-        # Extract weather data
-        if hasattr(session, 'weather_data') and not session.weather_data.empty:
-            weather = session.weather_data
-            avg_temp = weather['AirTemp'].mean()
-            avg_track_temp = weather['TrackTemp'].mean()
-            avg_humidity = weather['Humidity'].mean()
-            laps['AirTemp'] = avg_temp
-            laps['TrackTemp'] = avg_track_temp
-            laps['Humidity'] = avg_humidity
-        else:
-            # Use default values if weather data is missing
-            laps['AirTemp'] = np.nan
-            laps['TrackTemp'] = np.nan
-            laps['Humidity'] = np.nan
-        
         # Convert lap times to numeric format
-        valid_laps = laps.dropna(subset=['LapTime'])
-        if valid_laps.empty:
+        lap_seconds = laps['LapTime'].dt.total_seconds().to_numpy()
+        if np.isnan(lap_seconds).all():
             logger.warning(f"No valid lap times for {session.event.year} {session.event.name}")
             return None
-            
-        valid_laps['LapTime (s)'] = valid_laps['LapTime'].dt.total_seconds()
         
-        # Add track position and stint information
-        valid_laps['TrackPosition'] = valid_laps['Position']
-        valid_laps['Stint'] = valid_laps['Stint']
+        if not hasattr(session, 'results') or session.results.empty:
+            logger.warning(f"No driver results available for {session.event.year} {session.event.name}")
+            return None
         
-        # Add tire data if available
-        if 'Compound' in valid_laps.columns:
-            valid_laps['TireCompound'] = valid_laps['Compound']
+        count("laps processed", len(laps))
         
-        # Add driver information
-        if hasattr(session, 'results') and not session.results.empty:
-            drivers = session.results[['DriverNumber', 'Abbreviation', 'FullName', 'TeamName']]
-            merged_data = pd.merge(valid_laps, drivers, left_on="DriverNumber", right_on="DriverNumber", how="left")
-            
-            # Calculate average lap time per driver
-            avg_laptimes = merged_data.groupby(['FullName', 'TeamName', 'Year', 'CircuitName'])[
-                'LapTime (s)', 'AirTemp', 'TrackTemp', 'Humidity'
-            ].agg({
-                'LapTime (s)': ['mean', 'min', 'std'],
-                'AirTemp': 'mean',
-                'TrackTemp': 'mean',
-                'Humidity': 'mean'
-            }).reset_index()
-            
-            # Flatten multi-level columns
-            avg_laptimes.columns = ['_'.join(col).strip('_') if isinstance(col, tuple) else col for col in avg_laptimes.columns]
-            
-            return avg_laptimes
+        # One running aggregate per classified driver; laps of unknown drivers are ignored
+        drivers = session.results.drop_duplicates('DriverNumber')
+        codes = pd.Index(drivers['DriverNumber']).get_indexer(laps['DriverNumber'])
+        lap_count, mean, minimum, std = running_lap_stats(codes, lap_seconds, len(drivers))
+        pace = lap_pace_features(laps, codes, len(drivers))
+        
+        # Weather averages over the session
+        if hasattr(session, 'weather_data') and not session.weather_data.empty:
+            weather = session.weather_data
+            weather_means = [weather['AirTemp'].mean(), weather['TrackTemp'].mean(), weather['Humidity'].mean()]
         else:
-            logger.warning(f"No driver results available for {session.event.year} {session.event.name}")
-            return None
+            weather_means = [np.nan, np.nan, np.nan]
+        
+        has_laps = lap_count > 0
+        avg_laptimes = pd.DataFrame({
+            'FullName': drivers['FullName'].to_numpy()[has_laps],
+            'TeamName': drivers['TeamName'].to_numpy()[has_laps],
+            'Year': session.event.year,
+            'CircuitName': session.event.name,
+            'RoundNumber': session.event.get('RoundNumber', np.nan),
+            'LapTime (s)_mean': mean[has_laps],
+            'LapTime (s)_min': minimum[has_laps],
+            'LapTime (s)_std': std[has_laps],
+            'AirTemp_mean': weather_means[0],
+            'TrackTemp_mean': weather_means[1],
+            'Humidity_mean': weather_means[2],
+            'FinishPosition': drivers['Position'].to_numpy(dtype=float)[has_laps],
+            **{col: values[has_laps] for col, values in pace.items()},
+        })
+        avg_laptimes = avg_laptimes.dropna(subset=['FullName', 'TeamName'])
+        return avg_laptimes.sort_values(['FullName', 'TeamName']).reset_index(drop=True)
     
     except Exception as e:
         logger.error(f"Error processing race data: {e}")
         return None
 
+@profiled("process.quali")
 def preprocess_quali_data(session):
     """Extract qualifying data with enhanced circuit information."""
     try:
@@ -84,6 +208,7 @@ def preprocess_quali_data(session):
             quali['Year'] = session.event.year
             quali['CircuitName'] = session.event.name
             quali['CircuitShortName'] = session.event['EventName']
+            quali['RoundNumber'] = session.event.get('RoundNumber', np.nan)
             
             # Extract weather data
             if hasattr(session, 'weather_data') and not session.weather_data.empty:
@@ -103,10 +228,8 @@ def preprocess_quali_data(session):
             # Convert qualifying times to numeric format
             for col in ['Q1', 'Q2', 'Q3']:
                 if col in quali.columns:
-                    # Handle NaN values safely
-                    mask = quali[col].notna()
-                    if mask.any():
-                        quali.loc[mask, col] = pd.to_timedelta(quali.loc[mask, col]).dt.total_seconds()
+                    # Converting the whole column keeps it float (NaT becomes NaN)
+                    quali[col] = pd.to_timedelta(quali[col]).dt.total_seconds()
             
             # Calculate the best qualifying time
             best_q_columns = [col for col in ['Q1', 'Q2', 'Q3'] if col in quali.columns]
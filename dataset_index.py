@@ -0,0 +1,104 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+from config import logger, DATASET_INDEX_PATH
+
+# Surrogate key column for each name column; codes are positions in the index vocabularies
+KEY_COLUMNS = {'FullName': 'DriverKey', 'TeamName': 'TeamKey', 'CircuitName': 'CircuitKey'}
+VOCABULARIES = {'FullName': 'drivers', 'TeamName': 'teams', 'CircuitName': 'circuits'}
+
+# Integer join keys between race and qualifying records, equivalent to MERGE_KEYS
+INDEX_MERGE_KEYS = ['DriverKey', 'TeamKey', 'Year', 'CircuitKey']
+
+def load_dataset_index(path=DATASET_INDEX_PATH):
+    """Load the driver, team and circuit vocabularies of the dataset."""
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            for vocabulary in VOCABULARIES.values():
+                index.setdefault(vocabulary, [])
+            return index
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable dataset index {path}: {e}")
+    return {vocabulary: [] for vocabulary in VOCABULARIES.values()}
+
+def save_dataset_index(index, path=DATASET_INDEX_PATH):
+    """Write the dataset index atomically."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp_path, path)
+
+def _unique_names(values):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.categories
+    return pd.Index(values.dropna().unique())
+
+def extend_dataset_index(index, frames):
+    """Append names not yet in the index; existing keys never change.
+
+    Returns True when the index grew and should be saved.
+    """
+    grew = False
+    for name_col, vocabulary in VOCABULARIES.items():
+        known = set(index[vocabulary])
+        for data in frames:
+            if data is None or name_col not in data.columns:
+                continue
+            for name in _unique_names(data[name_col]):
+                if str(name) not in known:
+                    known.add(str(name))
+                    index[vocabulary].append(str(name))
+                    grew = True
+    return grew
+
+def add_surrogate_keys(data, index):
+    """Add integer DriverKey/TeamKey/CircuitKey columns and sort rows by circuit and season.
+
+    Names missing from the index get key -1. Keys are looked up once per distinct
+    name and broadcast through the categorical codes.
+    """
+    data = data.copy()
+    for name_col, key_col in KEY_COLUMNS.items():
+        if name_col not in data.columns:
+            continue
+        values = data[name_col].astype('category')
+        lookup = pd.Index(index[VOCABULARIES[name_col]]).get_indexer(values.cat.categories.astype(str))
+        lookup = np.append(lookup, -1).astype(np.int32)
+        data[key_col] = lookup[values.cat.codes.to_numpy()]
+    if 'CircuitKey' in data.columns:
+        sort_cols = ['CircuitKey', 'Year'] if 'Year' in data.columns else ['CircuitKey']
+        data = data.sort_values(sort_cols, kind='stable').reset_index(drop=True)
+    return data
+
+def circuit_keys(index, circuit_identifier):
+    """Keys of the circuits whose name contains the identifier (case-insensitive)."""
+    identifier = circuit_identifier.lower()
+    return [key for key, name in enumerate(index['circuits']) if identifier in name.lower()]
+
+def circuit_row_range(data, circuit_key):
+    """Return the (start, stop) rows of a circuit in a frame sorted by CircuitKey."""
+    keys = data['CircuitKey'].to_numpy()
+    return int(np.searchsorted(keys, circuit_key, 'left')), int(np.searchsorted(keys, circuit_key, 'right'))
+
+def select_circuit(data, circuit_identifier, index=None):
+    """Rows of the circuits matching an identifier.
+
+    Frames carrying surrogate keys (sorted by CircuitKey, as returned by
+    load_or_build_comprehensive_data) are sliced by row range; others fall back to
+    scanning CircuitName.
+    """
+    if 'CircuitKey' not in data.columns:
+        return data[data['CircuitName'].str.contains(circuit_identifier, case=False, na=False, regex=False)]
+    if index is None:
+        index = load_dataset_index()
+
+    ranges = [circuit_row_range(data, key) for key in circuit_keys(index, circuit_identifier)]
+    ranges = [(start, stop) for start, stop in ranges if stop > start]
+    if len(ranges) == 1:
+        return data.iloc[ranges[0][0]:ranges[0][1]]
+    return data.iloc[np.concatenate([np.arange(start, stop) for start, stop in ranges] or [np.arange(0)])]
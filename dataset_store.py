@@ -0,0 +1,104 @@
+import os
+import shutil
+from urllib.parse import quote
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from config import logger, DATASET_DIR, MERGE_KEYS, RACE_TARGET_COLS, RACE_PACE_COLS, FEATURE_COLS
+from schema import SCHEMAS, apply_schema
+from profiling import profiled, count
+
+# Columns read by default: merge keys plus what training and prediction use
+RACE_COLUMNS = MERGE_KEYS + ['RoundNumber'] + RACE_TARGET_COLS + ['FinishPosition'] + RACE_PACE_COLS
+QUALI_COLUMNS = MERGE_KEYS + ['RoundNumber'] + [col for col in FEATURE_COLS if col not in MERGE_KEYS]
+
+# Columns of each driver's race history, from which prior-race and form features are derived
+RACE_HISTORY_COLUMNS = MERGE_KEYS + ['RoundNumber', 'LapTime (s)_mean', 'FinishPosition'] + RACE_PACE_COLS
+
+PARTITIONING = ds.partitioning(pa.schema([('Year', pa.int16()), ('CircuitName', pa.string())]), flavor="hive")
+
+def store_path(kind):
+    """Directory holding the partitions of one table ("race" or "quali")."""
+    return os.path.join(DATASET_DIR, kind)
+
+def store_exists(kind):
+    """Check whether a table has at least one partition on disk."""
+    path = store_path(kind)
+    return os.path.isdir(path) and any(os.scandir(path))
+
+def cast_dtypes(data, kind):
+    """Cast a frame to the schema dtypes of a table, storing any extra text columns as strings."""
+    data = apply_schema(data, SCHEMAS[kind], project=False)
+    for col in data.columns:
+        if data[col].dtype == object:
+            data[col] = data[col].astype('string')
+    return data
+
+def write_partition(data, kind):
+    """Write the rows of a single (Year, CircuitName) event, replacing any previous copy."""
+    year = int(data['Year'].iloc[0])
+    circuit_name = str(data['CircuitName'].iloc[0])
+    partition_dir = os.path.join(store_path(kind), f"Year={year}", f"CircuitName={quote(circuit_name, safe='')}")
+    os.makedirs(partition_dir, exist_ok=True)
+
+    # Partition values live in the directory names, not in the files
+    table = pa.Table.from_pandas(cast_dtypes(data.drop(columns=['Year', 'CircuitName']), kind), preserve_index=False)
+    tmp_path = os.path.join(partition_dir, "data.parquet.tmp")
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, os.path.join(partition_dir, "data.parquet"))
+
+@profiled("dataset.write")
+def write_partitions(data, kind):
+    """Write a frame that may span several events, one partition per (Year, CircuitName)."""
+    count("dataset rows written", len(data))
+    for _, event_data in data.groupby(['Year', 'CircuitName'], sort=False, observed=True):
+        write_partition(event_data, kind)
+
+def _open_dataset(kind):
+    """Open a table as a dataset whose schema covers columns of every partition."""
+    dataset = ds.dataset(store_path(kind), format="parquet", partitioning=PARTITIONING)
+    schemas = [fragment.physical_schema for fragment in dataset.get_fragments()]
+    schema = pa.unify_schemas(schemas + [PARTITIONING.schema], promote_options="permissive")
+    return ds.dataset(store_path(kind), format="parquet", partitioning=PARTITIONING, schema=schema)
+
+@profiled("dataset.read")
+def read_table(kind, columns=None, circuit_identifier=None, years=None):
+    """Read a table from the store, optionally projecting columns and filtering partitions.
+
+    `circuit_identifier` keeps circuits whose name contains it (case-insensitive) and
+    `years` keeps the given seasons; both are evaluated on partition paths, so
+    unrelated partitions are never opened.
+    """
+    dataset = _open_dataset(kind)
+    if columns is not None:
+        columns = [col for col in columns if col in dataset.schema.names]
+
+    filters = []
+    if circuit_identifier:
+        filters.append(pc.match_substring(ds.field('CircuitName'), circuit_identifier, ignore_case=True))
+    if years is not None:
+        filters.append(ds.field('Year').isin([int(year) for year in years]))
+    row_filter = None
+    for expression in filters:
+        row_filter = expression if row_filter is None else row_filter & expression
+
+    table = dataset.to_table(columns=columns, filter=row_filter)
+    count("dataset rows read", table.num_rows)
+    count("dataset bytes read", table.nbytes)
+    return apply_schema(table.to_pandas(), SCHEMAS[kind], project=False)
+
+@profiled("dataset.migrate_csv")
+def migrate_csv(csv_path, kind):
+    """Convert a legacy CSV cache into store partitions."""
+    logger.info(f"Migrating {csv_path} to the partitioned dataset store...")
+    data = pd.read_csv(csv_path)
+    if data.empty:
+        return 0
+    if os.path.isdir(store_path(kind)):
+        shutil.rmtree(store_path(kind))
+    write_partitions(data, kind)
+    logger.info(f"Migrated {len(data)} {kind} records from {csv_path}; the CSV is no longer used and can be removed")
+    return len(data)
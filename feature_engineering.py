@@ -1,7 +1,12 @@
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
 from config import (
-    STREET_CIRCUITS, HIGH_SPEED_CIRCUITS, HIGH_DOWNFORCE_CIRCUITS,
+    RACE_PACE_COLS, PRIOR_RACE_FEATURE_COLS, STREET_CIRCUITS, HIGH_SPEED_CIRCUITS, HIGH_DOWNFORCE_CIRCUITS,
     HIGH_ALTITUDE_CIRCUITS, HIGH_TEMP_CIRCUITS, WET_PRONE_CIRCUITS
 )
+from profiling import profiled
 
 def extract_circuit_features(circuit_name):
     """Extract features specific to a circuit based on its name."""
@@ -17,43 +22,78 @@ def extract_circuit_features(circuit_name):
     }
     return features
 
+# Circuit flag columns in output order
+CIRCUIT_FEATURE_COLS = [
+    'is_street_circuit', 'is_high_speed', 'is_high_downforce',
+    'is_high_altitude', 'is_high_temp', 'is_wet_prone'
+]
+
+@lru_cache(maxsize=None)
+def circuit_feature_row(circuit_name):
+    """Return the circuit flags of a circuit as a tuple ordered like CIRCUIT_FEATURE_COLS."""
+    features = extract_circuit_features(circuit_name)
+    return tuple(features[feature_name] for feature_name in CIRCUIT_FEATURE_COLS)
+
+@profiled("features.circuit")
 def enhance_data_with_circuit_features(data):
-    """Add circuit-specific features to the dataset."""
+    """Add circuit-specific features to the dataset.
+    
+    Flags are computed once per unique circuit name and broadcast back to the
+    rows through their factorized codes.
+    """
     if data is None:
         return None
     
-    # Extract features for each circuit
-    for feature_name in [
-        'is_street_circuit', 'is_high_speed', 'is_high_downforce',
-        'is_high_altitude', 'is_high_temp', 'is_wet_prone'
-    ]:
-        data[feature_name] = data['CircuitName'].apply(
-            lambda x: extract_circuit_features(x)[feature_name]
-        )
+    codes, circuit_names = pd.factorize(data['CircuitName'])
+    
+    # One row of flags per unique circuit, plus an all-False row for missing names (code -1)
+    table = np.zeros((len(circuit_names) + 1, len(CIRCUIT_FEATURE_COLS)), dtype=bool)
+    for i, circuit_name in enumerate(circuit_names):
+        table[i] = circuit_feature_row(str(circuit_name))
+    
+    flags = table[codes]
+    for j, feature_name in enumerate(CIRCUIT_FEATURE_COLS):
+        data[feature_name] = flags[:, j]
     
     return data
 
-def prepare_features_for_model(data, feature_cols):
-    """Prepare features for model training or prediction."""
-    if data is None:
-        return None
+def _event_order(data):
+    """Chronological position of each row's event; NaN when the round is unknown."""
+    rounds = data['RoundNumber'].to_numpy(dtype=float)
+    return np.where(rounds > 0, data['Year'].to_numpy(dtype=float) * 100 + rounds, np.nan)
+
+@profiled("features.prior_race")
+def add_prior_race_features(data, history):
+    """Add each driver's race pace from their latest race before the row's event.
     
-    # Make sure all required feature columns exist
-    for col in feature_cols[:]:
-        if col not in data.columns:
-            data[col] = 0  # Add missing columns with default values
-    
-    # Convert boolean features to int
-    for col in feature_cols:
-        if data[col].dtype == bool:
-            data[col] = data[col].astype(int)
-    
-    # Handle missing values with median
-    for col in feature_cols:
-        if data[col].isna().any():
-            if data[col].notna().any():
-                data[col] = data[col].fillna(data[col].median())
-            else:
-                data[col] = 0
-    
-    return data[feature_cols]
\ No newline at end of file
+    `history` holds per-race pace rows (FullName, Year, RoundNumber and
+    RACE_PACE_COLS). Only strictly earlier events are used, so a race never sees
+    its own laps; rows without an earlier race or a known round get NaN.
+    """
+    data = data.copy()
+    for col in PRIOR_RACE_FEATURE_COLS:
+        data[col] = np.nan
+    required = ['FullName', 'Year', 'RoundNumber']
+    if history is None or not all(col in data.columns and col in history.columns for col in required):
+        return data
+    pace_cols = [col for col in RACE_PACE_COLS if col in history.columns]
+    
+    left = pd.DataFrame({'_row': np.arange(len(data)), 'FullName': data['FullName'].astype(str).to_numpy(),
+                         '_event': _event_order(data)}).dropna(subset=['_event'])
+    right = pd.DataFrame({'FullName': history['FullName'].astype(str).to_numpy(), '_event': _event_order(history)})
+    for col in pace_cols:
+        right[col] = history[col].to_numpy(dtype=float)
+    right = right.dropna(subset=['_event']).drop_duplicates(['FullName', '_event'])
+    if left.empty or right.empty:
+        return data
+    
+    prior = pd.merge_asof(
+        left.sort_values('_event'), right.sort_values('_event'),
+        on='_event', by='FullName', allow_exact_matches=False, direction='backward'
+    )
+    rows = prior['_row'].to_numpy()
+    for col in pace_cols:
+        values = data[f"Last{col}"].to_numpy(dtype=float)
+        values[rows] = prior[col].to_numpy()
+        data[f"Last{col}"] = values
+    return data
@@ -0,0 +1,154 @@
+import heapq
+import importlib
+import itertools
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+from config import (
+    logger, FETCH_TIMEOUT_SECONDS, FETCH_RETRIES, FETCH_BACKOFF_SECONDS, FETCH_BACKOFF_MAX_SECONDS,
+    FETCH_MAX_CONCURRENCY
+)
+from profiling import count
+
+# Queue priorities; lower values are fetched first
+PRIORITY_TARGET = 0   # the qualifying session of the race being predicted
+PRIORITY_RESULTS = 1  # results of a race being validated
+PRIORITY_INGEST = 10  # historical sessions for the dataset
+
+# Exception types treated as transient when raised by backends that do not subclass OSError
+TRANSIENT_ERROR_NAMES = {'Timeout', 'ReadTimeout', 'ConnectTimeout', 'ConnectionError', 'HTTPError',
+                         'ChunkedEncodingError', 'RateLimitExceededError'}
+
+class SessionUnavailable(Exception):
+    """Raised when the backend reports that a session does not exist or has no data."""
+
+class FetchFailed(Exception):
+    """Raised when a session could not be loaded after every retry of a transient error."""
+
+class FetchTimeout(TimeoutError):
+    """Raised when one load attempt runs past the per-session timeout."""
+
+def is_transient(error):
+    """Whether a load error is worth retrying (network, timeouts, rate limits)."""
+    return isinstance(error, (TimeoutError, ConnectionError, OSError)) or type(error).__name__ in TRANSIENT_ERROR_NAMES
+
+class FetchScheduler:
+    """Load backend sessions through a priority queue with timeouts, retries and a concurrency cap.
+
+    `max_concurrency` worker threads take requests in priority order (then
+    submission order). Each attempt runs in its own daemon thread so a hung
+    load can be abandoned after `timeout` seconds; an abandoned load keeps its
+    thread until the backend returns, so momentarily more than
+    `max_concurrency` loads can be running. Transient errors are retried
+    `retries` times with exponential backoff and jitter.
+    """
+
+    def __init__(self, backend, max_concurrency=FETCH_MAX_CONCURRENCY, timeout=FETCH_TIMEOUT_SECONDS,
+                 retries=FETCH_RETRIES, backoff=FETCH_BACKOFF_SECONDS, backoff_max=FETCH_BACKOFF_MAX_SECONDS):
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self._queue = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._workers = []
+
+    def submit(self, year, grand_prix, session_type, load_options=None, priority=PRIORITY_INGEST):
+        """Queue a session load and return a Future of the loaded session."""
+        future = Future()
+        request = (year, grand_prix, session_type, load_options or {})
+        with self._condition:
+            heapq.heappush(self._queue, (priority, next(self._sequence), request, future))
+            if len(self._workers) < self.max_concurrency:
+                worker = threading.Thread(target=self._work, name=f"fetch-{len(self._workers)}", daemon=True)
+                self._workers.append(worker)
+                worker.start()
+            self._condition.notify()
+        return future
+
+    def fetch(self, year, grand_prix, session_type, load_options=None, priority=PRIORITY_INGEST):
+        """Load a session and wait for it; raises SessionUnavailable or FetchFailed."""
+        return self.submit(year, grand_prix, session_type, load_options, priority).result()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                _, _, request, future = heapq.heappop(self._queue)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._load(*request))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def _load(self, year, grand_prix, session_type, load_options):
+        """Load one session, retrying transient errors with exponential backoff."""
+        for attempt in range(self.retries + 1):
+            try:
+                return self._attempt(year, grand_prix, session_type, load_options)
+            except Exception as e:
+                if not is_transient(e):
+                    raise SessionUnavailable(f"{year} {grand_prix} {session_type}: {e}") from e
+                if attempt == self.retries:
+                    count("fetch failures")
+                    raise FetchFailed(
+                        f"{year} {grand_prix} {session_type} failed after {attempt + 1} attempts: {e}"
+                    ) from e
+                delay = min(self.backoff_max, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+                count("fetch retries")
+                logger.info(f"Retrying {year} {grand_prix} {session_type} in {delay:.1f}s after: {e}")
+                time.sleep(delay)
+
+    def _attempt(self, year, grand_prix, session_type, load_options):
+        """Create and load a session in a separate thread, giving up after the timeout."""
+        outcome = {}
+
+        def load():
+            try:
+                session = importlib.import_module(self.backend).get_session(year, grand_prix, session_type)
+                session.load(**load_options)
+                outcome['session'] = session
+            except BaseException as e:
+                outcome['error'] = e
+
+        thread = threading.Thread(target=load, name=f"load-{year}-{session_type}", daemon=True)
+        thread.start()
+        thread.join(self.timeout)
+        if thread.is_alive():
+            count("fetch timeouts")
+            raise FetchTimeout(f"load did not finish within {self.timeout}s")
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome['session']
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def get_scheduler(backend):
+    """Return the process-wide scheduler of a backend."""
+    with _schedulers_lock:
+        if backend not in _schedulers:
+            _schedulers[backend] = FetchScheduler(backend)
+        return _schedulers[backend]
+
+def _forget_schedulers():
+    """Drop the schedulers a forked child inherited.
+
+    Their worker threads and queued requests belong to the parent, so a child
+    such as a build worker starts with fresh schedulers instead of waiting on
+    threads that do not exist in it or repeating the parent's queued loads.
+    """
+    global _schedulers_lock
+    _schedulers.clear()
+    _schedulers_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_schedulers)
@@ -0,0 +1,43 @@
+import random
+import time
+
+import synthetic
+from config import FLAKY_LATENCY_SECONDS, FLAKY_FAILURE_RATE, FLAKY_HANG_RATE, FLAKY_HANG_SECONDS
+
+# Current fault injection settings; change them with configure()
+faults = {
+    'latency': FLAKY_LATENCY_SECONDS,
+    'failure_rate': FLAKY_FAILURE_RATE,
+    'hang_rate': FLAKY_HANG_RATE,
+    'hang_seconds': FLAKY_HANG_SECONDS,
+}
+_rng = random.Random()
+
+def configure(seed=None, **settings):
+    """Update the fault injection settings and optionally reseed the fault draws."""
+    unknown = set(settings) - set(faults)
+    if unknown:
+        raise ValueError(f"Unknown fault settings: {', '.join(sorted(unknown))}")
+    faults.update(settings)
+    if seed is not None:
+        _rng.seed(seed)
+
+class FlakySession(synthetic.FakeSession):
+    """Synthetic session whose load is slow, sometimes fails transiently and sometimes hangs."""
+
+    def load(self, **kwargs):
+        draw = _rng.random()
+        time.sleep(faults['latency'])
+        if draw < faults['hang_rate']:
+            time.sleep(faults['hang_seconds'])
+        elif draw < faults['hang_rate'] + faults['failure_rate']:
+            raise ConnectionError(f"Injected failure loading {self.event.year} {self.event.name} {self.session_type}")
+        super().load(**kwargs)
+
+def get_session(year, grand_prix, session_type):
+    """Like synthetic.get_session, with injected latency and failures on load."""
+    if grand_prix not in synthetic.get_season_calendar(year):
+        raise ValueError(f"No synthetic event '{grand_prix}' in {year}")
+    return FlakySession(year, grand_prix, session_type)
+
+get_event_schedule = synthetic.get_event_schedule
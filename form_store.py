@@ -0,0 +1,241 @@
+import os
+import json
+from collections import deque
+import numpy as np
+import pandas as pd
+
+from config import logger, FORM_STATE_PATH, FORM_WINDOW, FORM_TEAM_ALPHA, FORM_FEATURE_COLS
+from profiling import profiled
+
+# Columns of a race row the form state is updated from
+FORM_SOURCE_COLUMNS = ['FullName', 'TeamName', 'CircuitName', 'Year', 'RoundNumber', 'FinishPosition', 'LapTime (s)_mean']
+
+def event_key(year, round_number):
+    """Chronological key of an event, or None when its round is unknown."""
+    if pd.isna(year) or pd.isna(round_number) or round_number <= 0:
+        return None
+    return (int(year), int(round_number))
+
+class _Window:
+    """Last-N values with a running sum and count of the non-missing ones."""
+
+    def __init__(self, size, values=()):
+        self.values = deque(maxlen=size)
+        self.total = 0.0
+        self.count = 0
+        for value in values:
+            self.push(value)
+
+    def push(self, value):
+        if len(self.values) == self.values.maxlen:
+            dropped = self.values[0]
+            if not np.isnan(dropped):
+                self.total -= dropped
+                self.count -= 1
+        self.values.append(value)
+        if not np.isnan(value):
+            self.total += value
+            self.count += 1
+
+    def mean(self):
+        return self.total / self.count if self.count else np.nan
+
+class FormStore:
+    """Rolling driver, team and circuit form, updated in constant time per driver and event.
+
+    Features read before an event is applied only reflect earlier events, which
+    is what makes them point-in-time correct.
+    """
+
+    def __init__(self, window=FORM_WINDOW, alpha=FORM_TEAM_ALPHA):
+        self.window = window
+        self.alpha = alpha
+        self.positions = {}
+        self.paces = {}
+        self.teams = {}
+        self.circuits = {}
+        self.last_event = None
+
+    def features(self, drivers, teams, circuit_name):
+        """Form features for the given drivers (and their teams) ahead of a race at `circuit_name`."""
+        features = {col: np.full(len(drivers), np.nan) for col in FORM_FEATURE_COLS}
+        for i, (driver, team) in enumerate(zip(drivers, teams)):
+            if driver in self.positions:
+                features['DriverFormPosition'][i] = self.positions[driver].mean()
+                features['DriverFormPace'][i] = self.paces[driver].mean()
+            if team in self.teams:
+                features['TeamFormPace'][i], features['TeamPaceTrend'][i] = self.teams[team]
+            starts, position_total = self.circuits.get(f"{driver}|{circuit_name}", (0, 0.0))
+            features['CircuitHistoryStarts'][i] = starts
+            if starts:
+                features['CircuitHistoryPosition'][i] = position_total / starts
+        return features
+
+    def update(self, event):
+        """Apply the race rows of one event."""
+        lap_times = event['LapTime (s)_mean'].to_numpy(dtype=float)
+        pace = lap_times - np.nanmedian(lap_times) if np.isfinite(lap_times).any() else lap_times
+        positions = event['FinishPosition'].to_numpy(dtype=float)
+        circuit_name = str(event['CircuitName'].iloc[0])
+
+        team_paces = {}
+        for driver, team, position, driver_pace in zip(event['FullName'].astype(str), event['TeamName'].astype(str),
+                                                      positions, pace):
+            if driver not in self.positions:
+                self.positions[driver] = _Window(self.window)
+                self.paces[driver] = _Window(self.window)
+            self.positions[driver].push(position)
+            self.paces[driver].push(driver_pace)
+            if not np.isnan(position):
+                starts, position_total = self.circuits.get(f"{driver}|{circuit_name}", (0, 0.0))
+                self.circuits[f"{driver}|{circuit_name}"] = (starts + 1, position_total + position)
+            if not np.isnan(driver_pace):
+                team_paces.setdefault(team, []).append(driver_pace)
+
+        # Team pace and its trend as exponentially weighted averages
+        for team, values in team_paces.items():
+            team_pace = sum(values) / len(values)
+            if team not in self.teams:
+                self.teams[team] = (team_pace, 0.0)
+            else:
+                previous_pace, trend = self.teams[team]
+                smoothed = previous_pace + self.alpha * (team_pace - previous_pace)
+                self.teams[team] = (smoothed, trend + self.alpha * ((smoothed - previous_pace) - trend))
+
+        self.last_event = event_key(event['Year'].iloc[0], event['RoundNumber'].iloc[0])
+
+    def to_dict(self):
+        return {
+            'window': self.window,
+            'alpha': self.alpha,
+            'last_event': self.last_event,
+            'positions': {driver: list(values.values) for driver, values in self.positions.items()},
+            'paces': {driver: list(values.values) for driver, values in self.paces.items()},
+            'teams': self.teams,
+            'circuits': self.circuits,
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        store = cls(state['window'], state['alpha'])
+        store.last_event = tuple(state['last_event']) if state['last_event'] else None
+        store.positions = {driver: _Window(store.window, values) for driver, values in state['positions'].items()}
+        store.paces = {driver: _Window(store.window, values) for driver, values in state['paces'].items()}
+        store.teams = {team: tuple(values) for team, values in state['teams'].items()}
+        store.circuits = {key: tuple(values) for key, values in state['circuits'].items()}
+        return store
+
+def _events(data):
+    """Group row positions of a frame by event key, in chronological order."""
+    keys = [event_key(year, round_number) for year, round_number in zip(data['Year'], data['RoundNumber'])]
+    groups = {}
+    for row, key in enumerate(keys):
+        if key is not None:
+            groups.setdefault(key, []).append(row)
+    return dict(sorted(groups.items()))
+
+def load_form_store(path=FORM_STATE_PATH):
+    """Load the persisted form state, or None when there is none."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return FormStore.from_dict(json.load(f))
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Ignoring unreadable form state {path}: {e}")
+        return None
+
+def save_form_store(store, path=FORM_STATE_PATH):
+    """Write the form state atomically."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(store.to_dict(), f)
+    os.replace(tmp_path, path)
+
+def rebuild_form_store(history):
+    """Build a form state from every race of a history frame."""
+    store = FormStore()
+    if history is None or any(col not in history.columns for col in FORM_SOURCE_COLUMNS):
+        return store
+    for rows in _events(history).values():
+        store.update(history.iloc[rows])
+    return store
+
+def update_form_store(store, race_frames, load_history):
+    """Apply newly ingested race frames to a form state, one event at a time.
+
+    Events later than the last applied one are added in order. When one is not
+    (a gap in the history was filled), the state is rebuilt from
+    `load_history()`, which must return every stored race including the new ones.
+    """
+    frames = [frame for frame in race_frames if frame is not None and not frame.empty]
+    if not frames:
+        return store
+    new_data = pd.concat([frame[[col for col in FORM_SOURCE_COLUMNS if col in frame.columns]] for frame in frames],
+                         ignore_index=True)
+    if any(col not in new_data.columns for col in FORM_SOURCE_COLUMNS):
+        return store
+    events = _events(new_data)
+
+    if store.last_event is not None and events and min(events) <= store.last_event:
+        logger.info("Rebuilding form state: new events precede the last applied one")
+        return rebuild_form_store(load_history())
+    for rows in events.values():
+        store.update(new_data.iloc[rows])
+    return store
+
+@profiled("features.form")
+def add_form_features(data, history):
+    """Add point-in-time form features to rows, replaying `history` in event order.
+
+    Each row gets the form built from races strictly before its own event, so
+    training rows and backtest folds never see the race they describe.
+    """
+    data = data.copy()
+    for col in FORM_FEATURE_COLS:
+        data[col] = np.nan
+    required = ['FullName', 'TeamName', 'CircuitName', 'Year', 'RoundNumber']
+    if history is None or not all(col in data.columns for col in required) or \
+            not all(col in history.columns for col in FORM_SOURCE_COLUMNS):
+        return data
+
+    history_events = _events(history)
+    target_events = _events(data)
+    values = {col: data[col].to_numpy(dtype=float) for col in FORM_FEATURE_COLS}
+    drivers = data['FullName'].astype(str).to_numpy()
+    teams = data['TeamName'].astype(str).to_numpy()
+    circuits = data['CircuitName'].astype(str).to_numpy()
+
+    store = FormStore()
+    for key in sorted(set(history_events) | set(target_events)):
+        rows = target_events.get(key)
+        if rows is not None:
+            features = store.features(drivers[rows], teams[rows], circuits[rows[0]])
+            for col, column_values in features.items():
+                values[col][rows] = column_values
+        if key in history_events:
+            store.update(history.iloc[history_events[key]])
+
+    for col, column_values in values.items():
+        data[col] = column_values
+    return data
+
+def form_features_for_event(data, history, store=None):
+    """Add form features to the rows of one upcoming or past event.
+
+    The persisted state answers in O(drivers) when the event comes after every
+    race it has applied; otherwise the history is replayed up to the event.
+    """
+    key = event_key(data['Year'].iloc[0], data['RoundNumber'].iloc[0]) if 'RoundNumber' in data.columns else None
+    if store is None:
+        store = load_form_store()
+    if key is None or store is None or store.last_event is None or key <= store.last_event:
+        return add_form_features(data, history)
+
+    data = data.copy()
+    features = store.features(data['FullName'].astype(str).to_numpy(), data['TeamName'].astype(str).to_numpy(),
+                              str(data['CircuitName'].iloc[0]))
+    for col, column_values in features.items():
+        data[col] = column_values
+    return data
@@ -1,69 +1,164 @@
-import fastf1
+import argparse
 from datetime import datetime
 import traceback
 
-from config import logger, CACHE_DIR
-from utils import suppress_warnings, display_comparison_results
+from config import (
+    logger, setup_logging, ensure_cache_dir, CACHE_DIR, SESSION_BACKEND,
+    SERVICE_HOST, SERVICE_PORT, SERVICE_MAX_CONCURRENCY, SIMULATION_DRAWS
+)
+from utils import suppress_warnings, display_comparison_results, get_circuit_identifier
 from data_loader import (
-    load_or_build_comprehensive_data, 
-    get_circuit_specific_data, 
+    ensure_dataset, 
     get_race_data, 
-    get_current_quali_data
+    get_current_quali_data,
+    prefetch_session
 )
-from model import train_comprehensive_model, predict_race_winner
+from fetch_scheduler import PRIORITY_RESULTS
+from model import predict_race_winner
+from materialize import load_training_matrix, get_or_train_matrix_model
+from profiling import stage, add_profile_arguments, start_profile, finish_profile
+from simulation import simulate_race, log_probabilities
+
+def parse_args(argv=None):
+    """Parse command line arguments; with no race given, main() prompts for one."""
+    parser = argparse.ArgumentParser(description="Predict Formula 1 race results from qualifying data.")
+    parser.add_argument('--year', type=int, help="race year to predict")
+    parser.add_argument('--grand-prix', help="Grand Prix name, e.g. 'Australian Grand Prix'")
+    parser.add_argument('--occurred', action='store_true',
+                        help="treat a race of the current season as already run and validate against its result")
+    parser.add_argument('--actual-winner', help="actual winner, logged for reference when validating")
+    parser.add_argument('--output', help="prediction CSV path (default: prediction_<year>_<grand_prix>.csv)")
+    parser.add_argument('--simulate', type=int, nargs='?', const=SIMULATION_DRAWS, metavar='DRAWS',
+                        help=f"simulate the race DRAWS times (default {SIMULATION_DRAWS}) for win/podium probabilities")
+    parser.add_argument('--seed', type=int, default=None, help="random seed of --simulate")
+    parser.add_argument('--stream-training', action='store_true',
+                        help="train through a streaming quantile DMatrix over the circuit matrices")
+    parser.add_argument('--external-memory', action='store_true',
+                        help="like --stream-training, caching the DMatrix on disk for data larger than memory")
+    parser.add_argument('--refresh', action='store_true', help="ingest events missing from the dataset before predicting")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes for building the dataset")
+    parser.add_argument('--backend', default=SESSION_BACKEND, help="module providing get_session()")
+    parser.add_argument('--serve', choices=['http', 'stdin'],
+                        help="keep the dataset and models in memory and answer requests over HTTP or JSON lines on stdin")
+    parser.add_argument('--host', default=SERVICE_HOST, help="HTTP service host")
+    parser.add_argument('--port', type=int, default=SERVICE_PORT, help="HTTP service port")
+    parser.add_argument('--max-concurrency', type=int, default=SERVICE_MAX_CONCURRENCY,
+                        help="predictions served at the same time")
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    
+    if (args.year is None) != (args.grand_prix is None):
+        parser.error("--year and --grand-prix must be given together")
+    return args
 
-def main():
+def main(argv=None):
     """Main function to run the comprehensive F1 prediction model."""
+    args = parse_args(argv)
+    setup_logging()
+    
     # Suppress warnings for cleaner output
     suppress_warnings()
     
-    # Enable fastF1 cache
-    fastf1.Cache.enable_cache(CACHE_DIR)
-    
-    # Get user input
+    # Stage timings and counters are only recorded with --profile
+    start_profile(args)
     try:
-        year = int(input("Enter race year to predict: "))
-        grand_prix = input("Enter Grand Prix name (e.g., 'Australian Grand Prix'): ")
-    except ValueError:
-        logger.error("Invalid year input. Please enter a valid integer year.")
+        run(args)
+    finally:
+        finish_profile(args)
+
+def run(args):
+    """Serve or predict as the parsed command line asks."""
+    # Enable fastF1 cache (fastf1 is only imported when it is the session backend)
+    ensure_cache_dir()
+    if args.backend == "fastf1":
+        import fastf1
+        fastf1.Cache.enable_cache(CACHE_DIR)
+    
+    if args.serve:
+        from service import PredictionService, serve_http, serve_stdin
+        service = PredictionService(backend=args.backend, max_concurrency=args.max_concurrency, refresh=args.refresh)
+        if args.serve == "http":
+            serve_http(service, args.host, args.port)
+        else:
+            serve_stdin(service)
         return
     
-    # For validation, check if race has already happened
     current_date = datetime.now()
-    race_already_happened = (year < current_date.year) or \
-                           (year == current_date.year and input("Has this race already occurred? (y/n): ").lower() == 'y')
-    
-    if race_already_happened:
-        actual_winner = input("Enter the actual winner (for validation): ")
+    if args.year is not None:
+        year, grand_prix = args.year, args.grand_prix
+        race_already_happened = year < current_date.year or args.occurred
+        actual_winner = args.actual_winner
+    else:
+        # Get user input
+        try:
+            year = int(input("Enter race year to predict: "))
+            grand_prix = input("Enter Grand Prix name (e.g., 'Australian Grand Prix'): ")
+        except ValueError:
+            logger.error("Invalid year input. Please enter a valid integer year.")
+            return
+        
+        # For validation, check if race has already happened
+        race_already_happened = (year < current_date.year) or \
+                               (year == current_date.year and input("Has this race already occurred? (y/n): ").lower() == 'y')
+        actual_winner = input("Enter the actual winner (for validation): ") if race_already_happened else None
+    
+    if actual_winner:
         logger.info(f"Note: The actual winner of {year} {grand_prix} was {actual_winner}")
     
-    # Load or build comprehensive dataset
+    run_prediction(year, grand_prix, race_already_happened, backend=args.backend, refresh=args.refresh,
+                   workers=args.workers, output=args.output, simulate=args.simulate, seed=args.seed,
+                   stream_training=args.stream_training or args.external_memory, external_memory=args.external_memory)
+
+def train_streamed_model(circuit_identifier, target_year, external_memory=False, backend=SESSION_BACKEND):
+    """Stream-train the circuit's model, or the general one when the circuit has no races."""
+    # XGBoost is only imported for training, to keep prediction startup fast
+    from stream_training import get_or_train_streaming_model
+    
+    logger.info("\n🔧 Training prediction model from streamed matrices...")
+    model = get_or_train_streaming_model(circuit_identifier, target_year, external_memory, backend=backend)
+    if model is not None:
+        logger.info(f"Using circuit-specific model for {circuit_identifier}")
+        return model
+    logger.info("Using general model with all historical data")
+    return get_or_train_streaming_model(None, target_year, external_memory, backend=backend)
+
+def run_prediction(year, grand_prix, race_already_happened, backend=SESSION_BACKEND, refresh=False,
+                   workers=None, output=None, simulate=None, seed=None, stream_training=False,
+                   external_memory=False):
+    """Predict one race, validate it against the result if it has run, and save the prediction.
+    
+    With `simulate`, the race is also simulated that many times and the win,
+    podium and points probabilities are added to the saved prediction. With
+    `stream_training`, the model is trained through a streaming quantile
+    DMatrix, its pages cached on disk with `external_memory`.
+    """
+    # The target qualifying session loads in the background, ahead of any dataset ingestion
+    quali_future = prefetch_session(year, grand_prix, "Q", backend)
+    
+    # Build or refresh the dataset, then load the circuit's materialized training matrix
     logger.info("\n📊 Loading historical F1 data...")
-    all_race_data, all_quali_data = load_or_build_comprehensive_data()
-    
-    if all_race_data is None or all_quali_data is None:
+    circuit_identifier = get_circuit_identifier(grand_prix)
+    if not ensure_dataset(workers=workers, backend=backend, refresh=refresh):
         logger.error("Failed to get historical data. Exiting.")
         return
     
-    # Get circuit-specific data (optional)
-    circuit_identifier = grand_prix.split(' ')[0]  # Use first word of GP name as circuit identifier
-    circuit_race_data, circuit_quali_data = get_circuit_specific_data(all_race_data, all_quali_data, circuit_identifier)
-    
-    if circuit_race_data is not None and not circuit_race_data.empty:
-        logger.info(f"Using circuit-specific model for {circuit_identifier}")
-        training_race_data, training_quali_data = circuit_race_data, circuit_quali_data
+    # Train model excluding target year (for validation), reusing a cached one when inputs match
+    target_year = year if race_already_happened else None
+    if stream_training:
+        model = train_streamed_model(circuit_identifier, target_year, external_memory, backend)
     else:
-        logger.info("Using general model with all historical data")
-        training_race_data, training_quali_data = all_race_data, all_quali_data
-    
-    # Train model excluding target year (for validation)
-    logger.info("\n🔧 Training prediction model...")
-    model = train_comprehensive_model(
-        training_race_data, 
-        training_quali_data, 
-        target_circuit_name=circuit_identifier,
-        target_year=year if race_already_happened else None
-    )
+        matrix = load_training_matrix(circuit_identifier, backend)
+        if matrix is not None:
+            logger.info(f"Using circuit-specific model for {circuit_identifier}")
+        else:
+            logger.info("Using general model with all historical data")
+            matrix = load_training_matrix(None, backend)
+        if matrix is None:
+            logger.error("Failed to get historical data. Exiting.")
+            return
+        
+        logger.info("\n🔧 Training prediction model...")
+        model = get_or_train_matrix_model(matrix, target_circuit_name=circuit_identifier, target_year=target_year)
     
     if model is None:
         logger.error("Failed to train model. Exiting.")
@@ -71,7 +166,7 @@ def main():
     
     # Get current qualifying data
     logger.info(f"\n🏎️ Getting qualifying data for {grand_prix} {year}...")
-    current_quali = get_current_quali_data(year, grand_prix)
+    current_quali = get_current_quali_data(year, grand_prix, backend, prefetched=quali_future)
     
     if current_quali is None:
         logger.error(f"No qualifying data available for {grand_prix} {year}!")
@@ -85,10 +180,21 @@ def main():
         logger.error("Failed to make prediction. Exiting.")
         return
     
+    # Outcome probabilities from simulated races around the predicted lap times
+    if simulate:
+        with stage("simulation"):
+            probabilities = simulate_race(prediction, n_draws=simulate, seed=seed)
+        log_probabilities(probabilities)
+        prediction = prediction.merge(
+            probabilities[['FullName', 'WinProbability', 'PodiumProbability', 'PointsProbability', 'ExpectedPosition']],
+            on='FullName', how='left'
+        )
+    
     # If race has happened, compare with actual results
     if race_already_happened:
         try:
-            actual_race_session = get_race_data(year, grand_prix, "R")
+            actual_race_session = get_race_data(year, grand_prix, "R", backend, purpose="results",
+                                                priority=PRIORITY_RESULTS)
             if actual_race_session is not None:
                 display_comparison_results(prediction, actual_race_session.results)
             else:
@@ -97,8 +203,9 @@ def main():
             logger.error(f"Error comparing with actual results: {e}")
     
     # Save prediction to file
-    prediction_file = f"prediction_{year}_{grand_prix.replace(' ', '_')}.csv"
-    prediction.to_csv(prediction_file, index=False)
+    prediction_file = output or f"prediction_{year}_{grand_prix.replace(' ', '_')}.csv"
+    with stage("prediction.save_csv"):
+        prediction.to_csv(prediction_file, index=False)
     logger.info(f"Prediction saved to {prediction_file}")
 
 if __name__ == "__main__":
@@ -0,0 +1,311 @@
+import argparse
+import os
+import json
+import hashlib
+from functools import lru_cache
+from urllib.parse import quote, unquote
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from config import logger, setup_logging, DATASET_DIR, MATRIX_DIR, FEATURE_COLS, PROCESSOR_VERSION, SESSION_BACKEND
+from data_loader import load_or_build_comprehensive_data
+from dataset_index import load_dataset_index, circuit_keys, circuit_row_range
+from dataset_store import store_path
+from model import build_training_frame, fit_model
+from model_cache import load_cached_model, save_cached_model, load_model_params
+from preprocessing import PREPROCESSOR_VERSION, fit_preprocessor, impute
+from profiling import profiled, count
+from utils import suppress_warnings
+
+# Bump when the layout or contents of the matrix files change
+MATRIX_VERSION = 1
+
+# Directory of the matrix covering every circuit, used when a circuit has no races of its own
+ALL_CIRCUITS_DIR = "_all"
+
+TARGET_COL = 'LapTime (s)_mean'
+
+def matrix_dir(circuit_name):
+    """Directory of one circuit's matrix; None stands for all circuits together."""
+    return os.path.join(MATRIX_DIR, ALL_CIRCUITS_DIR if circuit_name is None else quote(circuit_name, safe=''))
+
+def scan_partitions():
+    """Describe every stored partition file by kind, season, circuit and (size, mtime) stamp."""
+    partitions = {}
+    for kind in ("race", "quali"):
+        root = store_path(kind)
+        if not os.path.isdir(root):
+            continue
+        for year_entry in os.scandir(root):
+            if not year_entry.name.startswith("Year="):
+                continue
+            for circuit_entry in os.scandir(year_entry.path):
+                path = os.path.join(circuit_entry.path, "data.parquet")
+                if not circuit_entry.name.startswith("CircuitName=") or not os.path.exists(path):
+                    continue
+                stat = os.stat(path)
+                partitions[os.path.relpath(path, DATASET_DIR)] = {
+                    'kind': kind,
+                    'year': int(year_entry.name[len("Year="):]),
+                    'circuit': unquote(circuit_entry.name[len("CircuitName="):]),
+                    'stamp': [stat.st_size, stat.st_mtime_ns],
+                }
+    return partitions
+
+@lru_cache(maxsize=None)
+def _partition_round(relpath, stamp):
+    """Round number of a race partition (stamp keys the cache on the file version)."""
+    rounds = pq.read_table(os.path.join(DATASET_DIR, relpath), columns=['RoundNumber']).column(0).to_numpy()
+    rounds = rounds[rounds > 0]
+    return int(rounds.min()) if len(rounds) else None
+
+def _precedes(relpath, partition, last_event):
+    """Whether a race partition is an event before `last_event` (year, round)."""
+    year, round_number = last_event
+    if partition['year'] != year:
+        return partition['year'] < year
+    partition_round = _partition_round(relpath, tuple(partition['stamp']))
+    return partition_round is not None and partition_round < round_number
+
+def matrix_sources(circuit_name, last_event, partitions):
+    """Stamps of the partitions a circuit's matrix is derived from.
+
+    These are the circuit's own race and qualifying partitions plus, because
+    prior-race and form features look back over every circuit, the race
+    partitions of all earlier events. Races added after the circuit's last one
+    do not change its rows. The matrix of all circuits depends on everything.
+    """
+    if circuit_name is None:
+        return {relpath: partition['stamp'] for relpath, partition in partitions.items()}
+    return {
+        relpath: partition['stamp'] for relpath, partition in partitions.items()
+        if partition['circuit'] == circuit_name
+        or (partition['kind'] == "race" and _precedes(relpath, partition, last_event))
+    }
+
+def load_meta(circuit_name):
+    """Read the description of a stored matrix, or None without one."""
+    path = os.path.join(matrix_dir(circuit_name), "meta.json")
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable matrix description {path}: {e}")
+    return None
+
+def is_fresh(meta, partitions):
+    """Whether a stored matrix still matches its source partitions and the feature configuration."""
+    if meta is None or meta.get('version') != MATRIX_VERSION:
+        return False
+    if meta.get('feature_cols') != FEATURE_COLS or meta.get('processor_version') != PROCESSOR_VERSION:
+        return False
+    return meta['sources'] == matrix_sources(meta['circuit'], meta['last_event'], partitions)
+
+def _save_array(directory, name, values):
+    path = os.path.join(directory, f"{name}.npy")
+    tmp_path = os.path.join(directory, f"{name}.tmp.npy")
+    np.save(tmp_path, values)
+    os.replace(tmp_path, path)
+
+def write_matrix(circuit_name, combined_data, partitions):
+    """Store the feature matrix, target and seasons of a merged training frame as .npy files.
+
+    The description is written last, so a matrix interrupted mid-write is
+    never taken as fresh.
+    """
+    features = [col for col in FEATURE_COLS if col in combined_data.columns]
+    years = combined_data['Year'].to_numpy(dtype=np.int16)
+    rounds = combined_data['RoundNumber'].fillna(0).to_numpy(dtype=np.int64)
+    last_event = None if circuit_name is None else max(zip(years.tolist(), rounds.tolist()))
+
+    directory = matrix_dir(circuit_name)
+    os.makedirs(directory, exist_ok=True)
+    _save_array(directory, "X", combined_data[features].to_numpy(dtype=np.float32))
+    _save_array(directory, "y", combined_data[TARGET_COL].to_numpy(dtype=np.float32))
+    _save_array(directory, "years", years)
+
+    meta = {
+        'circuit': circuit_name,
+        'features': features,
+        'rows': len(combined_data),
+        'last_event': last_event,
+        'sources': matrix_sources(circuit_name, last_event, partitions),
+        'version': MATRIX_VERSION,
+        'feature_cols': FEATURE_COLS,
+        'processor_version': PROCESSOR_VERSION,
+    }
+    tmp_path = os.path.join(directory, "meta.json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=1)
+    os.replace(tmp_path, os.path.join(directory, "meta.json"))
+    return meta
+
+def _circuit_rows(data, index, circuit_name):
+    start, stop = circuit_row_range(data, index['circuits'].index(circuit_name))
+    return data.iloc[start:stop]
+
+@profiled("materialize")
+def materialize_matrices(circuit_names=None, force=False, backend=SESSION_BACKEND, partitions=None):
+    """Write the training matrices that are missing or stale.
+
+    `circuit_names` defaults to every stored circuit plus None, the matrix of
+    all circuits. Only stale matrices are rebuilt; a single stale circuit reads
+    just its own partitions and the race history. Returns the number written.
+    """
+    if partitions is None:
+        partitions = scan_partitions()
+    if circuit_names is None:
+        circuit_names = sorted({p['circuit'] for p in partitions.values() if p['kind'] == "race"}) + [None]
+    stale = [name for name in circuit_names if force or not is_fresh(load_meta(name), partitions)]
+    if not stale:
+        return 0
+
+    circuit_identifier = stale[0] if len(stale) == 1 and stale[0] is not None else None
+    race_data, quali_data = load_or_build_comprehensive_data(backend=backend, circuit_identifier=circuit_identifier)
+    if race_data is None or quali_data is None:
+        return 0
+    partitions = scan_partitions()
+    index = load_dataset_index()
+
+    written = 0
+    for circuit_name in stale:
+        if circuit_name is None:
+            combined_data = build_training_frame(race_data, quali_data)
+        else:
+            combined_data = build_training_frame(_circuit_rows(race_data, index, circuit_name),
+                                                 _circuit_rows(quali_data, index, circuit_name))
+        if combined_data.empty:
+            continue
+        write_matrix(circuit_name, combined_data, partitions)
+        written += 1
+    logger.info(f"Materialized {written} training matrices in {MATRIX_DIR}")
+    return written
+
+def load_matrix_dir(directory):
+    """Memory-map the matrix stored in a directory; returns a dict of X, y, years, features and sources, or None."""
+    path = os.path.join(directory, "meta.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    return {
+        'X': np.load(os.path.join(directory, "X.npy"), mmap_mode='r'),
+        'y': np.load(os.path.join(directory, "y.npy"), mmap_mode='r'),
+        'years': np.load(os.path.join(directory, "years.npy"), mmap_mode='r'),
+        'features': meta['features'],
+        'sources': {str(meta['circuit']): meta['sources']},
+    }
+
+def load_matrix(circuit_name):
+    """Memory-map the stored matrix of a circuit (None: all circuits), or return None without one."""
+    return load_matrix_dir(matrix_dir(circuit_name))
+
+def matching_circuits(circuit_identifier, partitions):
+    """Stored circuits whose name contains the identifier (every stored circuit when None), in key order."""
+    index = load_dataset_index()
+    stored = {p['circuit'] for p in partitions.values() if p['kind'] == "race"}
+    keys = range(len(index['circuits'])) if circuit_identifier is None else circuit_keys(index, circuit_identifier)
+    return [index['circuits'][key] for key in keys if index['circuits'][key] in stored]
+
+def refresh_matrices(circuit_names, backend=SESSION_BACKEND, partitions=None):
+    """Rebuild the stale matrices among `circuit_names` and count matrix cache hits and misses."""
+    written = materialize_matrices(circuit_names, backend=backend, partitions=partitions)
+    count("matrix cache misses", written)
+    count("matrix cache hits", len(circuit_names) - written)
+    return written
+
+def load_training_matrix(circuit_identifier=None, backend=SESSION_BACKEND):
+    """Training matrix of the circuits matching an identifier, or of all circuits when None.
+
+    Stale matrices are rebuilt first. Rows come in the same order as
+    select_circuit returns them. Returns None when no stored race matches.
+    """
+    partitions = scan_partitions()
+    circuit_names = [None] if circuit_identifier is None else matching_circuits(circuit_identifier, partitions)
+    if not circuit_names or not partitions:
+        return None
+
+    refresh_matrices(circuit_names, backend, partitions)
+    matrices = [matrix for matrix in map(load_matrix, circuit_names) if matrix is not None]
+    if len(matrices) <= 1:
+        return matrices[0] if matrices else None
+    return {
+        'X': np.concatenate([matrix['X'] for matrix in matrices]),
+        'y': np.concatenate([matrix['y'] for matrix in matrices]),
+        'years': np.concatenate([matrix['years'] for matrix in matrices]),
+        'features': matrices[0]['features'],
+        'sources': {name: sources for matrix in matrices for name, sources in matrix['sources'].items()},
+    }
+
+def training_rows(matrix, target_year=None):
+    """Feature and target arrays of a matrix without `target_year`, and the preprocessing fitted on them.
+
+    Missing features are imputed with the fitted artifact and missing targets
+    with their median. Arrays are only copied when rows are dropped or values
+    need filling.
+    """
+    X, y = matrix['X'], matrix['y']
+    if target_year:
+        keep = matrix['years'] != target_year
+        X, y = X[keep], y[keep]
+
+    preprocessor = fit_preprocessor(X, matrix['features'])
+    X = impute(X, preprocessor)
+    missing = np.isnan(y)
+    if missing.any() and not missing.all():
+        y = np.where(missing, np.median(y[~missing]), y).astype(np.float32)
+    return X, y, preprocessor
+
+def matrix_model_key(sources, features, target_year, params, **options):
+    """Model cache key of a model trained from matrices with the given sources."""
+    return hashlib.sha256(json.dumps({
+        'sources': sources,
+        'features': features,
+        'target_year': target_year,
+        'params': params,
+        'preprocessor': PREPROCESSOR_VERSION,
+        **options,
+    }, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:32]
+
+def get_or_train_matrix_model(matrix, target_circuit_name=None, target_year=None, use_cache=True):
+    """Load a matching model from the model cache, or train one straight from a training matrix."""
+    params = load_model_params()
+    key = matrix_model_key(matrix['sources'], matrix['features'], target_year, params)
+    if use_cache:
+        model = load_cached_model(key)
+        if model is not None:
+            count("model cache hits")
+            return model
+        count("model cache misses")
+
+    X, y, preprocessor = training_rows(matrix, target_year)
+    if len(X) == 0:
+        logger.error("No training rows left in the matrix!")
+        return None
+    logger.info(f"Training on {len(X)} materialized rows" + (f", excluding {target_year}" if target_year else ""))
+    model = fit_model(pd.DataFrame(X, columns=matrix['features'], copy=False), y, params, preprocessor)
+    if use_cache:
+        save_cached_model(key, model, description=f"matrix circuit={target_circuit_name} excluded_year={target_year}")
+    return model
+
+def main():
+    parser = argparse.ArgumentParser(description="Write ready-to-train feature matrices of every circuit.")
+    parser.add_argument('--circuit', help="only materialize circuits whose name contains this")
+    parser.add_argument('--force', action='store_true', help="rewrite matrices even when they are fresh")
+    parser.add_argument('--backend', default=SESSION_BACKEND, help="session backend used if the dataset must be built")
+    args = parser.parse_args()
+
+    setup_logging()
+    suppress_warnings()
+    circuit_names = None
+    if args.circuit:
+        index = load_dataset_index()
+        circuit_names = [index['circuits'][key] for key in circuit_keys(index, args.circuit)]
+    written = materialize_matrices(circuit_names, force=args.force, backend=args.backend)
+    if not written:
+        logger.info("Training matrices are up to date")
+
+if __name__ == "__main__":
+    main()
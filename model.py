@@ -1,22 +1,60 @@
+import numpy as np
 import pandas as pd
-from xgboost import XGBRegressor
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_absolute_error
 
-from config import logger, FEATURE_COLS, MODEL_PARAMS
-from feature_engineering import enhance_data_with_circuit_features, prepare_features_for_model
-from utils import log_feature_importance, display_prediction_results
+from config import logger, FEATURE_COLS, MERGE_KEYS, SESSION_BACKEND, TRAINING_TREE_METHOD, TRAINING_THREADS
+from data_loader import get_circuit_specific_data, get_current_quali_data, prefetch_session
+from dataset_index import INDEX_MERGE_KEYS, load_dataset_index, select_circuit
+from feature_engineering import enhance_data_with_circuit_features
+from model_cache import model_cache_key, load_cached_model, save_cached_model, load_model_params
+from preprocessing import fit_preprocessor, impute, attach_preprocessor, prediction_features
+from profiling import profiled, stage, count
+from utils import log_feature_importance, display_prediction_results, get_circuit_identifier
 
-def train_comprehensive_model(race_data, quali_data, target_circuit_name=None, target_year=None):
-    """Train an enhanced model with comprehensive historical data."""
+def build_training_frame(race_data, quali_data):
+    """Merge race and qualifying records and add circuit features.
+    
+    Frames carrying surrogate keys are joined on the integer keys, others on the
+    name columns. Missing values are left in place; boolean feature columns are
+    cast to int.
+    """
+    if all(col in race_data.columns and col in quali_data.columns for col in INDEX_MERGE_KEYS):
+        merge_keys = INDEX_MERGE_KEYS
+    else:
+        merge_keys = MERGE_KEYS
+    combined_data = pd.merge(
+        race_data,
+        quali_data[merge_keys + ['BestQualiTime', 'AirTemp', 'TrackTemp', 'Humidity']],
+        on=merge_keys,
+        how='inner'
+    )
+    if combined_data.empty:
+        return combined_data
+    
+    # Add circuit features
+    combined_data = enhance_data_with_circuit_features(combined_data)
+    
+    # Convert boolean features to int
+    for col in FEATURE_COLS:
+        if col in combined_data.columns and combined_data[col].dtype == bool:
+            combined_data[col] = combined_data[col].astype(int)
+    
+    return combined_data
+
+def train_comprehensive_model(race_data, quali_data, target_circuit_name=None, target_year=None, params=None):
+    """Train an enhanced model with comprehensive historical data.
+    
+    `params` defaults to the tuned parameters when a search has saved them, and
+    to MODEL_PARAMS otherwise.
+    """
     if race_data is None or quali_data is None:
         logger.error("Insufficient data to train model!")
         return None
     
     # Filter data if target circuit is specified
     if target_circuit_name:
-        race_data = race_data[race_data['CircuitName'].str.contains(target_circuit_name, case=False, na=False)]
-        quali_data = quali_data[quali_data['CircuitName'].str.contains(target_circuit_name, case=False, na=False)]
+        index = load_dataset_index()
+        race_data = select_circuit(race_data, target_circuit_name, index)
+        quali_data = select_circuit(quali_data, target_circuit_name, index)
         logger.info(f"Filtered to {len(race_data)} race records and {len(quali_data)} qualifying records for {target_circuit_name}")
     
     # Filter out the target year for cross-validation if specified
@@ -26,50 +64,46 @@ def train_comprehensive_model(race_data, quali_data, target_circuit_name=None, t
     else:
         train_race_data = race_data
     
-    # Merge race and qualifying data
-    combined_data = pd.merge(
-        train_race_data,
-        quali_data[['FullName', 'TeamName', 'Year', 'CircuitName', 'BestQualiTime', 
-                   'AirTemp', 'TrackTemp', 'Humidity']],
-        on=['FullName', 'TeamName', 'Year', 'CircuitName'],
-        how='inner'
-    )
+    # Merge race and qualifying data and add circuit features
+    with stage("model.merge"):
+        combined_data = build_training_frame(train_race_data, quali_data)
     
     if combined_data.empty:
         logger.error("No matching data after merging race and qualifying information!")
         return None
     
-    # Add circuit features
-    combined_data = enhance_data_with_circuit_features(combined_data)
-    
-    # Handle missing values
-    combined_data = combined_data.fillna({
-        'AirTemp': combined_data['AirTemp'].median(),
-        'TrackTemp': combined_data['TrackTemp'].median(),
-        'Humidity': combined_data['Humidity'].median(),
-        'BestQualiTime': combined_data['BestQualiTime'].median(),
-        'LapTime (s)_mean': combined_data['LapTime (s)_mean'].median(),
-        'LapTime (s)_min': combined_data['LapTime (s)_min'].median(),
-        'LapTime (s)_std': combined_data['LapTime (s)_std'].median()
-    })
-    
     # Make sure all feature columns exist
     available_features = [col for col in FEATURE_COLS if col in combined_data.columns]
     
-    # Convert boolean features to int
-    for col in available_features:
-        if combined_data[col].dtype == bool:
-            combined_data[col] = combined_data[col].astype(int)
-    
-    X = combined_data[available_features]
+    # Fit the imputation once on the float32 matrix; the same artifact is applied at prediction time
+    X = combined_data[available_features].to_numpy(dtype=np.float32, na_value=np.nan)
+    preprocessor = fit_preprocessor(X, available_features)
+    X = pd.DataFrame(impute(X, preprocessor), columns=available_features, copy=False)
     y = combined_data['LapTime (s)_mean']  # Using mean lap time as target
+    y = y.fillna(y.median())
+    
+    return fit_model(X, y, params, preprocessor)
+
+def fit_model(X, y, params=None, preprocessor=None):
+    """Fit a model on a held-out split of a feature frame and log its error and feature importance.
+    
+    A fitted `preprocessor` artifact is saved with the model.
+    """
+    # Training-only dependencies are imported here to keep prediction startup fast
+    from xgboost import XGBRegressor
+    from sklearn.model_selection import train_test_split
+    from sklearn.metrics import mean_absolute_error
     
     # Train-test split
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
     
     # Train model with better parameters
-    model = XGBRegressor(**MODEL_PARAMS)
-    model.fit(X_train, y_train)
+    if params is None:
+        params = load_model_params()
+    model = XGBRegressor(**{'tree_method': TRAINING_TREE_METHOD, 'n_jobs': TRAINING_THREADS, **params})
+    with stage("model.fit"):
+        model.fit(X_train, y_train)
+    count("training rows", len(X_train))
     
     # Evaluate model
     y_pred = model.predict(X_test)
@@ -77,21 +111,43 @@ def train_comprehensive_model(race_data, quali_data, target_circuit_name=None, t
     logger.info(f"Model trained with Mean Absolute Error: {mae:.2f} seconds")
     
     # Feature importance
-    log_feature_importance(available_features, model.feature_importances_)
+    log_feature_importance(list(X.columns), model.feature_importances_)
     
+    if preprocessor is not None:
+        attach_preprocessor(model, preprocessor)
     return model
 
+def get_or_train_model(race_data, quali_data, target_circuit_name=None, target_year=None, use_cache=True):
+    """Load a matching model from the model cache, or train and cache a new one."""
+    if race_data is None or quali_data is None:
+        logger.error("Insufficient data to train model!")
+        return None
+    
+    params = load_model_params()
+    if not use_cache:
+        return train_comprehensive_model(race_data, quali_data, target_circuit_name, target_year, params)
+    
+    key = model_cache_key(race_data, quali_data, target_circuit_name, target_year, params)
+    model = load_cached_model(key)
+    if model is not None:
+        count("model cache hits")
+        return model
+    count("model cache misses")
+    
+    model = train_comprehensive_model(race_data, quali_data, target_circuit_name, target_year, params)
+    if model is not None:
+        save_cached_model(key, model, description=f"circuit={target_circuit_name} excluded_year={target_year}")
+    return model
+
+@profiled("model.predict")
 def predict_race_winner(model, quali_data):
     """Predict the winner based on qualifying data and additional factors."""
     if model is None or quali_data is None:
         logger.error("Cannot make prediction without model or qualifying data!")
         return None
     
-    # Prepare features for prediction
-    feature_cols = [col for col in FEATURE_COLS if col in quali_data.columns]
-    
-    # Make prediction
-    quali_data['Predicted Lap Time'] = model.predict(quali_data[feature_cols])
+    # Apply the model's training preprocessing and predict
+    quali_data['Predicted Lap Time'] = model.predict(prediction_features(model, quali_data))
     
     # Sort by predicted lap time (faster is better)
     sorted_predictions = quali_data.sort_values('Predicted Lap Time')
@@ -99,4 +155,108 @@ def predict_race_winner(model, quali_data):
     # Display top 5 predicted finishers
     display_prediction_results(sorted_predictions)
     
-    return sorted_predictions
\ No newline at end of file
+    return sorted_predictions
+
+def get_or_train_circuit_model(race_data, quali_data, circuit_identifier, target_year=None, backend=SESSION_BACKEND):
+    """Model of a circuit, from its materialized training matrix like the CLI uses.
+    
+    Falls back to the matrix of all circuits when no stored circuit matches, and
+    to training on the in-memory frames when the dataset store has no matrices.
+    """
+    # materialize imports this module, so it is imported on first use
+    from materialize import load_training_matrix, get_or_train_matrix_model
+    
+    matrix = load_training_matrix(circuit_identifier, backend)
+    if matrix is None:
+        matrix = load_training_matrix(None, backend)
+    if matrix is not None:
+        return get_or_train_matrix_model(matrix, target_circuit_name=circuit_identifier, target_year=target_year)
+    
+    training_race_data, training_quali_data = get_circuit_specific_data(race_data, quali_data, circuit_identifier)
+    if training_race_data.empty:
+        training_race_data, training_quali_data = race_data, quali_data
+    return get_or_train_model(training_race_data, training_quali_data, circuit_identifier, target_year)
+
+def predict_races(targets, race_data, quali_data, exclude_target_year=True, backend=SESSION_BACKEND,
+                  models=None, quali_frames=None):
+    """Predict the finishing order of several races in one call.
+    
+    `targets` is a list of (year, grand_prix) pairs. Targets that need the same
+    model (same circuit and, with `exclude_target_year`, same held-out season)
+    share one model and one stacked `predict` call. Returns a tidy frame with one
+    row per driver and race; the caller's frames are never modified.
+    
+    Long-lived callers can pass dicts as `models` (keyed by (circuit identifier,
+    excluded year)) and `quali_frames` (keyed by (year, grand_prix)) to keep models
+    and qualifying features in memory between calls.
+    """
+    if models is None:
+        models = {}
+    if quali_frames is None:
+        quali_frames = {}
+    
+    if race_data is None or quali_data is None:
+        logger.error("Insufficient data to train model!")
+        return None
+    
+    # Qualifying sessions not held in memory load concurrently while models are trained
+    pending = {
+        target: prefetch_session(target[0], target[1], "Q", backend)
+        for target in dict.fromkeys(targets) if target not in quali_frames
+    }
+    
+    # Group targets by the model they need
+    groups = {}
+    for year, grand_prix in targets:
+        model_key = (get_circuit_identifier(grand_prix), year if exclude_target_year else None)
+        groups.setdefault(model_key, []).append((year, grand_prix))
+    
+    predictions = []
+    for model_key, group_targets in groups.items():
+        circuit_identifier, excluded_year = model_key
+        model = models.get(model_key)
+        if model is None:
+            model = get_or_train_circuit_model(race_data, quali_data, circuit_identifier, excluded_year, backend)
+            if model is not None:
+                models[model_key] = model
+        if model is None:
+            logger.warning(f"No model for {circuit_identifier}; skipping {len(group_targets)} race(s)")
+            continue
+        
+        # Stack the qualifying frames of every race that uses this model
+        frames = []
+        for year, grand_prix in group_targets:
+            frame = quali_frames.get((year, grand_prix))
+            if frame is None:
+                current_quali = get_current_quali_data(year, grand_prix, backend, history=race_data,
+                                                       prefetched=pending.get((year, grand_prix)))
+                if current_quali is None:
+                    continue
+                frame = current_quali[['FullName', 'TeamName']].copy()
+                frame.insert(0, 'GrandPrix', grand_prix)
+                frame.insert(0, 'Year', year)
+                for col in FEATURE_COLS:
+                    if col in current_quali.columns:
+                        frame[col] = pd.to_numeric(current_quali[col], errors='coerce')
+                quali_frames[(year, grand_prix)] = frame
+            frames.append(frame)
+        if not frames:
+            continue
+        
+        stacked = pd.concat(frames, ignore_index=True)
+        stacked['Predicted Lap Time'] = model.predict(prediction_features(model, stacked))
+        predictions.append(stacked[['Year', 'GrandPrix', 'FullName', 'TeamName', 'Predicted Lap Time']])
+    
+    if not predictions:
+        logger.error("No race could be predicted!")
+        return None
+    
+    # Rank drivers within each race, keeping the order in which targets were requested
+    result = pd.concat(predictions, ignore_index=True)
+    result['Predicted Position'] = result.groupby(['Year', 'GrandPrix'])['Predicted Lap Time'].rank(method='first').astype(int)
+    target_order = {target: i for i, target in enumerate(dict.fromkeys(targets))}
+    result['_order'] = [target_order[target] for target in zip(result['Year'], result['GrandPrix'])]
+    result = result.sort_values(['_order', 'Predicted Position']).drop(columns='_order').reset_index(drop=True)
+    
+    logger.info(f"Predicted {result.groupby(['Year', 'GrandPrix']).ngroups} races with {len(groups)} model(s)")
+    return result
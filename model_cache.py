@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import hashlib
+import pandas as pd
+
+from config import logger, MODEL_CACHE_DIR, MODEL_CACHE_MAX_ENTRIES, MODEL_CACHE_MAX_BYTES, FEATURE_COLS, MODEL_PARAMS
+from preprocessing import PREPROCESSOR_VERSION
+
+INDEX_PATH = os.path.join(MODEL_CACHE_DIR, "index.json")
+TUNED_PARAMS_PATH = os.path.join(MODEL_CACHE_DIR, "tuned_params.json")
+
+def hash_frame(data):
+    """Fingerprint the contents of a frame, independent of its index."""
+    digest = hashlib.sha256()
+    digest.update(",".join(map(str, data.columns)).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def model_cache_key(race_data, quali_data, target_circuit_name, target_year, params):
+    """Build the registry key of a model from its training data, filters and parameters."""
+    digest = hashlib.sha256()
+    digest.update(hash_frame(race_data).encode("utf-8"))
+    digest.update(hash_frame(quali_data).encode("utf-8"))
+    digest.update(json.dumps({
+        'target_circuit_name': target_circuit_name,
+        'target_year': target_year,
+        'params': params,
+        'features': FEATURE_COLS,
+        'preprocessor': PREPROCESSOR_VERSION,
+    }, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+def _load_index():
+    if os.path.exists(INDEX_PATH):
+        try:
+            with open(INDEX_PATH, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable model cache index: {e}")
+    return {}
+
+def _save_index(index):
+    os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{INDEX_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, INDEX_PATH)
+
+def _model_path(key):
+    return os.path.join(MODEL_CACHE_DIR, f"{key}.ubj")
+
+def load_cached_model(key):
+    """Load a model from the registry, or return None on a miss."""
+    index = _load_index()
+    path = _model_path(key)
+    if key not in index or not os.path.exists(path):
+        return None
+
+    from xgboost import XGBRegressor
+    model = XGBRegressor()
+    model.load_model(path)
+
+    index[key]['last_used'] = time.time()
+    _save_index(index)
+    logger.info(f"Loaded cached model {key}")
+    return model
+
+def save_cached_model(key, model, description=None):
+    """Store a trained model in the registry and evict least recently used entries."""
+    os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+    path = _model_path(key)
+    tmp_path = f"{path}.tmp.ubj"
+    model.save_model(tmp_path)
+    os.replace(tmp_path, path)
+
+    index = _load_index()
+    index[key] = {
+        'size': os.path.getsize(path),
+        'last_used': time.time(),
+        'description': description,
+    }
+    evict(index)
+    _save_index(index)
+
+def save_tuned_params(params, score, description=None):
+    """Store the best parameters of a hyperparameter search for later training runs."""
+    os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{TUNED_PARAMS_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({'params': params, 'score': score, 'description': description, 'saved': time.time()},
+                  f, indent=1, sort_keys=True)
+    os.replace(tmp_path, TUNED_PARAMS_PATH)
+
+def load_model_params():
+    """Return the tuned model parameters if a search has saved any, else MODEL_PARAMS."""
+    if os.path.exists(TUNED_PARAMS_PATH):
+        try:
+            with open(TUNED_PARAMS_PATH, "r", encoding="utf-8") as f:
+                return json.load(f)['params']
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable tuned parameters: {e}")
+    return dict(MODEL_PARAMS)
+
+def evict(index, max_entries=MODEL_CACHE_MAX_ENTRIES, max_bytes=MODEL_CACHE_MAX_BYTES):
+    """Drop least recently used models until the registry fits its entry and size caps."""
+    by_age = sorted(index, key=lambda key: index[key]['last_used'])
+    total_bytes = sum(entry['size'] for entry in index.values())
+
+    while by_age and (len(index) > max_entries or total_bytes > max_bytes):
+        key = by_age.pop(0)
+        total_bytes -= index.pop(key)['size']
+        if os.path.exists(_model_path(key)):
+            os.remove(_model_path(key))
+        logger.debug(f"Evicted cached model {key}")
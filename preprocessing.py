@@ -0,0 +1,77 @@
+import json
+import warnings
+import numpy as np
+import pandas as pd
+
+from config import IMPUTED_FEATURE_COLS
+
+# Bump when the preprocessing artifact or how it is applied changes
+PREPROCESSOR_VERSION = 1
+
+# Booster attribute holding the artifact, so it is saved and loaded with the model file
+PREPROCESSOR_ATTR = "preprocessor"
+
+def make_preprocessor(features, fill):
+    """Build a preprocessing artifact from a feature order and per-feature imputation values."""
+    return {
+        'version': PREPROCESSOR_VERSION,
+        'features': list(features),
+        'dtype': "float32",
+        'fill': {col: float(value) for col, value in fill.items() if col in features and not np.isnan(value)},
+    }
+
+def fit_preprocessor(X, features):
+    """Fit the preprocessing of a training matrix: column order, float32 cast and imputation medians.
+
+    Medians of IMPUTED_FEATURE_COLS are computed in one vectorized pass; other
+    missing values are left for XGBoost to route.
+    """
+    columns = [j for j, col in enumerate(features) if col in IMPUTED_FEATURE_COLS]
+    with warnings.catch_warnings():
+        # Columns that are entirely missing have no median and are not imputed
+        warnings.simplefilter("ignore", RuntimeWarning)
+        medians = np.nanmedian(np.asarray(X, dtype=np.float32)[:, columns], axis=0)
+    return make_preprocessor(features, {features[j]: median for j, median in zip(columns, medians)})
+
+def impute(X, preprocessor):
+    """Fill the missing values of a matrix in the artifact's column order; copies only when something is missing."""
+    fill = np.array([preprocessor['fill'].get(col, np.nan) for col in preprocessor['features']], dtype=np.float32)
+    missing = np.isnan(X) & ~np.isnan(fill)
+    if not missing.any():
+        return X
+    return np.where(missing, fill, X).astype(np.float32, copy=False)
+
+def transform(data, preprocessor):
+    """Apply a fitted artifact to a frame, returning float32 features in the training column order.
+
+    Columns the frame lacks are treated as missing. Runs in O(rows) with no
+    statistics computed on the frame itself.
+    """
+    features = preprocessor['features']
+    X = np.full((len(data), len(features)), np.nan, dtype=np.float32)
+    for j, col in enumerate(features):
+        if col in data.columns:
+            X[:, j] = pd.to_numeric(data[col], errors='coerce').to_numpy(dtype=np.float32, na_value=np.nan)
+    return pd.DataFrame(impute(X, preprocessor), columns=features, copy=False)
+
+def attach_preprocessor(model, preprocessor):
+    """Store an artifact on a fitted model; it is saved with the model from then on."""
+    model.get_booster().set_attr(**{PREPROCESSOR_ATTR: json.dumps(preprocessor)})
+    return model
+
+def model_preprocessor(model):
+    """Return the artifact saved with a model, or None for models trained without one."""
+    value = model.get_booster().attr(PREPROCESSOR_ATTR)
+    return json.loads(value) if value else None
+
+def prediction_features(model, data):
+    """Feature frame to pass to a model's predict.
+
+    Models carrying an artifact get exactly their training preprocessing;
+    older ones get their booster's feature columns as numbers.
+    """
+    preprocessor = model_preprocessor(model)
+    if preprocessor is not None:
+        return transform(data, preprocessor)
+    features = [col for col in model.get_booster().feature_names or [] if col in data.columns]
+    return data[features].apply(pd.to_numeric, errors='coerce')
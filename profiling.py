@@ -0,0 +1,157 @@
+import os
+import json
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from config import logger
+
+# Recording is off unless enabled; stages and counters are then no-ops
+_enabled = False
+_lock = threading.Lock()
+_origin = time.perf_counter()
+_events = []    # (stage, start seconds since enable, duration seconds, thread id)
+_stages = {}    # stage -> [calls, seconds]
+_counters = {}  # counter -> value
+
+def enable():
+    """Start recording stages and counters, discarding anything recorded before."""
+    global _enabled, _origin
+    reset()
+    _origin = time.perf_counter()
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    with _lock:
+        _events.clear()
+        _stages.clear()
+        _counters.clear()
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as a pipeline stage.
+
+    Nested stages are recorded separately, so a stage's time includes the time of
+    the stages it contains.
+    """
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        with _lock:
+            _events.append((name, start - _origin, duration, threading.get_ident()))
+            totals = _stages.setdefault(name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += duration
+
+def profiled(name):
+    """Decorator timing every call of a function as the stage `name`."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, value=1):
+    """Add `value` to a counter such as sessions loaded, cache hits or rows read."""
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def summary():
+    """Return the recorded stages, slowest total first, and counters."""
+    with _lock:
+        stages = [
+            {'stage': name, 'calls': calls, 'seconds': seconds, 'mean_ms': 1000 * seconds / calls}
+            for name, (calls, seconds) in _stages.items()
+        ]
+        counters = dict(sorted(_counters.items()))
+    return sorted(stages, key=lambda row: -row['seconds']), counters
+
+def log_summary():
+    """Log a table of stage timings and the counters."""
+    stages, counters = summary()
+    if not stages and not counters:
+        logger.info("Profile: nothing recorded")
+        return
+    width = max([len(row['stage']) for row in stages] + [len(name) for name in counters] + [5])
+    logger.info(f"Profile: {'stage':<{width}} | calls | total (s) | mean (ms)")
+    for row in stages:
+        logger.info(f"         {row['stage']:<{width}} | {row['calls']:5d} | {row['seconds']:9.3f} | {row['mean_ms']:9.2f}")
+    for name, value in counters.items():
+        logger.info(f"         {name:<{width}} | {value:,}")
+
+def export_trace(path, fmt="chrome"):
+    """Write the recorded stages and counters to `path`.
+
+    "chrome" writes the Trace Event Format read by chrome://tracing and Perfetto;
+    "json" writes the summary plus every stage call.
+    """
+    stages, counters = summary()
+    with _lock:
+        events = list(_events)
+
+    if fmt == "chrome":
+        pid = os.getpid()
+        trace_events = [
+            {'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'pid': pid, 'tid': thread,
+             'ts': round(start * 1e6, 3), 'dur': round(duration * 1e6, 3)}
+            for name, start, duration, thread in events
+        ]
+        end = max((start + duration for _, start, duration, _ in events), default=0.0)
+        trace_events += [
+            {'name': name, 'ph': 'C', 'pid': pid, 'ts': round(end * 1e6, 3), 'args': {'value': value}}
+            for name, value in counters.items()
+        ]
+        document = {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+    elif fmt == "json":
+        document = {
+            'stages': stages,
+            'counters': counters,
+            'events': [
+                {'stage': name, 'start': start, 'seconds': duration, 'thread': thread}
+                for name, start, duration, thread in events
+            ],
+        }
+    else:
+        raise ValueError(f"Unknown trace format: {fmt}")
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(document, f)
+    logger.info(f"Profile written to {path}")
+
+def add_profile_arguments(parser):
+    """Add the --profile options shared by the command line tools."""
+    parser.add_argument('--profile', action='store_true', help="time pipeline stages and log a summary table")
+    parser.add_argument('--profile-output', help="also write the profile to this file (implies --profile)")
+    parser.add_argument('--profile-format', choices=['chrome', 'json'], default='chrome',
+                        help="format of --profile-output: Chrome trace or JSON summary")
+
+def start_profile(args):
+    """Enable recording when the command line asked for a profile."""
+    if args.profile or args.profile_output:
+        enable()
+
+def finish_profile(args):
+    """Log and export the profile requested on the command line."""
+    if not (args.profile or args.profile_output):
+        return
+    log_summary()
+    if args.profile_output:
+        export_trace(args.profile_output, args.profile_format)
@@ -0,0 +1,100 @@
+import os
+import json
+import importlib
+from datetime import datetime, timedelta
+import pandas as pd
+
+from config import (
+    logger, CURRENT_YEAR, GRAND_PRIX_NAMES, SCHEDULE_CACHE_PATH, SCHEDULE_REFRESH_HOURS,
+    MISSING_SESSION_GRACE_DAYS, SESSION_BACKEND
+)
+
+def load_schedule_cache(path=SCHEDULE_CACHE_PATH):
+    """Load the on-disk schedule cache (event lists and known-missing sessions)."""
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+            cache.setdefault("seasons", {})
+            cache.setdefault("missing", [])
+            return cache
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable schedule cache {path}: {e}")
+    return {"seasons": {}, "missing": []}
+
+def save_schedule_cache(cache, path=SCHEDULE_CACHE_PATH):
+    """Write the schedule cache atomically."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def _season_is_fresh(season, year):
+    """Check whether a cached season entry can be used without fetching it again."""
+    if year < CURRENT_YEAR:
+        return True
+    fetched = datetime.fromisoformat(season["fetched"])
+    return datetime.now() - fetched < timedelta(hours=SCHEDULE_REFRESH_HOURS)
+
+def fetch_season_schedule(year, backend=SESSION_BACKEND):
+    """Fetch the list of championship events of a season from the backend schedule."""
+    schedule = importlib.import_module(backend).get_event_schedule(year, include_testing=False)
+    schedule = schedule.sort_values('RoundNumber')
+    return [
+        {"name": row['EventName'], "round": int(row['RoundNumber']), "date": pd.Timestamp(row['EventDate']).strftime("%Y-%m-%d")}
+        for _, row in schedule.iterrows()
+    ]
+
+def get_season_events(year, cache, backend=SESSION_BACKEND):
+    """Return the events of a season that have already taken place, in round order.
+
+    The schedule is resolved once per season and stored in `cache`. When it cannot
+    be fetched, every name in GRAND_PRIX_NAMES is returned as before.
+    """
+    season = cache["seasons"].get(str(year))
+    if season is None or not _season_is_fresh(season, year):
+        try:
+            season = {"events": fetch_season_schedule(year, backend), "fetched": datetime.now().isoformat()}
+            cache["seasons"][str(year)] = season
+        except Exception as e:
+            logger.warning(f"Could not fetch the {year} event schedule, trying all known Grand Prix names: {e}")
+            if season is None:
+                return list(GRAND_PRIX_NAMES)
+
+    today = datetime.now().strftime("%Y-%m-%d")
+    return [event["name"] for event in season["events"] if event["date"] <= today]
+
+def discover_events(seasons, cache, backend=SESSION_BACKEND):
+    """Resolve the (year, grand_prix) pairs that actually exist for the given seasons."""
+    events = []
+    for year in seasons:
+        events.extend((year, gp_name) for gp_name in get_season_events(year, cache, backend))
+    logger.info(f"Discovered {len(events)} events across {len(seasons)} seasons")
+    return events
+
+def session_key(year, grand_prix, session_type):
+    """Build the string key identifying one session of an event."""
+    return f"{year}|{grand_prix}|{session_type}"
+
+def is_known_missing(cache, year, grand_prix, session_type):
+    """Check whether a session is remembered as unavailable."""
+    return session_key(year, grand_prix, session_type) in cache["missing"]
+
+def record_missing(cache, year, grand_prix, session_type):
+    """Remember that a session could not be loaded, once its data should have been published."""
+    event_date = None
+    for event in cache["seasons"].get(str(year), {}).get("events", []):
+        if event["name"] == grand_prix:
+            event_date = datetime.strptime(event["date"], "%Y-%m-%d")
+            break
+
+    # Recent events may simply not be published yet, so only settled ones are remembered
+    if event_date is not None:
+        settled = datetime.now() - event_date > timedelta(days=MISSING_SESSION_GRACE_DAYS)
+    else:
+        settled = year < CURRENT_YEAR
+
+    key = session_key(year, grand_prix, session_type)
+    if settled and key not in cache["missing"]:
+        cache["missing"].append(key)
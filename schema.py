@@ -0,0 +1,81 @@
+import pandas as pd
+
+from config import RACE_TARGET_COLS, RACE_PACE_COLS
+from feature_engineering import CIRCUIT_FEATURE_COLS
+
+# Columns kept for each table and their compact dtypes; anything else is dropped at ingestion
+RACE_SCHEMA = {
+    'FullName': 'category',
+    'TeamName': 'category',
+    'Year': 'int16',
+    'CircuitName': 'category',
+    'RoundNumber': 'int16',
+    **{col: 'float32' for col in RACE_TARGET_COLS},
+    'AirTemp_mean': 'float32',
+    'TrackTemp_mean': 'float32',
+    'Humidity_mean': 'float32',
+    'FinishPosition': 'float32',
+    **{col: 'float32' for col in RACE_PACE_COLS},
+    **{col: 'uint8' for col in CIRCUIT_FEATURE_COLS},
+}
+
+QUALI_SCHEMA = {
+    'FullName': 'category',
+    'TeamName': 'category',
+    'Abbreviation': 'category',
+    'Year': 'int16',
+    'CircuitName': 'category',
+    'CircuitShortName': 'category',
+    'RoundNumber': 'int16',
+    'Q1': 'float32',
+    'Q2': 'float32',
+    'Q3': 'float32',
+    'BestQualiTime': 'float32',
+    'AirTemp': 'float32',
+    'TrackTemp': 'float32',
+    'Humidity': 'float32',
+    **{col: 'uint8' for col in CIRCUIT_FEATURE_COLS},
+}
+
+SCHEMAS = {'race': RACE_SCHEMA, 'quali': QUALI_SCHEMA}
+
+def _cast_column(values, dtype):
+    """Cast one column to a schema dtype."""
+    if values.dtype == dtype:
+        return values
+    if dtype == 'category':
+        return values.astype('category')
+    if dtype == 'float32':
+        return pd.to_numeric(values, errors='coerce').astype('float32')
+    return values.fillna(0).astype(dtype)
+
+def apply_schema(data, schema, project=True):
+    """Cast a frame to the compact dtypes of a schema.
+
+    With `project`, columns outside the schema are dropped; schema columns the
+    frame does not have are left out rather than added. The result is built in
+    one go so columns of the same dtype share a block.
+    """
+    if data is None:
+        return None
+    columns = [col for col in data.columns if col in schema or not project]
+    return pd.DataFrame(
+        {col: _cast_column(data[col], schema[col]) if col in schema else data[col] for col in columns},
+        index=data.index
+    )
+
+def concat_frames(frames, schema):
+    """Concatenate frames cast to `schema` into one frame with the schema dtypes.
+
+    Category columns whose categories differ come out of pd.concat as object
+    columns pointing at the existing strings, so they are re-categorized once on
+    the combined frame, which is cheaper than aligning every frame's categories.
+    """
+    frames = [frame for frame in frames if frame is not None and not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=list(schema))
+    return apply_schema(pd.concat(frames, ignore_index=True), schema, project=False)
+
+def frame_memory_bytes(data):
+    """Deep memory usage of a frame, including the contents of string columns."""
+    return int(data.memory_usage(deep=True).sum())
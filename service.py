@@ -0,0 +1,188 @@
+import sys
+import json
+import time
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from config import logger, SESSION_BACKEND, SERVICE_MAX_CONCURRENCY, SERVICE_QUEUE_TIMEOUT
+from data_loader import load_or_build_comprehensive_data
+from model import predict_races
+from utils import get_circuit_identifier
+
+class ServiceBusy(Exception):
+    """Raised when a request cannot get a concurrency slot in time."""
+
+class PredictionService:
+    """Answer prediction requests from a dataset, models and qualifying data held in memory."""
+
+    def __init__(self, backend=SESSION_BACKEND, max_concurrency=SERVICE_MAX_CONCURRENCY,
+                 queue_timeout=SERVICE_QUEUE_TIMEOUT, refresh=False):
+        self.backend = backend
+        self.queue_timeout = queue_timeout
+        self.race_data, self.quali_data = load_or_build_comprehensive_data(backend=backend, refresh=refresh)
+        if self.race_data is None or self.quali_data is None:
+            raise RuntimeError("Failed to get historical data")
+
+        self.models = {}
+        self.quali_frames = {}
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._fill_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self._counts = {'requests': 0, 'errors': 0, 'rejected': 0, 'in_flight': 0}
+
+    def _is_warm(self, year, grand_prix, exclude_year):
+        model_key = (get_circuit_identifier(grand_prix), year if exclude_year else None)
+        return model_key in self.models and (year, grand_prix) in self.quali_frames
+
+    def predict(self, year, grand_prix, exclude_year=False):
+        """Return the predicted order of one race as a list of driver records."""
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._metrics_lock:
+                self._counts['rejected'] += 1
+            raise ServiceBusy(f"More than {self.queue_timeout}s waiting for a free slot")
+
+        start = time.perf_counter()
+        with self._metrics_lock:
+            self._counts['requests'] += 1
+            self._counts['in_flight'] += 1
+        try:
+            args = ([(year, grand_prix)], self.race_data, self.quali_data, exclude_year, self.backend,
+                    self.models, self.quali_frames)
+            if self._is_warm(year, grand_prix, exclude_year):
+                result = predict_races(*args)
+            else:
+                # Training and fetching fill the shared caches, so only one request does it at a time
+                with self._fill_lock:
+                    result = predict_races(*args)
+            if result is None:
+                raise LookupError(f"No prediction available for {year} {grand_prix}")
+            return result.drop(columns=['Year', 'GrandPrix']).to_dict(orient='records')
+        except Exception:
+            with self._metrics_lock:
+                self._counts['errors'] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._metrics_lock:
+                self._counts['in_flight'] -= 1
+                self._latencies.append(elapsed)
+            self._slots.release()
+
+    def metrics(self):
+        """Request counters and latency percentiles over the most recent requests."""
+        with self._metrics_lock:
+            latencies = sorted(self._latencies)
+            metrics = dict(self._counts)
+        metrics['cached_models'] = len(self.models)
+        metrics['cached_qualifying'] = len(self.quali_frames)
+        if latencies:
+            metrics['latency_ms'] = {
+                'mean': 1000 * sum(latencies) / len(latencies),
+                'p50': 1000 * latencies[len(latencies) // 2],
+                'p95': 1000 * latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                'max': 1000 * latencies[-1],
+            }
+        return metrics
+
+    def handle(self, request):
+        """Answer one decoded JSON request, returning (status, response body)."""
+        try:
+            year = int(request['year'])
+            grand_prix = str(request['grand_prix'])
+            exclude_year = bool(request.get('exclude_year', False))
+        except (KeyError, TypeError, ValueError):
+            return 400, {'error': "expected 'year' and 'grand_prix'"}
+
+        start = time.perf_counter()
+        try:
+            rankings = self.predict(year, grand_prix, exclude_year)
+        except ServiceBusy as e:
+            return 503, {'error': str(e)}
+        except LookupError as e:
+            return 404, {'error': str(e)}
+        except Exception as e:
+            logger.error(f"Prediction failed for {year} {grand_prix}: {e}")
+            return 500, {'error': str(e)}
+        return 200, {
+            'year': year,
+            'grand_prix': grand_prix,
+            'rankings': rankings,
+            'elapsed_ms': 1000 * (time.perf_counter() - start),
+        }
+
+def make_handler(service):
+    """Build an HTTP request handler class bound to a PredictionService."""
+
+    class PredictionHandler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            payload = json.dumps(body, default=float).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/health":
+                self._send(200, {'status': 'ok'})
+            elif url.path == "/metrics":
+                self._send(200, service.metrics())
+            elif url.path == "/predict":
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                query['exclude_year'] = query.get('exclude_year', '').lower() in ('1', 'true', 'yes')
+                self._send(*service.handle(query))
+            else:
+                self._send(404, {'error': f"unknown path {url.path}"})
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/predict":
+                self._send(404, {'error': f"unknown path {self.path}"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._send(400, {'error': "invalid JSON body"})
+                return
+            self._send(*service.handle(request))
+
+        def log_message(self, format, *args):
+            logger.debug(f"{self.address_string()} - {format % args}")
+
+    return PredictionHandler
+
+def serve_http(service, host, port):
+    """Serve predictions over HTTP until interrupted."""
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    logger.info(f"Prediction service listening on http://{host}:{port} (POST /predict, GET /metrics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down prediction service")
+    finally:
+        server.server_close()
+
+def serve_stdin(service, input_stream=sys.stdin, output_stream=sys.stdout):
+    """Answer JSON-lines requests from a stream, one JSON response line per request."""
+    for line in input_stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError:
+            status, body = 400, {'error': "invalid JSON line"}
+        else:
+            if not isinstance(request, dict):
+                status, body = 400, {'error': "expected a JSON object"}
+            elif request.get('command') == 'metrics':
+                status, body = 200, service.metrics()
+            else:
+                status, body = service.handle(request)
+        body['status'] = status
+        output_stream.write(json.dumps(body, default=float) + "\n")
+        output_stream.flush()
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+
+from config import (
+    logger, MODEL_CACHE_DIR, SIMULATION_DRAWS, SIMULATION_CHUNK_DRAWS, SIMULATION_DEFAULT_SIGMA,
+    SIMULATION_SHRINKAGE
+)
+
+ERROR_MODEL_PATH = os.path.join(MODEL_CACHE_DIR, "error_model.json")
+
+def fit_error_model(residuals, shrinkage=SIMULATION_SHRINKAGE):
+    """Estimate each driver's lap time bias and spread from prediction residuals.
+
+    `residuals` has FullName and Residual (actual minus predicted mean lap time)
+    columns, e.g. from a walk-forward backtest. Spreads are measured after
+    removing each race's mean residual (per Year and CircuitName, when given),
+    since an offset shared by the whole field never changes the finishing
+    order; biases use the raw residuals. Driver estimates are shrunk towards
+    the overall bias and spread, by `shrinkage` pseudo-races, so drivers with
+    few races do not get extreme values.
+    """
+    residuals = residuals.dropna(subset=['Residual']).copy()
+    values = residuals['Residual'].to_numpy(dtype=float)
+    global_bias = float(values.mean())
+    race_keys = [col for col in ('Year', 'CircuitName') if col in residuals.columns]
+    if race_keys:
+        race_mean = residuals.groupby(race_keys)['Residual'].transform('mean')
+        residuals['Spread'] = residuals['Residual'] - race_mean
+    else:
+        residuals['Spread'] = residuals['Residual'] - global_bias
+    global_var = float(residuals['Spread'].var(ddof=0))
+
+    drivers = {}
+    grouped = residuals.groupby(residuals['FullName'].astype(str))
+    stats = grouped['Residual'].agg(['count', 'mean']).join(grouped['Spread'].var().rename('var'))
+    for name, (n, mean, var) in stats.iterrows():
+        var = 0.0 if np.isnan(var) else var
+        bias = (n * mean + shrinkage * global_bias) / (n + shrinkage)
+        sigma = np.sqrt((n * var + shrinkage * global_var) / (n + shrinkage))
+        drivers[name] = {'bias': float(bias), 'sigma': float(sigma), 'races': int(n)}
+    return {'bias': global_bias, 'sigma': float(np.sqrt(global_var)), 'drivers': drivers}
+
+def save_error_model(error_model, description=None, path=ERROR_MODEL_PATH):
+    """Store an error model next to the cached models."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({**error_model, 'description': description, 'saved': time.time()}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def load_error_model(path=ERROR_MODEL_PATH):
+    """Return the saved error model, or an unbiased one with SIMULATION_DEFAULT_SIGMA for every driver."""
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable error model: {e}")
+    return {'bias': 0.0, 'sigma': SIMULATION_DEFAULT_SIGMA, 'drivers': {}}
+
+def driver_errors(error_model, drivers):
+    """Bias and spread arrays for the given drivers; unknown drivers get the overall values."""
+    known = error_model.get('drivers', {})
+    bias = np.array([known.get(str(name), error_model)['bias'] for name in drivers], dtype=float)
+    sigma = np.array([known.get(str(name), error_model)['sigma'] for name in drivers], dtype=float)
+    return bias, sigma
+
+def finishing_position_counts(predicted, sigma, n_draws, rng, chunk_draws=SIMULATION_CHUNK_DRAWS):
+    """Count how often each driver finishes in each position over `n_draws` simulated races.
+
+    A race draws every driver's mean lap time from a normal distribution around
+    its prediction and orders the field by it. Draws are generated as one
+    (draws x drivers) array per chunk of `chunk_draws`, which bounds memory for
+    very large draw counts. Returns an int64 (drivers x positions) matrix.
+    """
+    predicted = np.asarray(predicted, dtype=float)
+    sigma = np.asarray(sigma, dtype=float)
+    n_drivers = len(predicted)
+    counts = np.zeros(n_drivers * n_drivers, dtype=np.int64)
+    positions = np.arange(n_drivers)
+
+    for start in range(0, n_draws, chunk_draws):
+        size = min(chunk_draws, n_draws - start)
+        lap_times = predicted + sigma * rng.standard_normal((size, n_drivers))
+        order = np.argsort(lap_times, axis=1)
+        # order[i, k] is the driver finishing in position k of draw i
+        counts += np.bincount((order * n_drivers + positions).ravel(), minlength=n_drivers * n_drivers)
+    return counts.reshape(n_drivers, n_drivers)
+
+def _position_probabilities(prediction, error_model, n_draws, seed, chunk_draws):
+    if error_model is None:
+        error_model = load_error_model()
+    bias, sigma = driver_errors(error_model, prediction['FullName'])
+    predicted = prediction['Predicted Lap Time'].to_numpy(dtype=float) + bias
+    counts = finishing_position_counts(predicted, sigma, n_draws, np.random.default_rng(seed), chunk_draws)
+    return counts / n_draws
+
+def simulate_race(prediction, error_model=None, n_draws=SIMULATION_DRAWS, seed=None,
+                  chunk_draws=SIMULATION_CHUNK_DRAWS):
+    """Turn one race's predicted lap times into win, podium and points probabilities.
+
+    `prediction` has FullName, TeamName and Predicted Lap Time columns, as
+    returned by predict_race_winner; `error_model` defaults to the saved one.
+    Returns one row per driver, most likely winner first.
+    """
+    probabilities = _position_probabilities(prediction, error_model, n_draws, seed, chunk_draws)
+    table = pd.DataFrame({
+        'FullName': prediction['FullName'].to_numpy(),
+        'TeamName': prediction['TeamName'].to_numpy(),
+        'Predicted Lap Time': prediction['Predicted Lap Time'].to_numpy(),
+        'WinProbability': probabilities[:, 0],
+        'PodiumProbability': probabilities[:, :3].sum(axis=1),
+        'PointsProbability': probabilities[:, :10].sum(axis=1),
+        'ExpectedPosition': probabilities @ np.arange(1, len(probabilities) + 1),
+    })
+    return table.sort_values(['WinProbability', 'ExpectedPosition'], ascending=[False, True]).reset_index(drop=True)
+
+def position_distribution(prediction, error_model=None, n_draws=SIMULATION_DRAWS, seed=None,
+                          chunk_draws=SIMULATION_CHUNK_DRAWS):
+    """Probability of every finishing position for every driver, one row per driver and P1..Pn columns."""
+    probabilities = _position_probabilities(prediction, error_model, n_draws, seed, chunk_draws)
+    return pd.DataFrame(probabilities, index=prediction['FullName'].to_numpy(),
+                        columns=[f"P{k + 1}" for k in range(len(probabilities))])
+
+def log_probabilities(table, top=10):
+    """Log the most likely winners of a simulated race."""
+    logger.info("\n🎲 Simulated outcome probabilities:")
+    logger.info(f"{'Driver':<24} {'Team':<20} {'Win':>6} {'Podium':>7} {'Points':>7} {'Exp. pos':>8}")
+    for row in table.head(top).itertuples(index=False):
+        logger.info(f"{str(row.FullName):<24} {str(row.TeamName):<20} {row.WinProbability:6.1%} "
+                    f"{row.PodiumProbability:7.1%} {row.PointsProbability:7.1%} {row.ExpectedPosition:8.2f}")
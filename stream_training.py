@@ -0,0 +1,244 @@
+import os
+import tempfile
+import numpy as np
+import xgboost
+from xgboost import XGBRegressor
+
+from config import (
+    logger, SESSION_BACKEND, MATRIX_DIR, IMPUTED_FEATURE_COLS, TRAINING_THREADS, STREAM_BATCH_ROWS,
+    STREAM_MEDIAN_SAMPLE
+)
+from materialize import (
+    TARGET_COL, matrix_dir, load_matrix_dir, load_meta, scan_partitions, matching_circuits,
+    refresh_matrices, matrix_model_key
+)
+from model_cache import load_cached_model, save_cached_model, load_model_params
+from preprocessing import make_preprocessor, impute, attach_preprocessor
+from profiling import stage, count
+from utils import log_feature_importance
+
+# Share of rows held out to report the error of a streamed model, like fit_model's split
+HOLDOUT_SHARE = 0.2
+
+# XGBRegressor keyword parameters whose native name differs
+NATIVE_PARAM_NAMES = {'random_state': 'seed', 'n_jobs': 'nthread'}
+
+def _held_out(n_rows, matrix_number, seed):
+    """Rows of a matrix held out for evaluation; the same on every pass over the data."""
+    return np.random.default_rng([seed, matrix_number]).random(n_rows) < HOLDOUT_SHARE
+
+class MatrixBatches(xgboost.DataIter):
+    """Hand stored training matrices to XGBoost in batches of at most `batch_rows` rows.
+
+    Matrices are memory-mapped one at a time and only the current batch is
+    copied, so memory does not grow with the number of matrices. Rows of
+    `target_year` are left out, missing features are imputed with the
+    `preprocessor` artifact and missing targets with `target_fill`, and either
+    the training or the held-out rows are produced.
+    """
+
+    def __init__(self, directories, preprocessor, target_fill=None, target_year=None, holdout=False, seed=42,
+                 batch_rows=STREAM_BATCH_ROWS, cache_prefix=None):
+        self.directories = directories
+        self.preprocessor = preprocessor
+        self.target_fill = target_fill
+        self.target_year = target_year
+        self.holdout = holdout
+        self.seed = seed
+        self.batch_rows = batch_rows
+        self._batches = None
+        super().__init__(cache_prefix=cache_prefix)
+
+    def batches(self):
+        """Yield (X, y, feature names) batches."""
+        for number, directory in enumerate(self.directories):
+            matrix = load_matrix_dir(directory)
+            if matrix is None:
+                continue
+            n_rows = len(matrix['y'])
+            held_out = _held_out(n_rows, number, self.seed)
+            for start in range(0, n_rows, self.batch_rows):
+                stop = min(start + self.batch_rows, n_rows)
+                keep = held_out[start:stop] == self.holdout
+                if self.target_year:
+                    keep &= matrix['years'][start:stop] != self.target_year
+                if not keep.any():
+                    continue
+                # Boolean indexing copies just this batch out of the memory map
+                X = impute(matrix['X'][start:stop][keep], self.preprocessor)
+                y = matrix['y'][start:stop][keep]
+                if self.target_fill is not None:
+                    y[np.isnan(y)] = self.target_fill
+                yield X, y, matrix['features']
+
+    def next(self, input_data):
+        if self._batches is None:
+            self._batches = self.batches()
+        batch = next(self._batches, None)
+        if batch is None:
+            return False
+        X, y, features = batch
+        input_data(data=X, label=y, feature_names=features)
+        return True
+
+    def reset(self):
+        self._batches = None
+
+class MedianSample:
+    """Uniform random sample of at most `size` values added in batches, for a median in bounded memory.
+
+    Every value gets a random key and the values with the `size` lowest keys
+    are kept, so the sample, and its median, stay exact while no more than
+    `size` values have been added.
+    """
+
+    def __init__(self, size=STREAM_MEDIAN_SAMPLE, seed=42):
+        self.size = size
+        self._rng = np.random.default_rng(seed)
+        self._values = np.empty(0, dtype=np.float32)
+        self._keys = np.empty(0)
+
+    def add(self, values):
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        keys = np.concatenate([self._keys, self._rng.random(len(values))])
+        values = np.concatenate([self._values, values])
+        if len(values) > self.size:
+            keep = np.argpartition(keys, self.size)[:self.size]
+            keys, values = keys[keep], values[keep]
+        self._keys, self._values = keys, values
+
+    def median(self):
+        return float(np.median(self._values)) if len(self._values) else None
+
+def fit_stream_preprocessor(directories, target_year=None, batch_rows=STREAM_BATCH_ROWS,
+                            sample_size=STREAM_MEDIAN_SAMPLE):
+    """Fit the preprocessing artifact and target median over every row outside `target_year`.
+
+    Only the imputed columns and the target are read, one batch at a time.
+    Medians come from a uniform sample of `sample_size` values per column, so
+    memory does not grow with the row count; they are approximate once a
+    column has more values than that. Returns (preprocessor, target median),
+    or (None, None) without matrices.
+    """
+    features = None
+    samples = {}
+    for directory in directories:
+        matrix = load_matrix_dir(directory)
+        if matrix is None:
+            continue
+        features = features or matrix['features']
+        columns = [(j, col) for j, col in enumerate(matrix['features']) if col in IMPUTED_FEATURE_COLS]
+        n_rows = len(matrix['y'])
+        for start in range(0, n_rows, batch_rows):
+            stop = min(start + batch_rows, n_rows)
+            keep = matrix['years'][start:stop] != target_year if target_year else slice(None)
+            for j, col in columns:
+                samples.setdefault(col, MedianSample(sample_size)).add(matrix['X'][start:stop, j][keep])
+            samples.setdefault(TARGET_COL, MedianSample(sample_size)).add(matrix['y'][start:stop][keep])
+
+    if features is None:
+        return None, None
+    medians = {col: sample.median() for col, sample in samples.items() if sample.median() is not None}
+    return make_preprocessor(features, medians), medians.pop(TARGET_COL, None)
+
+def booster_params(params, n_jobs=TRAINING_THREADS):
+    """Native XGBoost parameters and boosting rounds equivalent to XGBRegressor keyword parameters.
+
+    The quantile DMatrix only works with the hist tree method, so it is always used.
+    """
+    params = dict(params)
+    rounds = params.pop('n_estimators', 100)
+    native = {NATIVE_PARAM_NAMES.get(name, name): value for name, value in params.items()}
+    native.setdefault('objective', 'reg:squarederror')
+    native['tree_method'] = "hist"
+    if n_jobs:
+        native['nthread'] = n_jobs
+    return native, rounds
+
+def train_streaming(directories, target_year=None, params=None, n_jobs=TRAINING_THREADS, external_memory=False,
+                    batch_rows=STREAM_BATCH_ROWS):
+    """Train a model on stored matrices through a streaming quantile DMatrix.
+
+    The quantile sketch and histogram bins are built batch by batch, so the
+    float32 rows are never held in memory all at once. With `external_memory`,
+    the binned pages are also cached on disk next to the matrices instead of in
+    memory, for datasets larger than RAM. Reports the error on held-out rows and
+    returns an XGBRegressor, or None without training rows.
+    """
+    if params is None:
+        params = load_model_params()
+    native, rounds = booster_params(params, n_jobs)
+    preprocessor, target_fill = fit_stream_preprocessor(directories, target_year, batch_rows)
+    if preprocessor is None:
+        logger.error("No training matrices to stream!")
+        return None
+
+    os.makedirs(MATRIX_DIR, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="xgb-cache-", dir=MATRIX_DIR) as cache_dir:
+        cache_prefix = os.path.join(cache_dir, "train") if external_memory else None
+        batches = MatrixBatches(directories, preprocessor, target_fill, target_year, batch_rows=batch_rows,
+                                cache_prefix=cache_prefix)
+        dmatrix_type = xgboost.ExtMemQuantileDMatrix if external_memory else xgboost.QuantileDMatrix
+        with stage("model.quantile_dmatrix"):
+            dtrain = dmatrix_type(batches, nthread=native.get('nthread'), max_bin=native.get('max_bin'))
+        n_rows = dtrain.num_row()
+        if n_rows == 0:
+            logger.error("No training rows in the matrices!")
+            return None
+        with stage("model.fit"):
+            booster = xgboost.train(native, dtrain, num_boost_round=rounds)
+        count("training rows", n_rows)
+        del dtrain
+
+    # Evaluate on the held-out rows, one batch at a time
+    total_error = 0.0
+    n_held_out = 0
+    holdout = MatrixBatches(directories, preprocessor, target_fill, target_year, holdout=True, batch_rows=batch_rows)
+    for X, y, _ in holdout.batches():
+        total_error += float(np.abs(booster.inplace_predict(X) - y).sum())
+        n_held_out += len(y)
+    if n_held_out:
+        logger.info(f"Model trained with Mean Absolute Error: {total_error / n_held_out:.2f} seconds")
+
+    model = XGBRegressor()
+    model.load_model(bytearray(booster.save_raw("ubj")))
+    log_feature_importance(booster.feature_names, model.feature_importances_)
+    return attach_preprocessor(model, preprocessor)
+
+def get_or_train_streaming_model(circuit_identifier=None, target_year=None, external_memory=False, use_cache=True,
+                                 backend=SESSION_BACKEND):
+    """Load a matching model from the model cache, or stream-train one on the circuits' matrices.
+
+    With no `circuit_identifier` every circuit's matrix is streamed. Returns
+    None when no stored circuit matches.
+    """
+    partitions = scan_partitions()
+    circuit_names = matching_circuits(circuit_identifier, partitions)
+    if not circuit_names:
+        return None
+    refresh_matrices(circuit_names, backend, partitions)
+    metas = {name: load_meta(name) for name in circuit_names}
+    circuit_names = [name for name in circuit_names if metas[name] is not None]
+    if not circuit_names:
+        return None
+
+    params = load_model_params()
+    key = matrix_model_key({name: metas[name]['sources'] for name in circuit_names},
+                           metas[circuit_names[0]]['features'], target_year, params,
+                           training="external_memory" if external_memory else "streaming")
+    if use_cache:
+        model = load_cached_model(key)
+        if model is not None:
+            count("model cache hits")
+            return model
+        count("model cache misses")
+
+    logger.info(f"Streaming {len(circuit_names)} circuit matrices into a quantile DMatrix"
+                + (" with external memory" if external_memory else ""))
+    model = train_streaming([matrix_dir(name) for name in circuit_names], target_year, params,
+                            external_memory=external_memory)
+    if model is not None and use_cache:
+        save_cached_model(key, model, description=f"streamed circuit={circuit_identifier} excluded_year={target_year}")
+    return model
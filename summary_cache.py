@@ -0,0 +1,31 @@
+import os
+import pickle
+from urllib.parse import quote
+import pandas as pd
+
+from config import logger, SUMMARY_CACHE_DIR, PROCESSOR_VERSION
+
+def summary_path(year, grand_prix, session_type):
+    """Location of the cached summary of one session for the current processor version."""
+    return os.path.join(
+        SUMMARY_CACHE_DIR, f"v{PROCESSOR_VERSION}", str(year), f"{quote(grand_prix, safe='')}_{session_type}.pkl"
+    )
+
+def load_summary(year, grand_prix, session_type):
+    """Return the cached per-driver summary of a session, or None on a miss."""
+    path = summary_path(year, grand_prix, session_type)
+    if not os.path.exists(path):
+        return None
+    try:
+        return pd.read_pickle(path)
+    except (OSError, pickle.UnpicklingError, EOFError) as e:
+        logger.warning(f"Ignoring unreadable session summary {path}: {e}")
+        return None
+
+def save_summary(year, grand_prix, session_type, summary):
+    """Store the per-driver summary of a session."""
+    path = summary_path(year, grand_prix, session_type)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    summary.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
@@ -0,0 +1,218 @@
+import zlib
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+from config import GRAND_PRIX_NAMES
+
+# Default size of a generated session
+DEFAULT_DRIVERS = 20
+DEFAULT_LAPS = 57
+
+# Size of the sessions get_session creates; changed with session_size
+_session_size = {'n_drivers': DEFAULT_DRIVERS, 'n_laps': DEFAULT_LAPS}
+
+# Share of GRAND_PRIX_NAMES that take place in any given synthetic season
+CALENDAR_FRACTION = 0.65
+
+def _seed(*parts):
+    """Build a stable random seed from the given identifiers."""
+    return zlib.crc32("|".join(str(part) for part in parts).encode("utf-8"))
+
+def get_season_calendar(year):
+    """Return the synthetic list of Grand Prix names held in a season."""
+    rng = np.random.default_rng(_seed("calendar", year))
+    held = rng.random(len(GRAND_PRIX_NAMES)) < CALENDAR_FRACTION
+    return [name for name, is_held in zip(GRAND_PRIX_NAMES, held) if is_held]
+
+def session_grid(first_year, n_seasons, n_events):
+    """Return (year, grand_prix) pairs of the first `n_events` events of `n_seasons` seasons.
+
+    A season has at most as many events as its synthetic calendar.
+    """
+    return [
+        (year, grand_prix)
+        for year in range(first_year, first_year + n_seasons)
+        for grand_prix in get_season_calendar(year)[:n_events]
+    ]
+
+def make_drivers(n_drivers=DEFAULT_DRIVERS):
+    """Build the driver line-up shared by every synthetic session."""
+    return pd.DataFrame({
+        'DriverNumber': [str(i + 1) for i in range(n_drivers)],
+        'Abbreviation': [f"D{i + 1:02d}" for i in range(n_drivers)],
+        'FullName': [f"Driver {i + 1:02d}" for i in range(n_drivers)],
+        'TeamName': [f"Team {i // 2 + 1:02d}" for i in range(n_drivers)],
+    })
+
+def make_weather(rng, n_samples=60):
+    """Generate a weather table shaped like session.weather_data."""
+    return pd.DataFrame({
+        'Time': pd.to_timedelta(np.arange(n_samples) * 60, unit='s'),
+        'AirTemp': rng.normal(24.0, 4.0) + rng.normal(0.0, 0.3, n_samples),
+        'TrackTemp': rng.normal(35.0, 6.0) + rng.normal(0.0, 0.5, n_samples),
+        'Humidity': rng.uniform(30.0, 80.0) + rng.normal(0.0, 1.0, n_samples),
+    })
+
+def make_laps(rng, drivers, n_laps=DEFAULT_LAPS, base_lap_time=90.0):
+    """Generate a lap table shaped like session.laps for a race."""
+    n_drivers = len(drivers)
+    pace = np.sort(rng.normal(0.0, 0.6, n_drivers))
+
+    lap_number = np.tile(np.arange(1, n_laps + 1), n_drivers)
+    driver_idx = np.repeat(np.arange(n_drivers), n_laps)
+    pit_lap = rng.integers(n_laps // 3, 2 * n_laps // 3, n_drivers)
+    stint = np.where(lap_number > pit_lap[driver_idx], 2, 1)
+    tyre_life = np.where(stint == 1, lap_number, lap_number - pit_lap[driver_idx])
+
+    lap_time = (
+        base_lap_time
+        + pace[driver_idx]
+        + 0.05 * tyre_life
+        - 0.03 * lap_number
+        + rng.normal(0.0, 0.4, n_drivers * n_laps)
+    )
+    lap_time[lap_number == pit_lap[driver_idx]] += 20.0
+    elapsed = pd.Series(lap_time).groupby(driver_idx).cumsum().to_numpy()
+
+    laps = pd.DataFrame({
+        'Driver': drivers['Abbreviation'].to_numpy()[driver_idx],
+        'DriverNumber': drivers['DriverNumber'].to_numpy()[driver_idx],
+        'LapNumber': lap_number.astype(float),
+        'LapTime': pd.to_timedelta(lap_time, unit='s'),
+        'Time': pd.to_timedelta(elapsed, unit='s'),
+        'Stint': stint.astype(float),
+        'TyreLife': tyre_life.astype(float),
+        'PitInTime': pd.to_timedelta(
+            np.where(lap_number == pit_lap[driver_idx], elapsed, np.nan), unit='s'
+        ),
+    })
+    laps['Position'] = laps.groupby('LapNumber')['Time'].rank(method='first')
+
+    # A few laps without a time, as FastF1 reports for in/out laps and incidents
+    missing = rng.random(len(laps)) < 0.01
+    laps.loc[missing, 'LapTime'] = pd.NaT
+
+    # Drivers start on softs or mediums; drawn last so lap times do not depend on it
+    first_compound = rng.choice(['SOFT', 'MEDIUM'], n_drivers)
+    laps['Compound'] = np.where(stint == 1, first_compound[driver_idx], 'HARD')
+    laps['PitOutTime'] = pd.to_timedelta(
+        np.where(lap_number == pit_lap[driver_idx] + 1, elapsed - lap_time, np.nan), unit='s'
+    )
+    return laps
+
+def make_results(rng, drivers, session_type, base_lap_time=90.0):
+    """Generate a results table shaped like session.results."""
+    results = drivers.copy()
+    results['Position'] = np.arange(1, len(results) + 1, dtype=float)
+    results['GridPosition'] = rng.permutation(len(results)).astype(float) + 1
+
+    if session_type == "Q":
+        best = base_lap_time - 10.0 + np.sort(rng.normal(0.0, 0.5, len(results)))
+        for i, col in enumerate(['Q1', 'Q2', 'Q3']):
+            times = pd.Series(pd.to_timedelta(best + 0.3 * (2 - i), unit='s'))
+            # Drivers knocked out in earlier segments have no later times
+            cutoff = len(results) - 5 * i
+            times.iloc[cutoff:] = pd.NaT
+            results[col] = times.to_numpy()
+    return results
+
+def make_car_data(rng, drivers, n_laps=DEFAULT_LAPS, base_lap_time=90.0, sample_rate_hz=4):
+    """Generate per-driver telemetry shaped like session.car_data."""
+    n_samples = int(n_laps * base_lap_time * sample_rate_hz)
+    car_data = {}
+    for driver_number in drivers['DriverNumber']:
+        car_data[driver_number] = pd.DataFrame({
+            'SessionTime': pd.to_timedelta(np.arange(n_samples) / sample_rate_hz, unit='s'),
+            'Speed': rng.uniform(80.0, 340.0, n_samples),
+            'RPM': rng.uniform(8000.0, 12500.0, n_samples),
+            'nGear': rng.integers(1, 9, n_samples),
+            'Throttle': rng.uniform(0.0, 100.0, n_samples),
+            'Brake': rng.random(n_samples) < 0.2,
+            'DRS': rng.integers(0, 15, n_samples),
+        })
+    return car_data
+
+def make_race_control_messages(rng, n_messages=80):
+    """Generate a message table shaped like session.race_control_messages."""
+    return pd.DataFrame({
+        'Time': pd.to_datetime("2024-01-01") + pd.to_timedelta(np.sort(rng.uniform(0, 7200, n_messages)), unit='s'),
+        'Category': rng.choice(['Flag', 'Other', 'Drs', 'SafetyCar'], n_messages),
+        'Message': [f"MESSAGE {i}" for i in range(n_messages)],
+    })
+
+class FakeEvent(pd.Series):
+    """Minimal stand-in for fastf1.events.Event."""
+
+    _metadata = ['year']
+
+    @property
+    def _constructor(self):
+        return FakeEvent
+
+class FakeSession:
+    """Offline stand-in for a FastF1 session with generated data."""
+
+    def __init__(self, year, grand_prix, session_type, n_drivers=DEFAULT_DRIVERS, n_laps=DEFAULT_LAPS):
+        calendar = get_season_calendar(year)
+        round_number = calendar.index(grand_prix) + 1 if grand_prix in calendar else 0
+        self.event = FakeEvent({'EventName': grand_prix, 'RoundNumber': round_number}, name=grand_prix)
+        self.event.year = year
+        self.session_type = session_type
+        self.n_drivers = n_drivers
+        self.n_laps = n_laps
+        self.load_kwargs = None
+
+    def load(self, laps=True, telemetry=True, weather=True, messages=True):
+        """Generate the requested session tables deterministically from the event identity.
+
+        Like FastF1, results are always loaded and components that were not
+        requested are left unset.
+        """
+        self.load_kwargs = {'laps': laps, 'telemetry': telemetry, 'weather': weather, 'messages': messages}
+        rng = np.random.default_rng(_seed(self.event.year, self.event.name, self.session_type))
+        base_lap_time = 75.0 + (_seed(self.event.name) % 2000) / 100.0
+        drivers = make_drivers(self.n_drivers)
+
+        # Every table is always generated so the data does not depend on what was requested
+        results = make_results(rng, drivers, self.session_type, base_lap_time)
+        weather_data = make_weather(rng)
+        if self.session_type == "R":
+            lap_data = make_laps(rng, drivers, self.n_laps, base_lap_time)
+        else:
+            lap_data = pd.DataFrame()
+
+        self.results = results
+        if weather:
+            self.weather_data = weather_data
+        if laps:
+            self.laps = lap_data
+        if telemetry:
+            self.car_data = make_car_data(rng, drivers, self.n_laps, base_lap_time)
+        if messages:
+            self.race_control_messages = make_race_control_messages(rng)
+
+@contextmanager
+def session_size(n_drivers=DEFAULT_DRIVERS, n_laps=DEFAULT_LAPS):
+    """Make get_session create sessions of the given size inside the block, e.g. for benchmarks."""
+    previous = dict(_session_size)
+    _session_size.update(n_drivers=n_drivers, n_laps=n_laps)
+    try:
+        yield
+    finally:
+        _session_size.update(previous)
+
+def get_session(year, grand_prix, session_type):
+    """Drop-in replacement for fastf1.get_session backed by generated data."""
+    if grand_prix not in get_season_calendar(year):
+        raise ValueError(f"No synthetic event '{grand_prix}' in {year}")
+    return FakeSession(year, grand_prix, session_type, **_session_size)
+
+def get_event_schedule(year, include_testing=False):
+    """Drop-in replacement for fastf1.get_event_schedule backed by the synthetic calendar."""
+    names = get_season_calendar(year)
+    return pd.DataFrame({
+        'RoundNumber': np.arange(1, len(names) + 1),
+        'EventName': names,
+        'EventDate': pd.Timestamp(year=year, month=3, day=1) + pd.to_timedelta(np.arange(len(names)) * 14, unit='D'),
+    })
@@ -0,0 +1,215 @@
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from sklearn.model_selection import GroupKFold
+from xgboost import XGBRegressor
+from xgboost.callback import TrainingCallback
+
+from config import (
+    logger, setup_logging, FEATURE_COLS, MODEL_PARAMS, SESSION_BACKEND, TUNING_SEARCH_SPACE, TUNING_TRIALS,
+    TUNING_FOLDS, TUNING_MAX_TREES, TUNING_EARLY_STOPPING_ROUNDS, TUNING_BUDGET_SECONDS
+)
+from data_loader import load_or_build_comprehensive_data
+from model import build_training_frame
+from model_cache import save_tuned_params
+from preprocessing import fit_preprocessor, impute
+from utils import suppress_warnings
+
+class TrialPruner:
+    """Median pruning shared by concurrent trials.
+
+    A trial is stopped after a fold when its running mean error is worse than the
+    median of completed trials at the same fold.
+    """
+
+    def __init__(self, min_trials=3):
+        self.min_trials = min_trials
+        self._lock = threading.Lock()
+        self._completed = []
+
+    def should_prune(self, fold, running_score):
+        with self._lock:
+            history = [scores[fold] for scores in self._completed]
+        return len(history) >= self.min_trials and running_score > np.median(history)
+
+    def report(self, running_scores):
+        with self._lock:
+            self._completed.append(running_scores)
+
+class _DeadlineCallback(TrainingCallback):
+    """Stop boosting once the search's wall-clock budget is spent."""
+
+    def __init__(self, deadline):
+        super().__init__()
+        self.deadline = deadline
+
+    def after_iteration(self, model, epoch, evals_log):
+        return time.monotonic() > self.deadline
+
+def prepare_tuning_data(race_data, quali_data):
+    """Build the raw feature matrix, target, race groups and feature names used for cross-validation.
+
+    Missing features are left as NaN for each fold to impute; rows without a
+    target are dropped.
+    """
+    combined_data = build_training_frame(race_data, quali_data)
+    if not combined_data.empty:
+        combined_data = combined_data[combined_data['LapTime (s)_mean'].notna()]
+    if combined_data.empty:
+        return None
+
+    feature_cols = [col for col in FEATURE_COLS if col in combined_data.columns]
+    X = combined_data[feature_cols].to_numpy(dtype=np.float32, na_value=np.nan)
+    y = combined_data['LapTime (s)_mean'].to_numpy(dtype=np.float32)
+
+    # One group per race so no race is split between training and validation
+    groups = combined_data.groupby(['Year', 'CircuitName'], observed=True, sort=False).ngroup().to_numpy()
+    return X, y, groups, feature_cols
+
+def fold_matrices(X, y, folds, features):
+    """Split each fold into (X_train, y_train, X_val, y_val), imputed like training does.
+
+    The preprocessor is fitted on the fold's training rows only, so validation
+    rows never inform the fill values.
+    """
+    matrices = []
+    for train_idx, val_idx in folds:
+        preprocessor = fit_preprocessor(X[train_idx], features)
+        matrices.append((impute(X[train_idx], preprocessor), y[train_idx],
+                         impute(X[val_idx], preprocessor), y[val_idx]))
+    return matrices
+
+def sample_params(rng, space=TUNING_SEARCH_SPACE):
+    """Draw one value per searched parameter."""
+    return {name: values[rng.integers(len(values))] for name, values in space.items()}
+
+def run_trial(params, folds, n_jobs, pruner, deadline):
+    """Cross-validate one parameter set over fold_matrices with early stopping, pruning and the budget deadline."""
+    errors = []
+    running_scores = []
+    best_iterations = []
+    for i, (X_train, y_train, X_val, y_val) in enumerate(folds):
+        if time.monotonic() > deadline:
+            return {'params': params, 'status': 'timeout', 'folds': i}
+
+        model = XGBRegressor(**{
+            **MODEL_PARAMS, **params,
+            'n_estimators': TUNING_MAX_TREES,
+            'early_stopping_rounds': TUNING_EARLY_STOPPING_ROUNDS,
+            'tree_method': 'hist',
+            'n_jobs': n_jobs,
+            'callbacks': [_DeadlineCallback(deadline)],
+        })
+        model.fit(X_train, y_train, eval_set=[(X_val, y_val)], verbose=False)
+        if time.monotonic() > deadline:
+            return {'params': params, 'status': 'timeout', 'folds': i}
+
+        # predict() stops at the best iteration found by early stopping
+        errors.append(float(np.mean(np.abs(model.predict(X_val) - y_val))))
+        running_scores.append(float(np.mean(errors)))
+        best_iterations.append(model.best_iteration + 1)
+
+        if i < len(folds) - 1 and pruner.should_prune(i, running_scores[-1]):
+            return {'params': params, 'status': 'pruned', 'folds': i + 1, 'score': running_scores[-1]}
+
+    pruner.report(running_scores)
+    return {
+        'params': {**params, 'n_estimators': int(np.median(best_iterations))},
+        'status': 'complete',
+        'folds': len(folds),
+        'score': running_scores[-1],
+    }
+
+def tune(race_data, quali_data, n_trials=TUNING_TRIALS, parallel=None, budget_seconds=TUNING_BUDGET_SECONDS,
+         n_folds=TUNING_FOLDS, seed=42):
+    """Random search over TUNING_SEARCH_SPACE with race-grouped cross-validation.
+
+    `parallel` trials run at once, each training with cpu_count // parallel
+    threads so XGBoost does not oversubscribe the machine. Returns the best
+    parameters (merged over MODEL_PARAMS) and their mean validation MAE, or
+    (None, None) with fewer than two races or when no trial completed within
+    the budget.
+    """
+    data = prepare_tuning_data(race_data, quali_data)
+    if data is None:
+        logger.error("No matching data after merging race and qualifying information!")
+        return None, None
+    X, y, groups, features = data
+
+    n_races = len(np.unique(groups))
+    if n_races < 2:
+        logger.error(f"Need at least 2 races for race-grouped cross-validation, found {n_races}")
+        return None, None
+    n_folds = min(n_folds, n_races)
+    folds = fold_matrices(X, y, GroupKFold(n_splits=n_folds).split(X, y, groups), features)
+    cpus = os.cpu_count() or 1
+    if parallel is None:
+        parallel = cpus
+    parallel = max(1, min(parallel, n_trials))
+    n_jobs = max(1, cpus // parallel)
+    logger.info(f"Tuning on {len(y)} rows: {n_trials} trials, {n_folds} race-grouped folds, "
+                f"{parallel} parallel trial(s) x {n_jobs} thread(s), {budget_seconds}s budget")
+
+    rng = np.random.default_rng(seed)
+    candidates = [sample_params(rng) for _ in range(n_trials)]
+    pruner = TrialPruner()
+    deadline = time.monotonic() + budget_seconds
+
+    def start_trial(params):
+        if time.monotonic() > deadline:
+            return {'params': params, 'status': 'skipped', 'folds': 0}
+        return run_trial(params, folds, n_jobs, pruner, deadline)
+
+    # XGBoost releases the GIL while training, so threads are enough to use every core
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        trials = list(executor.map(start_trial, candidates))
+
+    counts = {status: sum(trial['status'] == status for trial in trials)
+              for status in ('complete', 'pruned', 'timeout', 'skipped')}
+    logger.info(", ".join(f"{count} {status}" for status, count in counts.items()))
+
+    completed = sorted((trial for trial in trials if trial['status'] == 'complete'), key=lambda trial: trial['score'])
+    if not completed:
+        logger.error("No trial completed within the budget")
+        return None, None
+    for trial in completed[:5]:
+        logger.info(f"MAE {trial['score']:.4f}s: {trial['params']}")
+
+    best = completed[0]
+    return {**MODEL_PARAMS, **best['params']}, best['score']
+
+def main():
+    parser = argparse.ArgumentParser(description="Search XGBoost parameters with race-grouped cross-validation.")
+    parser.add_argument('--trials', type=int, default=TUNING_TRIALS, help="parameter sets to try")
+    parser.add_argument('--parallel', type=int, default=None, help="trials run at once (default: one per core)")
+    parser.add_argument('--budget', type=float, default=TUNING_BUDGET_SECONDS, help="wall-clock budget in seconds")
+    parser.add_argument('--folds', type=int, default=TUNING_FOLDS, help="cross-validation folds")
+    parser.add_argument('--seed', type=int, default=42, help="random seed of the search")
+    parser.add_argument('--no-save', action='store_true', help="report the best parameters without saving them")
+    parser.add_argument('--backend', default=SESSION_BACKEND, help="session backend used if the dataset must be built")
+    args = parser.parse_args()
+
+    setup_logging()
+    suppress_warnings()
+    race_data, quali_data = load_or_build_comprehensive_data(backend=args.backend)
+    if race_data is None or quali_data is None:
+        logger.error("Failed to get historical data. Exiting.")
+        return
+
+    start = time.perf_counter()
+    params, score = tune(race_data, quali_data, n_trials=args.trials, parallel=args.parallel,
+                         budget_seconds=args.budget, n_folds=args.folds, seed=args.seed)
+    logger.info(f"Search took {time.perf_counter() - start:.1f}s")
+    if params is None:
+        return
+
+    logger.info(f"Best parameters (MAE {score:.4f}s): {params}")
+    if not args.no_save:
+        save_tuned_params(params, score, description=f"{args.trials} trials, {args.folds}-fold race-grouped CV")
+        logger.info("Saved tuned parameters; new models will be trained with them")
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,10 @@ def get_all_f1_seasons(first_year, current_year=None):
         current_year = datetime.now().year
     return range(first_year, current_year + 1)
 
+def get_circuit_identifier(grand_prix):
+    """Use the first word of a Grand Prix name as its circuit identifier."""
+    return grand_prix.split(' ')[0]
+
 def display_progress(current, total, success_count, interval=10):
     """Display progress information at specified intervals."""
     if current % interval == 0: